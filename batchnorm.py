@@ -45,9 +45,25 @@ class ConvolutionalBatchNormalizer(object):
     """Returns an EWMA apply op that must be invoked after optimization."""
     return self.ewma_trainer.apply([self.mean, self.variance])
 
-  def normalize(self, x, train=True):
-    """Returns a batch-normalized version of x."""
-    if train is not None:
+  def normalize(self, x, train=True, per_example=False, population=False):
+    """Returns a batch-normalized version of x.
+
+    If per_example is set, the statistics are computed over each example in
+    the batch on its own, and the state variables are left untouched. If
+    population is set, the mean and variance state variables are used as the
+    statistics, which is how a trained model is evaluated once its moving
+    averages have been restored into them.
+    """
+    if population:
+      return tf.nn.batch_norm_with_global_normalization(
+          x, self.mean, self.variance, self.beta, self.gamma,
+          self.epsilon, self.scale_after_norm)
+    elif per_example:
+      mean, variance = tf.nn.moments(x, [1, 2], keep_dims=True)
+      return tf.nn.batch_normalization(
+          x, mean, variance, self.beta,
+          self.gamma if self.scale_after_norm else None, self.epsilon)
+    elif train is not None:
       mean, variance = tf.nn.moments(x, [0, 1, 2])
       assign_mean = self.mean.assign(mean)
       assign_variance = self.variance.assign(variance)
@@ -0,0 +1,160 @@
+"""
+Writes training checkpoints without stalling training.
+
+Saving a checkpoint only takes a snapshot of the values of the variables in
+memory, and a background thread writes the snapshot to disk. Each checkpoint
+is written to a temporary directory and renamed into place, so a checkpoint
+that is found on disk is always complete. Checkpoints of a training step are
+named <prefix>-<step>, and only the latest few of them are kept.
+
+Use:
+    writer = CheckpointWriter(var_list)
+    writer.save(sess, 'model/model_red', step)
+    writer.close()
+    (the checkpoints are written and the thread is stopped once it returns).
+"""
+
+import os
+import re
+import shutil
+import tempfile
+import threading
+import tensorflow as tf
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+# The number of step-numbered checkpoints kept for each prefix by default
+KEEP_CHECKPOINTS = 5
+
+# The number of snapshots that can wait to be written before saving blocks
+MAX_PENDING = 1
+
+
+def checkpoint_path(prefix, step):
+    """Returns the path of the checkpoint of the given step."""
+    return '%s-%d' % (prefix, step)
+
+
+def checkpoint_steps(prefix):
+    """Returns the steps of the step-numbered checkpoints with the given
+    prefix that are on disk, in order."""
+    checkpoint_dir = os.path.dirname(prefix) or os.curdir
+    pattern = re.compile(re.escape(os.path.basename(prefix)) + r'-(\d+)$')
+    if not os.path.isdir(checkpoint_dir):
+        return []
+
+    steps = []
+    for name in os.listdir(checkpoint_dir):
+        match = pattern.match(name)
+        if match:
+            steps.append(int(match.group(1)))
+    return sorted(steps)
+
+
+def saved_step(path, step_name='global_step'):
+    """Returns the global step saved in the given checkpoint, or None if it was
+    saved without one."""
+    reader = tf.train.NewCheckpointReader(path)
+    if not reader.has_tensor(step_name):
+        return None
+    return int(reader.get_tensor(step_name))
+
+
+def latest_checkpoint(prefix):
+    """Returns the checkpoint with the given prefix that was saved at the
+    latest global step, which is either the latest step-numbered checkpoint
+    or the final one saved to the prefix itself, or None if there is none."""
+    paths = [checkpoint_path(prefix, step) for step in
+            checkpoint_steps(prefix)]
+    if os.path.isfile(prefix):
+        paths.append(prefix)
+    if not paths:
+        return None
+    return max(paths, key=lambda path: saved_step(path) or 0)
+
+
+class CheckpointWriter(object):
+    """Saves checkpoints of the given variables from a background thread.
+
+    The var_list maps the names to save the variables under to the variables,
+    like the var_list of a tf.train.Saver. The snapshots are written through a
+    Saver in a graph of its own, so the checkpoints restore like any other.
+    """
+
+    def __init__(self, var_list, keep=KEEP_CHECKPOINTS):
+        names = sorted(var_list)
+        self.variables = [var_list[name] for name in names]
+        self.keep = keep
+
+        # The graph holding a copy of each variable, which is initialized with
+        # the values of a snapshot before it is saved
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            self.values = [tf.placeholder(var.dtype.base_dtype,
+                    var.get_shape()) for var in self.variables]
+            copies = [tf.Variable(value) for value in self.values]
+            self.init_op = tf.variables_initializer(copies)
+            self.saver = tf.train.Saver(dict(zip(names, copies)),
+                    max_to_keep=0, write_version=tf.train.SaverDef.V1)
+        self.graph.finalize()
+        self.sess = tf.Session(graph=self.graph)
+
+        self.snapshots = queue.Queue(MAX_PENDING)
+        self.error = None
+        self.thread = threading.Thread(target=self._write_snapshots)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def save(self, sess, prefix, step=None):
+        """Takes a snapshot of the variables in the given session, and queues it
+        to be written to the given path, or to the checkpoint of the given step
+        with the given prefix. Returns the path the checkpoint is written to."""
+        self._raise_error()
+        path = prefix if step is None else checkpoint_path(prefix, step)
+        self.snapshots.put((sess.run(self.variables), path, prefix, step))
+        return path
+
+    def close(self):
+        """Writes the queued snapshots, and stops the background thread."""
+        self.snapshots.put(None)
+        self.thread.join()
+        self.sess.close()
+        self._raise_error()
+
+    def _raise_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def _write_snapshots(self):
+        while True:
+            snapshot = self.snapshots.get()
+            if snapshot is None:
+                return
+            try:
+                self._write(*snapshot)
+            except Exception as error:
+                self.error = error
+
+    def _write(self, values, path, prefix, step):
+        # Write the checkpoint next to its final path, and move it into place
+        checkpoint_dir = os.path.dirname(path) or os.curdir
+        if not os.path.exists(checkpoint_dir):
+            os.makedirs(checkpoint_dir)
+        temp_dir = tempfile.mkdtemp(prefix='.checkpoint', dir=checkpoint_dir)
+        try:
+            self.sess.run(self.init_op,
+                    feed_dict=dict(zip(self.values, values)))
+            temp_path = os.path.join(temp_dir, os.path.basename(path))
+            self.saver.save(self.sess, temp_path, write_meta_graph=False)
+            os.rename(temp_path, path)
+        finally:
+            shutil.rmtree(temp_dir)
+
+        # Remove the step-numbered checkpoints beyond the latest ones
+        if step is not None and self.keep:
+            for old_step in checkpoint_steps(prefix)[:-self.keep]:
+                os.remove(checkpoint_path(prefix, old_step))
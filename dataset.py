@@ -0,0 +1,155 @@
+"""
+The layout of the training dataset, shared by the preprocessing scripts and
+training.
+
+The images are resized to IMAGE_SIZE x IMAGE_SIZE, and sorted into a color bin
+per ensemble model by their dominant color. The bins are recorded in a CSV
+manifest, with a row per color image holding its path, its bin, and the sums
+of its color channels.
+
+For training, the resized images of each bin can be packed into shard files of
+fixed-size uint8 records, which training reads without decoding, and which
+several training processes share through the page cache.
+"""
+
+import csv
+import json
+import os
+import numpy as np
+from PIL import Image
+
+# The color bins that the images are sorted into, one per ensemble model
+RED_BIN = 'red'
+GREEN_BIN = 'green'
+BLUE_BIN = 'blue'
+BLUE_GREEN_BIN = 'blue_green'
+COLOR_BINS = [RED_BIN, GREEN_BIN, BLUE_BIN, BLUE_GREEN_BIN]
+
+# The size that the images are resized to for training, which is larger than
+# the network's input so that training can take random crops of it
+IMAGE_SIZE = 256
+
+# The quality that resized images are saved at
+JPEG_QUALITY = 92
+
+# The number of images packed into each shard file
+SHARD_RECORDS = 1024
+
+# The name of the manifest in a sorted dataset directory, and its columns
+MANIFEST_NAME = 'manifest.csv'
+MANIFEST_FIELDS = ['path', 'bin', 'red_sum', 'green_sum', 'blue_sum']
+
+
+def write_manifest(manifest_path, rows):
+    """Writes the given rows, which are dictionaries with MANIFEST_FIELDS as
+    keys, to the manifest at the given path."""
+    with open(manifest_path, 'w') as manifest_file:
+        writer = csv.DictWriter(manifest_file, MANIFEST_FIELDS)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+
+
+def read_manifest(manifest_path, color_bin=None):
+    """Returns the rows of the manifest at the given path, keeping only the
+    images in the given color bin if one is given."""
+    with open(manifest_path) as manifest_file:
+        return [row for row in csv.DictReader(manifest_file)
+                if color_bin is None or row['bin'] == color_bin]
+
+
+def load_resized(image_path, size=IMAGE_SIZE):
+    """Decodes the image at the given path as an RGB PIL image resized to
+    size x size, ignoring its aspect ratio.
+
+    Large JPEGs are decoded at a reduced scale by the decoder itself, skipping
+    most of the work of decoding them at full size, as long as the reduced
+    image is still at least size x size.
+    """
+    image = Image.open(image_path)
+    image.draft('RGB', (size, size))
+    return image.convert('RGB').resize((size, size), Image.LANCZOS)
+
+
+def save_resized(image, output_path):
+    """Saves the given resized PIL image as a JPEG to the given path."""
+    image.save(output_path, 'JPEG', quality=JPEG_QUALITY)
+
+
+def find_images(paths):
+    """Yields the given image files, and the JPEG images under the given
+    directories, in sorted order within each directory."""
+    for image_path in paths:
+        if not os.path.isdir(image_path):
+            yield image_path
+            continue
+        for dir_path, _, file_names in os.walk(image_path, followlinks=True):
+            for file_name in sorted(file_names):
+                if file_name.endswith('.jpg'):
+                    yield os.path.join(dir_path, file_name)
+
+
+def shard_index_path(shard_dir, color_bin):
+    """Returns the path of the index of the given color bin's shards."""
+    return os.path.join(shard_dir, color_bin + '.index')
+
+
+def read_shard_index(shard_dir, color_bin):
+    """Returns the image size of the given color bin's shards, and the list of
+    the paths of its shard files with the number of records in each."""
+    with open(shard_index_path(shard_dir, color_bin)) as index_file:
+        index = json.load(index_file)
+    shards = [(os.path.join(shard_dir, name), num_records)
+              for name, num_records in index['shards']]
+    return index['size'], shards
+
+
+class ShardWriter(object):
+    """Packs the images of a color bin into shard files.
+
+    Every image is a fixed-size record of its raw uint8 RGB pixels, and each
+    shard file holds up to shard_records of them. The index of the shards is
+    written when the writer is closed.
+
+    Use:
+        writer = ShardWriter(shard_dir, 'red')
+        writer.write(image)
+        writer.close()
+    """
+
+    def __init__(self, shard_dir, color_bin, size=IMAGE_SIZE,
+                 shard_records=SHARD_RECORDS):
+        self.shard_dir = shard_dir
+        self.color_bin = color_bin
+        self.size = size
+        self.shard_records = shard_records
+        self.shards = []
+        self.shard_file = None
+
+    def _next_shard(self):
+        if self.shard_file is not None:
+            self.shard_file.close()
+        name = '%s-%05d.shard' % (self.color_bin, len(self.shards))
+        self.shard_file = open(os.path.join(self.shard_dir, name), 'wb')
+        self.shards.append([name, 0])
+
+    def write(self, image):
+        """Appends the given size x size x 3 uint8 image to the shards."""
+        if image.shape != (self.size, self.size, 3):
+            raise ValueError("Expected a {0}x{0}x3 image, got shape {1}".format(
+                self.size, image.shape))
+        if self.shard_file is None or self.shards[-1][1] == self.shard_records:
+            self._next_shard()
+        self.shard_file.write(np.ascontiguousarray(image, np.uint8).tobytes())
+        self.shards[-1][1] += 1
+
+    def close(self):
+        """Finishes the last shard, and writes the index of the shards."""
+        if self.shard_file is not None:
+            self.shard_file.close()
+            self.shard_file = None
+
+        index_path = shard_index_path(self.shard_dir, self.color_bin)
+        with open(index_path + '.tmp', 'w') as index_file:
+            json.dump({'size': self.size, 'shards': self.shards}, index_file)
+        os.rename(index_path + '.tmp', index_path)
@@ -0,0 +1,142 @@
+"""
+Synchronous data-parallel training across several processes.
+
+The variables are held by parameter server processes, and every worker process
+builds the same training graph over its own part of the training images. On
+every step, each worker computes the gradients of its batch and stores them on
+the parameter server. Once the gradients of all of the workers are in, the
+chief worker applies their average to the shared variables, and then lets
+every worker move on to the next step, so all of the workers always train the
+same weights.
+
+Use:
+    cluster = cluster_spec(ps_hosts, worker_hosts)
+    server = tf.train.Server(cluster, job_name, task_index)
+    with tf.device(device_setter(cluster, task_index)):
+        (build the training graph)
+        sync = SyncGradients(optimizer, grads_and_vars, global_step,
+                             task_index, num_workers)
+    sess = tf.Session(server.target)
+    sync.initialize(sess, init_op)
+    results = sync.run(sess, fetches, feed_dict)
+"""
+
+import time
+import tensorflow as tf
+
+# The job names of the processes in a training cluster
+PS_JOB = 'ps'
+WORKER_JOB = 'worker'
+
+# The device that holds the gradients of the workers and the step barrier
+SYNC_DEVICE = '/job:%s/task:0' % PS_JOB
+
+# The collection of the variables holding the gradients of the workers, which
+# are left out of the global variables, so they are never checkpointed
+SYNC_VARIABLES = 'sync_variables'
+
+# How long a worker waits between checks that the chief has initialized the
+# variables, in seconds
+INITIALIZE_POLL_SECS = 1.0
+
+
+def cluster_spec(ps_hosts, worker_hosts):
+    """Returns the spec of the cluster with the given lists of host:port
+    addresses of its parameter servers and workers."""
+    return tf.train.ClusterSpec({PS_JOB: ps_hosts, WORKER_JOB: worker_hosts})
+
+
+def device_setter(cluster, task_index):
+    """Returns the device function that places the variables on the parameter
+    servers, and everything else on the worker with the given index."""
+    return tf.train.replica_device_setter(
+        worker_device='/job:%s/task:%d' % (WORKER_JOB, task_index),
+        cluster=cluster)
+
+
+def shard(items, task_index, num_workers):
+    """Returns the part of the given list of files that the worker with the
+    given index trains on."""
+    return items[task_index::num_workers]
+
+
+class SyncGradients(object):
+    """Averages the gradients of all of the workers before applying them.
+
+    Every worker has its own copy of the gradients on the parameter server.
+    Running a step assigns the worker's gradients to its copy and adds a token
+    to the ready queue. The chief then takes a token from every worker, applies
+    the average of all of the copies, and adds a token per worker to the go
+    queue, which each worker takes before its next step. The queues are shared
+    by name on the parameter server, so they are the same in every worker.
+    """
+
+    def __init__(self, optimizer, grads_and_vars, global_step, task_index,
+            num_workers, chief_ops=None):
+        self.is_chief = task_index == 0
+        grads_and_vars = [(grad, var) for grad, var in grads_and_vars
+                if grad is not None]
+
+        with tf.device(SYNC_DEVICE), tf.name_scope('sync_gradients'):
+            # The copies of the gradients of each worker, indexed by worker
+            self.gradients = []
+            for worker in range(num_workers):
+                self.gradients.append([tf.Variable(tf.zeros(var.get_shape()),
+                        trainable=False, collections=[SYNC_VARIABLES],
+                        name='worker_%d' % worker)
+                        for _, var in grads_and_vars])
+
+            ready = tf.FIFOQueue(num_workers, [tf.bool], shapes=[[]],
+                    shared_name='sync_ready', name='ready')
+            go = tf.FIFOQueue(num_workers, [tf.bool], shapes=[[]],
+                    shared_name='sync_go', name='go')
+
+        # Store this worker's gradients and tell the chief they are in. The
+        # chief also runs the given ops once its gradients are computed.
+        assigns = [copy.assign(grad) for copy, (grad, _) in
+                zip(self.gradients[task_index], grads_and_vars)]
+        if self.is_chief and chief_ops:
+            with tf.control_dependencies(assigns):
+                assigns = [tf.group(*chief_ops)]
+        with tf.control_dependencies(assigns):
+            self.push = ready.enqueue(True)
+
+        # Apply the average of the workers' gradients, and release the workers
+        with tf.control_dependencies([ready.dequeue_many(num_workers)]):
+            averages = [tf.add_n([tf.identity(copies[i]) for copies in
+                    self.gradients]) / num_workers
+                    for i in range(len(grads_and_vars))]
+        apply_op = optimizer.apply_gradients(
+                [(average, var) for average, (_, var) in
+                zip(averages, grads_and_vars)], global_step=global_step)
+        with tf.control_dependencies([apply_op]):
+            self.apply = go.enqueue_many(tf.fill([num_workers], True))
+
+        self.wait = go.dequeue()
+
+        self.init_op = tf.variables_initializer(
+                tf.get_collection(SYNC_VARIABLES))
+        self.uninitialized = tf.report_uninitialized_variables(
+                tf.global_variables())
+
+    def initialize(self, sess, init_op):
+        """Initializes the variables with the given op on the chief, while the
+        other workers wait for it to finish."""
+        if self.is_chief:
+            sess.run(self.init_op)
+            sess.run(init_op)
+            return
+
+        while len(sess.run(self.uninitialized)) > 0:
+            print("Waiting for the chief worker to initialize the variables")
+            time.sleep(INITIALIZE_POLL_SECS)
+
+    def run(self, sess, fetches, feed_dict=None):
+        """Runs a synchronous training step, which computes this worker's
+        gradients along with the given fetches, and returns their values once
+        the average gradients of all of the workers are applied."""
+        results = sess.run([self.push, fetches], feed_dict=feed_dict)[1]
+        if self.is_chief:
+            sess.run(self.apply)
+        sess.run(self.wait)
+        return results
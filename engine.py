@@ -0,0 +1,609 @@
+"""
+The colorization engine, which keeps the ensemble of color-biased colornet
+models loaded in memory, and runs them over images on request.
+
+Use:
+    engine = ColorizationEngine(MODEL_DIR, SAT_WEIGHTS)
+    result = engine.colorize('image.jpg')
+    (result.combined is the recombined output of the ensemble).
+"""
+
+import os
+import numpy as np
+import tensorflow as tf
+from tensorflow.python.framework import graph_util
+from freeze import optimize_for_inference
+from model import (BATCHNORM_STATISTICS, EXAMPLE_STATS, POPULATION_STATS,
+        VGG_LAYERS, VGG_MODEL_PATH, colornet, colornet_weights, load_graph_def,
+        load_vgg, rgb2yuv, vgg_features, yuv2rgb)
+from profiler import profile_stage
+from quantize import FLOAT32
+from tiles import TILE_BUDGET, TILE_OVERLAP, blend_tiles
+
+# The color-biased models that make up the ensemble, in the order they are run
+ENSEMBLE_COLORS = ['red', 'green', 'blue', 'blue_green']
+
+# How each biased model's saturations are weighted relative to the others
+SAT_WEIGHTS = {
+    'red': 1 / 8.0,
+    'green': 7 / 32.0,
+    'blue': 7 / 32.0,
+    'blue_green': 7 / 16.0,
+}
+
+# The default number of images run through the ensemble at once
+BATCH_SIZE = 1
+
+# The directory that training saves the models of the ensemble into, and that
+# the frozen ensembles are exported into, by default
+MODEL_DIR = 'model'
+
+# The names of the input of the frozen ensemble and of the scope of its VGG16
+# trunk, where each model's chroma is <color>/chroma
+ENSEMBLE_INPUT = 'grayscale'
+VGG_SCOPE = 'vgg'
+
+
+def frozen_ensemble_path(model_dir, precision):
+    """Returns the path of the frozen ensemble of the given precision in the
+    given model directory."""
+    return os.path.join(model_dir, 'ensemble_%s.pb' % precision)
+
+
+def ensemble_outputs(colors):
+    """Returns the names of the output nodes of the frozen ensemble of the
+    given colors, which are the VGG16 features and the chroma of each model."""
+    return (['%s/%s/Relu' % (VGG_SCOPE, layer) for layer in VGG_LAYERS] +
+            ['%s/chroma' % color for color in colors])
+
+
+def concat_images(imga, imgb):
+    """
+    Combines two color image ndarrays side-by-side.
+    """
+    ha, wa = imga.shape[:2]
+    hb, wb = imgb.shape[:2]
+    max_height = np.max([ha, hb])
+    total_width = wa + wb
+    new_img = np.zeros(shape=(max_height, total_width, 3), dtype=np.float32)
+    new_img[:ha, :wa] = imga
+    new_img[:hb, wa:wa + wb] = imgb
+    return new_img
+
+
+def recombine(predictions, weights):
+    """
+    Combines the output images from the color-biased CNN's into final output
+    images. Recombination is done by pixel-wise weighting, where the pixel
+    value for any given CNN's output is weighted as its relative saturation to
+    the others, scaled by that CNN's weight.
+
+    The predictions are stacked into a single (heads, B, H, W, 3) RGB tensor,
+    and the weights are given in the same order as the heads, so the whole
+    ensemble is recombined in one pass.
+    """
+    # Compute the pixel-wise HSV saturation for each biased CNN output image,
+    # where black pixels have no saturation
+    max_channel = tf.reduce_max(predictions, [4])
+    min_channel = tf.reduce_min(predictions, [4])
+    sats = (max_channel - min_channel) / tf.maximum(max_channel, 1e-12)
+    sats = sats * tf.reshape(tf.constant(weights, dtype=tf.float32),
+            [-1, 1, 1, 1])
+
+    # Weight each CNN-bias by its relative saturations at each pixel
+    sat_weights = sats / tf.reduce_sum(sats, [0], keep_dims=True)
+
+    # Compute the output image as the pixel-wise weighted sum of the biases
+    return tf.reduce_sum(tf.expand_dims(sat_weights, 4) * predictions, [0])
+
+
+class Colorization(object):
+    """The result of running the ensemble over a single image.
+
+    All of the images are 224x224x3 float ndarrays with values in [0, 1], or
+    HxWx3 at the full size of the image once upsampled. The predictions map
+    each ensemble color to the output of its biased model.
+    """
+
+    def __init__(self, grayscale, original, predictions, combined):
+        self.grayscale = grayscale
+        self.original = original
+        self.predictions = predictions
+        self.combined = combined
+
+    def composite(self, color=None):
+        """Returns the grayscale, result, and original images concatenated
+        together, where the result is the given color's prediction, or the
+        combined output if no color is given."""
+        output = self.combined if color is None else self.predictions[color]
+        output_image = concat_images(self.grayscale, output)
+        return concat_images(output_image, self.original)
+
+
+def moving_average_name(names, var_name):
+    """Returns the name of the moving average of the named variable among the
+    given checkpoint variable names. The moving averages are created under the
+    scope of their variable, so that scope ends up in their names twice."""
+    suffix = var_name + '/ExponentialMovingAverage'
+    for name in sorted(names):
+        if name == suffix or name.endswith('/' + suffix):
+            return name
+    raise ValueError("The checkpoint has no moving average of '{}'".format(
+            var_name))
+
+
+def restore_scope(sess, scope, model_path, population=False):
+    """Restores the variables under the given scope from a checkpoint that was
+    saved from a graph without that scope.
+
+    If population is set, the batch normalization statistics are restored from
+    their moving averages, rather than from the statistics of the last training
+    batch. Returns the Saver, which restores the same variables into another
+    session."""
+    prefix = scope + '/'
+    var_list = dict((var.op.name[len(prefix):], var) for var in
+            tf.global_variables() if var.op.name.startswith(prefix))
+
+    if population:
+        names = tf.train.NewCheckpointReader(
+                model_path).get_variable_to_shape_map()
+        for var in tf.get_collection(BATCHNORM_STATISTICS, scope=prefix):
+            var_name = var.op.name[len(prefix):]
+            del var_list[var_name]
+            var_list[moving_average_name(names, var_name)] = var
+
+    saver = tf.train.Saver(var_list)
+    saver.restore(sess, model_path)
+    return saver
+
+
+class ImagePipeline(object):
+    """The preprocessing and postprocessing around the ensemble models.
+
+    The operations are built once, when the pipeline is created, and are fed
+    through placeholders afterwards, so running images through the pipeline
+    never adds nodes to the graph. Every operation works on a batch of images.
+
+    Full-size images are decoded one at a time, since their sizes differ. Their
+    color comes from the 224x224 outputs, whose chroma is upsampled to the
+    full size and combined with the full-size luminance.
+
+    Use:
+        pipeline = ImagePipeline(sess)
+        original, grayscale_rgb, luma = pipeline.preprocess([contents])
+        rgb = pipeline.postprocess(luma, chroma)
+        original, grayscale_rgb, luma = pipeline.preprocess_full(contents)
+        rgb = pipeline.upsample(luma, outputs)
+        resized = pipeline.resize(pixels)
+        rgb = pipeline.recolor(pixels, chroma)
+    """
+
+    def __init__(self, sess):
+        self.sess = sess
+
+        with sess.graph.as_default(), tf.name_scope('pipeline'):
+            # Encoded JPEG bytes in, resized color and grayscale images out
+            self.contents = tf.placeholder(tf.string, shape=[None],
+                    name='contents')
+            self.original = tf.map_fn(self._decode, self.contents,
+                    dtype=tf.float32)
+
+            grayscale = tf.image.rgb_to_grayscale(self.original)
+            self.grayscale_rgb = tf.image.grayscale_to_rgb(grayscale)
+            self.luma = tf.split(3, 3, rgb2yuv(self.grayscale_rgb))[0]
+
+            # Luminance and predicted chroma in, RGB images out
+            self.luma_in = tf.placeholder(tf.float32,
+                    shape=[None, 224, 224, 1], name='luma')
+            self.chroma_in = tf.placeholder(tf.float32,
+                    shape=[None, 224, 224, 2], name='chroma')
+            self.rgb = yuv2rgb(tf.concat(3, [self.luma_in, self.chroma_in]))
+
+            # Encoded JPEG bytes in, a color and grayscale image of its full
+            # size out
+            self.full_contents = tf.placeholder(tf.string, shape=[],
+                    name='full_contents')
+            self.full_original = tf.expand_dims(tf.div(tf.cast(
+                    tf.image.decode_jpeg(self.full_contents, channels=3),
+                    tf.float32), 255), 0)
+            full_grayscale = tf.image.rgb_to_grayscale(self.full_original)
+            self.full_grayscale_rgb = tf.image.grayscale_to_rgb(full_grayscale)
+            self.full_luma = tf.split(3, 3,
+                    rgb2yuv(self.full_grayscale_rgb))[0]
+
+            # Full-size luminance and 224x224 RGB outputs in, the outputs at
+            # the size of the luminance out
+            self.full_luma_in = tf.placeholder(tf.float32,
+                    shape=[1, None, None, 1], name='full_luma')
+            self.outputs_in = tf.placeholder(tf.float32,
+                    shape=[None, 224, 224, 3], name='outputs')
+            chroma = tf.concat(3, tf.split(3, 3, rgb2yuv(self.outputs_in))[1:])
+            chroma = tf.image.resize_bilinear(chroma,
+                    tf.shape(self.full_luma_in)[1:3])
+            luma = tf.tile(self.full_luma_in, [tf.shape(chroma)[0], 1, 1, 1])
+            self.full_rgb = yuv2rgb(tf.concat(3, [luma, chroma]))
+
+            # uint8 RGB images of any size in, resized to 224x224 for the
+            # models out
+            self.pixels_in = tf.placeholder(tf.uint8,
+                    shape=[None, None, None, 3], name='pixels')
+            self.resized = tf.div(tf.image.resize_images(self.pixels_in,
+                    (224, 224)), 255)
+
+            # The same images and chroma of any size in, the images recolored
+            # with that chroma, resized to their size, out
+            self.pixels_chroma_in = tf.placeholder(tf.float32,
+                    shape=[None, None, None, 2], name='pixels_chroma')
+            pixels_luma = tf.split(3, 3, rgb2yuv(tf.image.grayscale_to_rgb(
+                    tf.image.rgb_to_grayscale(tf.div(tf.cast(self.pixels_in,
+                    tf.float32), 255)))))[0]
+            pixels_chroma = tf.image.resize_bilinear(self.pixels_chroma_in,
+                    tf.shape(self.pixels_in)[1:3])
+            self.recolored = yuv2rgb(tf.concat(3, [pixels_luma,
+                    pixels_chroma]))
+
+    @staticmethod
+    def _decode(contents):
+        uint8image = tf.image.decode_jpeg(contents, channels=3)
+        return tf.div(tf.image.resize_images(uint8image, (224, 224)), 255)
+
+    def preprocess(self, contents):
+        """Decodes the given list of JPEG bytes, returning the resized original
+        images, their grayscale versions (which are the input to the models),
+        and their luminance."""
+        return self.sess.run([self.original, self.grayscale_rgb, self.luma],
+                feed_dict={self.contents: contents})
+
+    def postprocess(self, luma, chroma):
+        """Combines the given luminance and predicted chroma, which have the
+        same leading batch dimension, into RGB images."""
+        return self.sess.run(self.rgb,
+                feed_dict={self.luma_in: luma, self.chroma_in: chroma})
+
+    def preprocess_full(self, contents):
+        """Decodes the given JPEG bytes at their full size, returning the
+        original image, its grayscale version, and its luminance, each with a
+        leading batch dimension of one."""
+        return self.sess.run([self.full_original, self.full_grayscale_rgb,
+                self.full_luma], feed_dict={self.full_contents: contents})
+
+    def upsample(self, luma, outputs):
+        """Combines the given full-size luminance with the chroma of the given
+        224x224 RGB outputs, upsampled to its size, into full-size RGB
+        images."""
+        return self.sess.run(self.full_rgb,
+                feed_dict={self.full_luma_in: luma, self.outputs_in: outputs})
+
+    def resize(self, pixels):
+        """Resizes the given uint8 RGB images, which have the same size, to
+        the 224x224 float images that the models take."""
+        return self.sess.run(self.resized, feed_dict={self.pixels_in: pixels})
+
+    def recolor(self, pixels, chroma):
+        """Combines the luminance of the given uint8 RGB images with the given
+        chroma, which is resized to their size, into RGB images."""
+        return self.sess.run(self.recolored, feed_dict={
+                self.pixels_in: pixels, self.pixels_chroma_in: chroma})
+
+
+class ColorizationEngine(object):
+    """Holds the ensemble of color-biased models in a single session.
+
+    The models share a single VGG16 trunk, and only differ in their colornet
+    heads. Every head is built once under its own variable scope (named after
+    its color), and restored from its checkpoint when the engine is created, so
+    colorizing an image does not touch the checkpoints on disk again. The
+    models are fed the grayscale images straight from the pipeline, and take
+    batches of any number of images.
+
+    By default, batch normalization uses the statistics of each image, which
+    matches models trained one image at a time. Models trained with larger
+    batches are run with moving_averages set, which normalizes with the moving
+    averages of the statistics kept by training.
+
+    With a Profiler, the stages of the ensemble are run one at a time, so each
+    of them is timed on its own: reading and decoding the images, restoring the
+    models, the VGG16 trunk, the colornet heads, and the recombination.
+
+    With frozen set, or a precision other than FLOAT32, the ensemble is
+    loaded from the frozen ensemble of that precision in the model directory,
+    which scripts/freeze_ensemble.py and scripts/quantize_ensemble.py export,
+    rather than from the checkpoints. The VGG16 model and moving_averages are
+    then not used, since they are part of the frozen ensemble.
+
+    Given a graph_def, the frozen ensemble is imported from it rather than
+    from the model directory, which is how an ensemble restored from its
+    checkpoints is turned into a frozen one in memory (see frozen_graph_def).
+
+    A session does not survive a fork, so a process forked from the one that
+    created the engine calls reopen before using it. The graph, which is built
+    and finalized before the fork, is inherited from the parent, but every
+    session holds its own copy of the weights, frozen or not. The sessions run
+    ops with num_threads threads, or one per core if it is zero, so that
+    several processes can split the cores between them.
+    """
+
+    def __init__(self, model_dir, sat_weights=SAT_WEIGHTS,
+            ensemble_colors=ENSEMBLE_COLORS, vgg_model_path=VGG_MODEL_PATH,
+            moving_averages=False, profiler=None, precision=FLOAT32,
+            frozen=False, graph_def=None, num_threads=0):
+        self.sat_weights = sat_weights
+        self.profiler = profiler
+        self.precision = precision
+        self.frozen = frozen or precision != FLOAT32 or graph_def is not None
+        self.num_threads = num_threads
+        self.colors = list(ensemble_colors)
+        self.graph = tf.Graph()
+        self.sess = self._open_session()
+        self.pipeline = ImagePipeline(self.sess)
+
+        # The chroma predicted by each model, keyed by its color, and the
+        # Savers that restored the models from their checkpoints
+        self.predictions = dict()
+        self.restores = []
+
+        with self.graph.as_default():
+            # The models take the grayscale images through an identity, which
+            # becomes the input of the frozen ensemble
+            grayscale = tf.identity(self.pipeline.grayscale_rgb,
+                    name=ENSEMBLE_INPUT)
+            if self.frozen:
+                self._import_ensemble(model_dir, grayscale, graph_def)
+            else:
+                self._restore_ensemble(model_dir, grayscale, vgg_model_path,
+                        moving_averages)
+
+            # Convert the chroma of every head back to RGB in a single pass,
+            # and recombine them into the final output images
+            num_heads = len(self.colors)
+            chroma = tf.pack([self.predictions[color] for color in
+                    self.colors])
+            luma = tf.tile(tf.expand_dims(self.pipeline.luma, 0),
+                    [num_heads, 1, 1, 1, 1])
+            pred_yuv = tf.reshape(tf.concat(4, [luma, chroma]),
+                    [-1, 224, 224, 3])
+            self.pred_rgb = tf.reshape(yuv2rgb(pred_yuv),
+                    [num_heads, -1, 224, 224, 3])
+            self.combined = recombine(self.pred_rgb,
+                    [self.sat_weights[color] for color in self.colors])
+            self.combined_chroma = tf.concat(3,
+                    tf.split(3, 3, rgb2yuv(self.combined))[1:])
+
+        # Nothing is added to the graph after the models are loaded
+        self.graph.finalize()
+
+    def _restore_ensemble(self, model_dir, grayscale, vgg_model_path,
+            moving_averages):
+        # The VGG16 trunk is frozen, and so the same for every model, so its
+        # features are computed once and shared by all of the colornet heads
+        with profile_stage(self.profiler, 'load'):
+            graph_def = load_vgg(vgg_model_path)
+        stats = POPULATION_STATS if moving_averages else EXAMPLE_STATS
+        self.features = vgg_features(graph_def, grayscale, name=VGG_SCOPE)
+        for color in self.colors:
+            with tf.variable_scope(color):
+                tensors = dict(self.features)
+                tensors["grayscale"] = grayscale
+                tensors["weights"] = colornet_weights()
+                self.predictions[color] = tf.identity(
+                        colornet(tensors, None, stats), name='chroma')
+
+            model_path = os.path.join(model_dir, 'model_%s' % color)
+            print("Restoring the {}-biased colornet model from '{}'".format(
+                    color, model_path))
+            with profile_stage(self.profiler, 'restore'):
+                saver = restore_scope(self.sess, color, model_path,
+                        moving_averages)
+            self.restores.append((saver, model_path))
+
+    def _open_session(self):
+        # The session runs its own thread pools, rather than the ones shared
+        # by the process, so a process forked from this one does not depend
+        # on threads that it does not have
+        return tf.Session(graph=self.graph, config=tf.ConfigProto(
+                use_per_session_threads=True,
+                intra_op_parallelism_threads=self.num_threads,
+                inter_op_parallelism_threads=self.num_threads))
+
+    def reopen(self, num_threads=None):
+        """Opens a new session over the graph of the engine, running ops with
+        the given number of threads if one is given. Models restored from
+        their checkpoints are restored into it again, while a frozen ensemble
+        is part of the graph, and needs nothing more, though the session
+        allocates its own copy of its weights. The old session is left open,
+        since it is the one of the parent process when this is called after a
+        fork, and cannot be shut down without its threads."""
+        if num_threads is not None:
+            self.num_threads = num_threads
+        self.parent_sess = self.sess
+        self.sess = self._open_session()
+        self.pipeline.sess = self.sess
+        for saver, model_path in self.restores:
+            with profile_stage(self.profiler, 'restore'):
+                saver.restore(self.sess, model_path)
+
+    def _import_ensemble(self, model_dir, grayscale, graph_def=None):
+        with profile_stage(self.profiler, 'restore'):
+            if graph_def is None:
+                graph_def_path = frozen_ensemble_path(model_dir,
+                        self.precision)
+                print("Loading the {} ensemble from '{}'".format(
+                        self.precision, graph_def_path))
+                graph_def = load_graph_def(graph_def_path)
+            outputs = tf.import_graph_def(graph_def,
+                    input_map={ENSEMBLE_INPUT: grayscale},
+                    return_elements=['%s:0' % name for name in
+                    ensemble_outputs(self.colors)], name='ensemble')
+        self.features = dict(zip(VGG_LAYERS, outputs))
+        self.predictions = dict(zip(self.colors, outputs[len(VGG_LAYERS):]))
+
+    def frozen_graph_def(self):
+        """Returns the float32 ensemble as a GraphDef with its weights frozen
+        into constants, and optimized for inference. It takes the grayscale
+        images as its ENSEMBLE_INPUT, and its outputs are named by
+        ensemble_outputs."""
+        if self.frozen:
+            raise ValueError("Only an ensemble restored from its checkpoints "
+                    "can be frozen")
+
+        # Cut the ensemble off from the image pipeline at its input
+        output_names = ensemble_outputs(self.colors)
+        graph_def = graph_util.convert_variables_to_constants(self.sess,
+                self.graph.as_graph_def(), output_names)
+        for node in graph_def.node:
+            if node.name == ENSEMBLE_INPUT:
+                node.op = 'Placeholder'
+                del node.input[:]
+                node.attr.clear()
+                node.attr['dtype'].type = tf.float32.as_datatype_enum
+                node.attr['shape'].shape.CopyFrom(
+                        tf.TensorShape([None, 224, 224, 3]).as_proto())
+        return optimize_for_inference(graph_def, output_names)
+
+    def colorize(self, image_path, full_size=False, colors=None):
+        """Runs the ensemble over the given JPEG image, returning the
+        Colorization of it, at the full size of the image if full_size is
+        set, with only the predictions of the given colors (see upsample)."""
+        with profile_stage(self.profiler, 'read'):
+            with open(image_path, 'rb') as image_file:
+                contents = image_file.read()
+        return self.colorize_contents(contents, full_size, colors)
+
+    def colorize_contents(self, contents, full_size=False, colors=None):
+        """Runs the ensemble over the given encoded JPEG bytes, returning the
+        Colorization of them, at the full size of the image if full_size is
+        set, with only the predictions of the given colors (see upsample)."""
+        result = self.colorize_batch([contents])[0]
+        if full_size:
+            result = self.upsample(result, contents, colors)
+        return result
+
+    def upsample(self, colorization, contents, colors=None):
+        """Returns the given Colorization of the given encoded JPEG bytes at
+        the full size of the image. The ensemble only runs at 224x224, so the
+        chroma of its outputs is upsampled to the full size, and combined with
+        the luminance of the full-size image. Only the predictions of the
+        given colors are upsampled, which are all of them by default."""
+        colors = self.colors if colors is None else list(colors)
+        with profile_stage(self.profiler, 'upsample'):
+            original, grayscale_rgb, luma = self.pipeline.preprocess_full(
+                    contents)
+
+            # Upsample one output at a time, which bounds the memory used to
+            # a single full-size image per output
+            outputs = [colorization.combined] + [
+                    colorization.predictions[color] for color in colors]
+            outputs = [self.pipeline.upsample(luma, [output])[0] for output in
+                    outputs]
+        return Colorization(grayscale_rgb[0], original[0],
+                dict(zip(colors, outputs[1:])), outputs[0])
+
+    def colorize_batch(self, contents):
+        """Runs the ensemble over the given list of encoded JPEG images as a
+        single batch, returning the list of their Colorizations."""
+        # Decode the batch, and run all of the biased models over it at once
+        pipeline = self.pipeline
+        with profile_stage(self.profiler, 'colorize', len(contents)):
+            if self.profiler is None:
+                img, grayscale_rgb_, pred_rgb_, combined_ = self.sess.run(
+                        [pipeline.original, pipeline.grayscale_rgb,
+                        self.pred_rgb, self.combined],
+                        feed_dict={pipeline.contents: contents})
+            else:
+                img, grayscale_rgb_, pred_rgb_, combined_ = (
+                        self._colorize_stages(contents))
+
+        results = []
+        for i in range(len(contents)):
+            predictions = dict(zip(self.colors, pred_rgb_[:, i]))
+            results.append(Colorization(grayscale_rgb_[i], img[i],
+                    predictions, combined_[i]))
+        return results
+
+    def _colorize_stages(self, contents):
+        # Run each stage on its own, feeding it the outputs of the one before
+        profiler = self.profiler
+        pipeline = self.pipeline
+        trace = profiler.new_trace()
+        img, grayscale_rgb_, luma_ = profiler.run(self.sess,
+                [pipeline.original, pipeline.grayscale_rgb, pipeline.luma],
+                {pipeline.contents: contents}, 'decode', trace,
+                len(contents))
+
+        features = [self.features[layer] for layer in sorted(self.features)]
+        features_ = profiler.run(self.sess, features,
+                {pipeline.grayscale_rgb: grayscale_rgb_}, 'vgg', trace,
+                len(contents))
+
+        feed_dict = dict(zip(features, features_))
+        feed_dict[pipeline.grayscale_rgb] = grayscale_rgb_
+        chroma = [self.predictions[color] for color in self.colors]
+        chroma_ = profiler.run(self.sess, chroma, feed_dict, 'heads', trace,
+                len(contents))
+
+        feed_dict = dict(zip(chroma, chroma_))
+        feed_dict[pipeline.luma] = luma_
+        pred_rgb_, combined_ = profiler.run(self.sess,
+                [self.pred_rgb, self.combined], feed_dict, 'recombine', trace,
+                len(contents))
+
+        profiler.write_trace(trace)
+        return img, grayscale_rgb_, pred_rgb_, combined_
+
+    def colorize_tiled(self, pixels, tile_budget=TILE_BUDGET,
+            overlap=TILE_OVERLAP):
+        """Runs the ensemble over overlapping 224x224 tiles of the given HxWx3
+        uint8 RGB image at its own resolution, at most tile_budget tiles at
+        once, and yields the combined output as (top, rows) bands of uint8
+        RGB rows, from the top of the image down. The chroma of the tiles is
+        blended with feathered weights, and combined with the luminance of
+        the image (see tiles.blend_tiles)."""
+        def predict(tiles):
+            with profile_stage(self.profiler, 'colorize'):
+                return self.sess.run(self.combined_chroma, feed_dict={
+                        self.pipeline.original: tiles / np.float32(255)})
+
+        for top, chroma in blend_tiles(pixels, predict, tile_budget, overlap):
+            yield top, self.recolor([pixels[top:top + len(chroma)]],
+                    [chroma])[0]
+
+    def frame_chroma(self, frames):
+        """Runs the ensemble over the given batch of uint8 RGB frames, which
+        have the same size, returning the 224x224 chroma of their combined
+        outputs."""
+        with profile_stage(self.profiler, 'decode', len(frames)):
+            resized = self.pipeline.resize(frames)
+        with profile_stage(self.profiler, 'colorize', len(frames)):
+            return self.sess.run(self.combined_chroma,
+                    feed_dict={self.pipeline.original: resized})
+
+    def recolor(self, pixels, chroma):
+        """Combines the luminance of the given uint8 RGB images with the given
+        chroma, which is resized to their size, returning the uint8 RGB
+        images."""
+        with profile_stage(self.profiler, 'recolor', len(pixels)):
+            rgb = self.pipeline.recolor(pixels, chroma)
+        return np.round(np.clip(rgb, 0, 1) * 255).astype(np.uint8)
+
+    def colorize_many(self, image_paths, batch_size=BATCH_SIZE,
+            full_size=False, colors=None):
+        """Runs the ensemble over each of the given JPEG images, batch_size
+        images at a time, yielding their Colorizations in order. With
+        full_size, they are upsampled to the full size of the images, with
+        only the predictions of the given colors (see upsample)."""
+        for start in range(0, len(image_paths), batch_size):
+            contents = []
+            for image_path in image_paths[start:start + batch_size]:
+                with profile_stage(self.profiler, 'read'):
+                    with open(image_path, 'rb') as image_file:
+                        contents.append(image_file.read())
+
+            results = self.colorize_batch(contents)
+            for image_contents, result in zip(contents, results):
+                if full_size:
+                    result = self.upsample(result, image_contents, colors)
+                yield result
+
+    def close(self):
+        """Releases the session holding the models."""
+        self.sess.close()
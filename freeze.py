@@ -0,0 +1,221 @@
+"""
+Frozen inference graphs of the ensemble.
+
+A frozen GraphDef holds its weights in constants, so it is loaded in one go,
+without building the network in Python or restoring checkpoints. Before it is
+written out, it is optimized for inference:
+
+- The Identity nodes that the frozen variables were read through are removed.
+- Batch normalization with fixed statistics, which is what the moving averages
+  of training give, becomes a scale and shift of its input. When its input is
+  a convolution, the scale is folded into the weights of the convolution, and
+  the shift becomes its bias. Batch normalization with the statistics of each
+  image is computed from the image, and so is left as it is.
+- Everything that the outputs do not need is dropped.
+
+The module also holds the helpers that the GraphDef rewrites share.
+
+Use:
+    graph_def = optimize_for_inference(frozen_graph_def, output_names)
+"""
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.core.framework import attr_value_pb2, graph_pb2, node_def_pb2
+from tensorflow.python.framework import graph_util, tensor_util
+
+# The suffixes of the names of the nodes that fold_batch_norms adds: the
+# weights of a convolution that a batch normalization was folded into, and the
+# scale of one that became a scale and shift of its input
+FOLDED_WEIGHTS_SUFFIX = '/folded_weights'
+SCALE_SUFFIX = '/scale'
+
+
+def node_name(input_name):
+    """Returns the name of the node of the given input of a NodeDef."""
+    return input_name.lstrip('^').split(':')[0]
+
+
+def tensor_name(input_name):
+    """Returns the name of the tensor of the given input of a NodeDef."""
+    return input_name if ':' in input_name else input_name + ':0'
+
+
+def type_attr(dtype):
+    """Returns the AttrValue of the given DType."""
+    return attr_value_pb2.AttrValue(type=dtype.as_datatype_enum)
+
+
+def make_node(op, name, inputs=(), **attrs):
+    """Returns a NodeDef of the given op, with the given AttrValues."""
+    node = node_def_pb2.NodeDef(op=op, name=name, input=list(inputs))
+    for key, value in attrs.items():
+        node.attr[key].CopyFrom(value)
+    return node
+
+
+def make_constant(name, value, dtype=tf.float32):
+    """Returns a Const NodeDef holding the given value."""
+    return make_node('Const', name, dtype=type_attr(dtype),
+            value=attr_value_pb2.AttrValue(
+            tensor=tensor_util.make_tensor_proto(value, dtype)))
+
+
+def constant_input(nodes, input_name):
+    """Returns the Const node that the given input reads, through any Identity
+    nodes, or None if it does not read a constant. The nodes map the names of
+    the nodes of the GraphDef to them."""
+    node = nodes.get(node_name(input_name))
+    while node is not None and node.op == 'Identity':
+        node = nodes.get(node_name(node.input[0]))
+    if node is None or node.op != 'Const':
+        return None
+    return node
+
+
+def constant_value(node):
+    """Returns the value of the given Const node as an ndarray."""
+    return tensor_util.MakeNdarray(node.attr['value'].tensor)
+
+
+def _copy(node):
+    copy = node_def_pb2.NodeDef()
+    copy.CopyFrom(node)
+    return copy
+
+
+def _graph_def(graph_def, nodes):
+    output = graph_pb2.GraphDef()
+    output.versions.CopyFrom(graph_def.versions)
+    output.library.CopyFrom(graph_def.library)
+    output.node.extend(nodes)
+    return output
+
+
+def remove_identities(graph_def, keep=()):
+    """Returns a copy of the given GraphDef without its Identity nodes, other
+    than the named ones to keep, where their inputs are read directly."""
+    sources = dict((node.name, node.input[0]) for node in graph_def.node
+            if node.op == 'Identity' and node.name not in keep)
+
+    def source(input_name):
+        name = node_name(input_name)
+        if name not in sources:
+            return input_name
+        resolved = source(sources[name])
+        if input_name.startswith('^'):
+            return '^' + node_name(resolved)
+        return resolved
+
+    nodes = []
+    for node in graph_def.node:
+        if node.name in sources:
+            continue
+        node = _copy(node)
+        inputs = [source(input_name) for input_name in node.input]
+        del node.input[:]
+        node.input.extend(inputs)
+        nodes.append(node)
+    return _graph_def(graph_def, nodes)
+
+
+def _batch_norm_affine(nodes, node):
+    # The scale and shift that the batch normalization applies, or None if
+    # any of its statistics or parameters are not constant
+    params = [constant_input(nodes, input_name) for input_name in
+            node.input[1:5]]
+    if any(param is None for param in params):
+        return None
+    mean, variance, beta, gamma = [constant_value(param) for param in params]
+    scale = 1 / np.sqrt(variance + node.attr['variance_epsilon'].f)
+    if node.attr['scale_after_normalization'].b:
+        scale = scale * gamma
+    return scale, beta - mean * scale
+
+
+def fold_batch_norms(graph_def):
+    """Returns a copy of the given GraphDef where each batch normalization
+    with constant statistics is folded into the convolution before it, or
+    becomes a scale and shift of its input when there is none."""
+    nodes = dict((node.name, node) for node in graph_def.node)
+    consumers = dict()
+    for node in graph_def.node:
+        for input_name in node.input:
+            name = node_name(input_name)
+            consumers[name] = consumers.get(name, 0) + 1
+
+    # The affine transform of each batch normalization that can be folded
+    affines = dict()
+    for node in graph_def.node:
+        if node.op == 'BatchNormWithGlobalNormalization':
+            affine = _batch_norm_affine(nodes, node)
+            if affine is not None:
+                affines[node.name] = affine
+
+    # The convolutions whose output only goes into one of those, so their
+    # weights can be scaled
+    folded = dict()
+    for name in affines:
+        conv = nodes[node_name(nodes[name].input[0])]
+        if (conv.op == 'Conv2D' and consumers[conv.name] == 1 and
+                constant_input(nodes, conv.input[1]) is not None):
+            folded[conv.name] = name
+
+    output = []
+    for node in graph_def.node:
+        if node.name in folded:
+            scale, _ = affines[folded[node.name]]
+            weights = constant_value(constant_input(nodes, node.input[1]))
+            weights_name = node.name + FOLDED_WEIGHTS_SUFFIX
+            output.append(make_constant(weights_name,
+                    (weights * scale).astype(np.float32)))
+            conv = _copy(node)
+            conv.input[1] = weights_name
+            output.append(conv)
+        elif node.name in affines:
+            scale, shift = affines[node.name]
+            name = node.name
+            if node_name(node.input[0]) in folded:
+                output.append(make_constant(name + '/bias',
+                        shift.astype(np.float32)))
+                output.append(make_node('BiasAdd', name, [node.input[0],
+                        name + '/bias'], T=type_attr(tf.float32)))
+            else:
+                output.append(make_constant(name + SCALE_SUFFIX,
+                        scale.astype(np.float32)))
+                output.append(make_constant(name + '/shift',
+                        shift.astype(np.float32)))
+                output.append(make_node('Mul', name + '/mul', [node.input[0],
+                        name + SCALE_SUFFIX], T=type_attr(tf.float32)))
+                output.append(make_node('Add', name, [name + '/mul',
+                        name + '/shift'], T=type_attr(tf.float32)))
+        else:
+            output.append(node)
+    return _graph_def(graph_def, output)
+
+
+def count_folds(graph_def):
+    """Returns the number of batch normalizations that fold_batch_norms folded
+    in the given GraphDef, as the number folded into convolutions and the
+    number that became a scale and shift of their input."""
+    into_convs = len([node for node in graph_def.node if node.op == 'Conv2D'
+            and node.input[1].endswith(FOLDED_WEIGHTS_SUFFIX)])
+    scaled = len([node for node in graph_def.node if node.op == 'Mul' and
+            node.name.endswith('/mul') and
+            node.input[1] == node.name[:-len('/mul')] + SCALE_SUFFIX])
+    return into_convs, scaled
+
+
+def optimize_for_inference(graph_def, output_names):
+    """Returns a copy of the given frozen GraphDef optimized for inference,
+    keeping only what the named output nodes need."""
+    graph_def = remove_identities(graph_def, keep=output_names)
+    graph_def = fold_batch_norms(graph_def)
+    return graph_util.extract_sub_graph(graph_def, output_names)
+
+
+def subgraph(graph_def, nodes, output_names):
+    """Returns a GraphDef of the given nodes, with the versions and functions
+    of the given GraphDef, keeping only what the named output nodes need."""
+    return graph_util.extract_sub_graph(_graph_def(graph_def, nodes),
+            output_names)
@@ -0,0 +1,184 @@
+"""
+The colornet network, shared by training and inference.
+
+The network is a residual encoder on top of the frozen VGG16 network, which
+predicts the chroma (UV) of an image from its grayscale version. Training and
+inference build the network through these functions, so the variables are
+named the same in both, and a trained checkpoint can be restored into a graph
+built for inference.
+"""
+
+import tensorflow as tf
+from batchnorm import ConvolutionalBatchNormalizer
+
+# The frozen VGG16 model that the colornet network is built on top of
+VGG_MODEL_PATH = 'vgg/tensorflow-vgg16/vgg16-20160129.tfmodel'
+
+# The VGG16 layers whose activations are fed into the colornet network
+VGG_LAYERS = ['conv1_2', 'conv2_2', 'conv3_3', 'conv4_3']
+
+# The statistics that batch normalization can normalize with: those of the
+# whole batch, those of each example on its own, or the population statistics
+# averaged over training
+BATCH_STATS = 'batch'
+EXAMPLE_STATS = 'example'
+POPULATION_STATS = 'population'
+
+# The collection of the batch normalization mean and variance variables, which
+# hold the population statistics when normalizing with POPULATION_STATS
+BATCHNORM_STATISTICS = 'batchnorm_statistics'
+
+
+def rgb2yuv(rgb):
+    """
+    Convert RGB image into YUV https://en.wikipedia.org/wiki/YUV
+    """
+    rgb2yuv_filter = tf.constant(
+        [[[[0.299, -0.169, 0.499],
+           [0.587, -0.331, -0.418],
+            [0.114, 0.499, -0.0813]]]])
+    rgb2yuv_bias = tf.constant([0., 0.5, 0.5])
+
+    temp = tf.nn.conv2d(rgb, rgb2yuv_filter, [1, 1, 1, 1], 'SAME')
+    temp = tf.nn.bias_add(temp, rgb2yuv_bias)
+
+    return temp
+
+
+def yuv2rgb(yuv):
+    """
+    Convert YUV image into RGB https://en.wikipedia.org/wiki/YUV
+    """
+    yuv = tf.mul(yuv, 255)
+    yuv2rgb_filter = tf.constant(
+        [[[[1., 1., 1.],
+           [0., -0.34413999, 1.77199996],
+            [1.40199995, -0.71414, 0.]]]])
+    yuv2rgb_bias = tf.constant([-179.45599365, 135.45983887, -226.81599426])
+    temp = tf.nn.conv2d(yuv, yuv2rgb_filter, [1, 1, 1, 1], 'SAME')
+    temp = tf.nn.bias_add(temp, yuv2rgb_bias)
+    temp = tf.maximum(temp, 0.)
+    temp = tf.minimum(temp, 255.)
+    temp = tf.div(temp, 255)
+    return temp
+
+
+def load_graph_def(graph_def_path):
+    """Returns the GraphDef serialized in the given file."""
+    with open(graph_def_path, mode='rb') as f:
+        fileContent = f.read()
+
+    graph_def = tf.GraphDef()
+    graph_def.ParseFromString(fileContent)
+    return graph_def
+
+
+def load_vgg(vgg_model_path=VGG_MODEL_PATH):
+    """Returns the GraphDef of the frozen VGG16 model."""
+    return load_graph_def(vgg_model_path)
+
+
+def vgg_features(graph_def, grayscale, name='import'):
+    """Imports the VGG16 model into the default graph, feeding it the given
+    grayscale images, and returns the activations of VGG_LAYERS by name."""
+    layers = tf.import_graph_def(graph_def, input_map={"images": grayscale},
+            return_elements=['%s/Relu:0' % layer for layer in VGG_LAYERS],
+            name=name)
+    return dict(zip(VGG_LAYERS, layers))
+
+
+def colornet_weights():
+    """Creates the weights of the colornet convolutions."""
+    with tf.variable_scope('colornet'):
+        # Store layers weight
+        weights = {
+            # 1x1 conv, 512 inputs, 256 outputs
+            'wc1': tf.Variable(tf.truncated_normal([1, 1, 512, 256], stddev=0.01)),
+            # 3x3 conv, 512 inputs, 128 outputs
+            'wc2': tf.Variable(tf.truncated_normal([3, 3, 256, 128], stddev=0.01)),
+            # 3x3 conv, 256 inputs, 64 outputs
+            'wc3': tf.Variable(tf.truncated_normal([3, 3, 128, 64], stddev=0.01)),
+            # 3x3 conv, 128 inputs, 3 outputs
+            'wc4': tf.Variable(tf.truncated_normal([3, 3, 64, 3], stddev=0.01)),
+            # 3x3 conv, 6 inputs, 3 outputs
+            'wc5': tf.Variable(tf.truncated_normal([3, 3, 3, 3], stddev=0.01)),
+            # 3x3 conv, 3 inputs, 2 outputs
+            'wc6': tf.Variable(tf.truncated_normal([3, 3, 3, 2], stddev=0.01)),
+        }
+    return weights
+
+
+def batch_norm(x, depth, phase_train, stats=BATCH_STATS):
+    with tf.variable_scope('batchnorm'):
+        ewma = tf.train.ExponentialMovingAverage(decay=0.9999)
+        bn = ConvolutionalBatchNormalizer(depth, 0.001, ewma, True)
+        if stats == BATCH_STATS:
+            # The moving averages are updated after every optimizer step
+            tf.add_to_collection(tf.GraphKeys.UPDATE_OPS, bn.get_assigner())
+        elif stats == POPULATION_STATS:
+            tf.add_to_collection(BATCHNORM_STATISTICS, bn.mean)
+            tf.add_to_collection(BATCHNORM_STATISTICS, bn.variance)
+        x = bn.normalize(x, train=phase_train,
+                per_example=(stats == EXAMPLE_STATS),
+                population=(stats == POPULATION_STATS))
+    return x
+
+
+def conv2d(_X, w, phase_train, sigmoid=False, bn=False, stats=BATCH_STATS):
+    with tf.variable_scope('conv2d'):
+        _X = tf.nn.conv2d(_X, w, [1, 1, 1, 1], 'SAME')
+        if bn:
+            _X = batch_norm(_X, w.get_shape()[3], phase_train, stats)
+        if sigmoid:
+            return tf.sigmoid(_X)
+        else:
+            _X = tf.nn.relu(_X)
+            return tf.maximum(0.01 * _X, _X)
+
+
+def colornet(_tensors, phase_train, stats=BATCH_STATS):
+    """
+    Network architecture http://tinyclouds.org/colorize/residual_encoder.png
+
+    The stats select the statistics that batch normalization uses. Training
+    uses the statistics of the batch. With EXAMPLE_STATS, each image uses its
+    own statistics, which is how a network trained one image at a time
+    behaves, so a batch of images gives the same results as running them one
+    by one. With POPULATION_STATS, the moving averages of the batch statistics
+    kept by training are used, once they are restored.
+    """
+    def bn(x, depth):
+        return batch_norm(x, depth, phase_train, stats)
+
+    def conv(x, w, sigmoid=False):
+        return conv2d(x, w, phase_train, sigmoid=sigmoid, bn=True, stats=stats)
+    with tf.variable_scope('colornet'):
+        # Bx28x28x512 -> batch norm -> 1x1 conv = Bx28x28x256
+        conv1 = tf.nn.relu(tf.nn.conv2d(bn(_tensors["conv4_3"], 512),
+            _tensors["weights"]["wc1"], [1, 1, 1, 1], 'SAME'))
+        # upscale to 56x56x256
+        conv1 = tf.image.resize_bilinear(conv1, (56, 56))
+        conv1 = tf.add(conv1, bn(_tensors["conv3_3"], 256))
+
+        # Bx56x56x256-> 3x3 conv = Bx56x56x128
+        conv2 = conv(conv1, _tensors["weights"]['wc2'])
+        # upscale to 112x112x128
+        conv2 = tf.image.resize_bilinear(conv2, (112, 112))
+        conv2 = tf.add(conv2, bn(_tensors["conv2_2"], 128))
+
+        # Bx112x112x128 -> 3x3 conv = Bx112x112x64
+        conv3 = conv(conv2, _tensors["weights"]['wc3'])
+        # upscale to Bx224x224x64
+        conv3 = tf.image.resize_bilinear(conv3, (224, 224))
+        conv3 = tf.add(conv3, bn(_tensors["conv1_2"], 64))
+
+        # Bx224x224x64 -> 3x3 conv = Bx224x224x3
+        conv4 = conv(conv3, _tensors["weights"]['wc4'])
+        conv4 = tf.add(conv4, bn(_tensors["grayscale"], 3))
+
+        # Bx224x224x3 -> 3x3 conv = Bx224x224x3
+        conv5 = conv(conv4, _tensors["weights"]['wc5'])
+        # Bx224x224x3 -> 3x3 conv = Bx224x224x2
+        conv6 = conv(conv5, _tensors["weights"]['wc6'], sigmoid=True)
+
+    return conv6
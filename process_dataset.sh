@@ -1,6 +1,4 @@
-echo Resizing images
+echo Resizing and sorting images per color
 cd scripts
-#./resize.sh ../dataset/original ../dataset/resized
-echo Sorting images per color
-#./color_sort.sh ../dataset/resized ../dataset/sorted
+python color_sort.py --link --resize-dir ../dataset/resized ../dataset/sorted ../dataset/original
 cd ..
@@ -0,0 +1,159 @@
+"""
+Per-stage profiling of the inference path.
+
+A Profiler records the wall and CPU time of every run of each named stage,
+such as decoding the JPEG images or running the colornet heads, and sums them
+up as the median, 95th percentile and maximum time of each stage. A run over a
+batch of images is recorded as a sample per image, of its share of the time
+of the run, so the times are per image whatever the batch size. The CPU time
+is that of the whole process, so it counts the work of TensorFlow's threads as
+well, and can be larger than the wall time.
+
+With a trace directory, the TensorFlow step statistics of the session runs of
+each batch are also written there as a Chrome trace, which can be opened from
+chrome://tracing.
+
+Use:
+    profiler = Profiler(trace_dir)
+    with profile_stage(profiler, 'decode', len(images)):
+        (decode the images)
+    results = profiler.run(sess, fetches, feed_dict, 'vgg', trace,
+            len(images))
+    print(profiler.table())
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.core.framework import step_stats_pb2
+from tensorflow.python.client import timeline
+
+# The CPU time of the process, which Python 2 only has as time.clock
+try:
+    process_time = time.process_time
+except AttributeError:
+    process_time = time.clock
+
+# The percentiles of the times of each stage reported in the table
+PERCENTILES = [50, 95]
+
+
+class Profiler(object):
+    """Records the wall and CPU times of the stages of the inference path."""
+
+    def __init__(self, trace_dir=None):
+        self.trace_dir = trace_dir
+        self.times = OrderedDict()
+        self.lock = threading.Lock()
+        self.num_traces = 0
+
+        if trace_dir is not None and not os.path.exists(trace_dir):
+            os.makedirs(trace_dir)
+
+    @contextmanager
+    def stage(self, name, items=1):
+        """Records the wall and CPU time of the enclosed block as a run of the
+        given stage over the given number of images, as a sample per image of
+        its share of the time."""
+        wall_start = time.time()
+        cpu_start = process_time()
+        try:
+            yield
+        finally:
+            items = max(items, 1)
+            wall_time = (time.time() - wall_start) / items
+            cpu_time = (process_time() - cpu_start) / items
+            with self.lock:
+                self.times.setdefault(name, []).extend(
+                        [(wall_time, cpu_time)] * items)
+
+    def new_trace(self):
+        """Returns the step statistics to collect the trace of a batch into, or
+        None if no traces are written."""
+        if self.trace_dir is None:
+            return None
+        return step_stats_pb2.StepStats()
+
+    def run(self, sess, fetches, feed_dict, name, trace=None, items=1):
+        """Runs the given fetches as a run of the given stage over the given
+        number of images, adding the step statistics of the run to the given
+        trace, if there is one."""
+        with self.stage(name, items):
+            if trace is None:
+                return sess.run(fetches, feed_dict=feed_dict)
+
+            options = tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE)
+            run_metadata = tf.RunMetadata()
+            results = sess.run(fetches, feed_dict=feed_dict, options=options,
+                    run_metadata=run_metadata)
+            trace.MergeFrom(run_metadata.step_stats)
+            return results
+
+    def write_trace(self, trace):
+        """Writes the given trace as a Chrome trace into the trace directory,
+        returning its path."""
+        if trace is None:
+            return None
+        with self.lock:
+            self.num_traces += 1
+            trace_path = os.path.join(self.trace_dir,
+                    'timeline_%05d.json' % self.num_traces)
+        chrome_trace = timeline.Timeline(trace).generate_chrome_trace_format()
+        with open(trace_path, 'w') as trace_file:
+            trace_file.write(chrome_trace)
+        return trace_path
+
+    def summary(self):
+        """Returns the number of images run through each stage, and the
+        percentiles and maximum of their wall and CPU times per image in
+        seconds, as a list of dictionaries in the order the stages were first
+        run."""
+        with self.lock:
+            times = [(name, np.array(stage_times)) for name, stage_times in
+                    self.times.items()]
+
+        rows = []
+        for name, stage_times in times:
+            row = OrderedDict([('stage', name), ('images', len(stage_times))])
+            for column, kind in enumerate(['wall', 'cpu']):
+                for percentile in PERCENTILES:
+                    row['%s_p%d' % (kind, percentile)] = float(
+                            np.percentile(stage_times[:, column], percentile))
+                row['%s_max' % kind] = float(np.max(stage_times[:, column]))
+            rows.append(row)
+        return rows
+
+    def table(self):
+        """Returns the summary as a text table, with the times in
+        milliseconds."""
+        rows = self.summary()
+        if not rows:
+            return 'No stages were profiled'
+
+        columns = [column for column in rows[0] if column not in
+                ['stage', 'images']]
+        stage_width = max(len('stage'), max(len(row['stage']) for row in rows))
+        lines = [' '.join(['stage'.ljust(stage_width), 'images'.rjust(6)] +
+                [column.rjust(10) for column in columns])]
+        for row in rows:
+            lines.append(' '.join([row['stage'].ljust(stage_width),
+                    str(row['images']).rjust(6)] + ['%10.1f' % (row[column] *
+                    1000) for column in columns]))
+        return '\n'.join(lines)
+
+
+@contextmanager
+def profile_stage(profiler, name, items=1):
+    """Records the enclosed block as a run of the given stage over the given
+    number of images with the given profiler, or does nothing if there is no
+    profiler."""
+    if profiler is None:
+        yield
+    else:
+        with profiler.stage(name, items):
+            yield
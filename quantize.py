@@ -0,0 +1,213 @@
+"""
+Reduced-precision versions of the colorization ensemble.
+
+The ensemble is frozen into a GraphDef, which takes the grayscale images and
+gives the chroma predicted by each of its models, with every weight held in a
+constant. That GraphDef is rewritten for a lower precision:
+
+FLOAT16 stores the large weights as half floats, which are cast back to
+float32 as they are used, so the weights take half of the memory, but the
+network still computes in float32.
+
+INT8 runs the convolutions with TensorFlow's eight bit quantized kernels. The
+weights of each convolution are quantized over their own range, and its input
+over the range that it takes on a sample of images, which is found by running
+the float32 ensemble over them first.
+
+Use:
+    graph_def = engine.frozen_graph_def()
+    ranges = calibrate(graph_def, ENSEMBLE_INPUT, grayscale_batches)
+    int8_graph_def = quantize_graph_def(graph_def, INT8, output_names, ranges)
+"""
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.core.framework import attr_value_pb2
+from tensorflow.python.framework import tensor_util
+from freeze import (constant_input, constant_value, make_constant, make_node,
+        subgraph, tensor_name, type_attr)
+
+# The precisions that the ensemble can be run in
+FLOAT32 = 'float32'
+FLOAT16 = 'float16'
+INT8 = 'int8'
+PRECISIONS = [FLOAT32, FLOAT16, INT8]
+
+# Weights with fewer elements than this are kept in float32. They take next to
+# no memory, and include the small final convolutions that give the chroma,
+# which are the most sensitive to rounding.
+MIN_QUANTIZED_SIZE = 1024
+
+# The quantized type of the weights and activations, and how floats are mapped
+# onto it. The quantized kernels take the minimum of the range to be the lowest
+# quantized value, which is what MIN_FIRST rounds to, as quantize_graph does.
+QUANTIZED_TYPE = tf.quint8
+QUANTIZE_MODE = b'MIN_FIRST'
+
+# The rows of the RGB to YUV conversion of model.rgb2yuv that give the chroma
+UV_FILTER = np.array([[-0.169, 0.499], [-0.331, -0.418], [0.499, -0.0813]])
+
+
+def _size(const_node):
+    dims = const_node.attr['value'].tensor.tensor_shape.dim
+    return int(np.prod([dim.size for dim in dims]))
+
+
+def _is_weight(node):
+    return (node.op == 'Const' and
+            node.attr['dtype'].type == tf.float32.as_datatype_enum and
+            _size(node) >= MIN_QUANTIZED_SIZE)
+
+
+def quantized_convolutions(graph_def):
+    """Returns the names of the convolutions of the given GraphDef that are
+    quantized to INT8, which are those with constant weights of at least
+    MIN_QUANTIZED_SIZE elements."""
+    nodes = dict((node.name, node) for node in graph_def.node)
+    convolutions = []
+    for node in graph_def.node:
+        if node.op != 'Conv2D':
+            continue
+        weights = constant_input(nodes, node.input[1])
+        if weights is not None and _is_weight(weights):
+            convolutions.append(node.name)
+    return convolutions
+
+
+def calibrate(graph_def, input_name, batches):
+    """Runs the given float32 GraphDef over the given batches of inputs, fed
+    to its named input, and returns the range of the input of each of its
+    quantized convolutions, by name. The ranges always include zero."""
+    nodes = dict((node.name, node) for node in graph_def.node)
+    convolutions = quantized_convolutions(graph_def)
+    input_names = [tensor_name(nodes[name].input[0]) for name in convolutions]
+
+    graph = tf.Graph()
+    with graph.as_default():
+        elements = tf.import_graph_def(graph_def,
+                return_elements=[tensor_name(input_name)] + input_names,
+                name='')
+    graph.finalize()
+
+    ranges = dict((name, (0.0, 0.0)) for name in convolutions)
+    with tf.Session(graph=graph) as sess:
+        for batch in batches:
+            values = sess.run(elements[1:], feed_dict={elements[0]: batch})
+            for name, value in zip(convolutions, values):
+                low, high = ranges[name]
+                ranges[name] = (min(low, float(np.min(value))),
+                        max(high, float(np.max(value))))
+    return ranges
+
+
+def _quantize(value, low, high):
+    # Quantize with TensorFlow itself, so the values are rounded exactly as the
+    # quantized kernels expect. The range is widened to include zero.
+    with tf.Graph().as_default(), tf.Session() as sess:
+        return sess.run(tf.quantize_v2(value, min(low, 0.0), max(high, 0.0),
+                QUANTIZED_TYPE, mode=QUANTIZE_MODE))
+
+
+def _float16_weights(graph_def):
+    # Replace each large float32 constant with a float16 one, and a cast back
+    # to float32 under the name of the original
+    nodes = []
+    for node in graph_def.node:
+        if not _is_weight(node):
+            nodes.append(node)
+            continue
+        value = constant_value(node)
+        half_name = node.name + '/float16'
+        nodes.append(make_constant(half_name, value.astype(np.float16),
+                tf.float16))
+        nodes.append(make_node('Cast', node.name, [half_name],
+                SrcT=type_attr(tf.float16), DstT=type_attr(tf.float32)))
+    return nodes
+
+
+def _eightbit_convolutions(graph_def, ranges):
+    # Replace each quantized convolution with one that quantizes its input,
+    # convolves it with the quantized weights, and converts the result back to
+    # float32 under the name of the original convolution
+    nodes = dict((node.name, node) for node in graph_def.node)
+    convolutions = set(quantized_convolutions(graph_def))
+    quantized = []
+    for node in graph_def.node:
+        if node.name not in convolutions:
+            quantized.append(node)
+            continue
+
+        name = node.name
+        if name not in ranges:
+            raise ValueError("The convolution '{}' was not calibrated".format(
+                    name))
+        weights = constant_value(constant_input(nodes, node.input[1]))
+        weights, weights_min, weights_max = _quantize(weights,
+                float(np.min(weights)), float(np.max(weights)))
+        input_min, input_max = ranges[name]
+
+        quantized += [
+            make_constant(name + '/weights', weights, QUANTIZED_TYPE),
+            make_constant(name + '/weights_min', weights_min, tf.float32),
+            make_constant(name + '/weights_max', weights_max, tf.float32),
+            make_constant(name + '/input_min', input_min, tf.float32),
+            make_constant(name + '/input_max', input_max, tf.float32),
+            make_node('QuantizeV2', name + '/quantize_input', [node.input[0],
+                    name + '/input_min', name + '/input_max'],
+                    T=type_attr(QUANTIZED_TYPE),
+                    mode=attr_value_pb2.AttrValue(s=QUANTIZE_MODE)),
+            make_node('QuantizedConv2D', name + '/quantized', [
+                    name + '/quantize_input:0', name + '/weights',
+                    name + '/quantize_input:1', name + '/quantize_input:2',
+                    name + '/weights_min', name + '/weights_max'],
+                    Tinput=type_attr(QUANTIZED_TYPE),
+                    Tfilter=type_attr(QUANTIZED_TYPE),
+                    out_type=type_attr(tf.qint32),
+                    strides=node.attr['strides'],
+                    padding=node.attr['padding']),
+            make_node('QuantizeDownAndShrinkRange', name + '/requantize', [
+                    name + '/quantized:0', name + '/quantized:1',
+                    name + '/quantized:2'], Tinput=type_attr(tf.qint32),
+                    out_type=type_attr(QUANTIZED_TYPE)),
+            make_node('Dequantize', name, [name + '/requantize:0',
+                    name + '/requantize:1', name + '/requantize:2'],
+                    T=type_attr(QUANTIZED_TYPE),
+                    mode=attr_value_pb2.AttrValue(s=QUANTIZE_MODE)),
+        ]
+    return quantized
+
+
+def quantize_graph_def(graph_def, precision, output_names, ranges=None):
+    """Returns a copy of the given frozen float32 GraphDef in the given
+    precision, keeping only what the named output nodes need. INT8 takes the
+    ranges of the inputs of the convolutions found by calibrate."""
+    if precision == FLOAT16:
+        nodes = _float16_weights(graph_def)
+    elif precision == INT8:
+        if ranges is None:
+            raise ValueError("Quantizing to int8 needs the calibrated ranges "
+                    "of the activations")
+        nodes = _eightbit_convolutions(graph_def, ranges)
+    else:
+        raise ValueError("Cannot quantize to '{}'".format(precision))
+
+    return subgraph(graph_def, nodes, output_names)
+
+
+def constant_bytes(graph_def):
+    """Returns the number of bytes held by the constants of the given
+    GraphDef, which are the weights of a frozen network."""
+    total = 0
+    for node in graph_def.node:
+        if node.op == 'Const':
+            tensor = node.attr['value'].tensor
+            total += (len(tensor.tensor_content) or
+                    tensor_util.MakeNdarray(tensor).nbytes)
+    return total
+
+
+def chroma_error(rgb, reference_rgb):
+    """Returns the mean and maximum absolute difference between the UV chroma
+    of the given RGB images and those of the reference images."""
+    error = np.abs(np.dot(rgb, UV_FILTER) - np.dot(reference_rgb, UV_FILTER))
+    return float(np.mean(error)), float(np.max(error))
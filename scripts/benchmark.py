@@ -0,0 +1,451 @@
+#!/usr/bin/env python
+#
+# benchmark.py
+#
+# Benchmarks the parts of the project whose speed matters: colorizing single
+# images and batches of images with the ensemble, the recombination of the
+# ensemble's outputs and the color space conversions around it, sorting images
+# into color bins, and training steps. Everything runs on synthetic JPEG images
+# and randomly initialized colornet models, and on a randomly initialized
+# stand-in for the VGG16 model unless the real one is given, so no dataset or
+# trained model is needed, and the inputs are the same on every run with the
+# same seed. The results are written as JSON, and can be compared against the
+# results of an earlier run to flag regressions.
+
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from multiprocessing import cpu_count
+
+import numpy as np
+import tensorflow as tf
+from PIL import Image
+
+# The modules of the project are at the root of the repository
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.append(REPO_DIR)
+from dataset import COLOR_BINS, IMAGE_SIZE, JPEG_QUALITY
+from engine import ENSEMBLE_COLORS, SAT_WEIGHTS, ColorizationEngine, recombine
+from model import colornet, colornet_weights, rgb2yuv, yuv2rgb
+from profiler import PERCENTILES
+
+from benchmark_cluster import THROUGHPUT_PATTERN
+from color_sort import sort_image
+
+# The groups of benchmarks that can be run
+BENCHMARKS = ['inference', 'recombine', 'sort', 'train']
+
+# Default values for parameters
+SEED = 0
+NUM_RUNS = 20
+NUM_WARMUP = 3
+BATCH_SIZE = 8
+SORT_IMAGES = 1000
+SORT_RUNS = 3
+TRAIN_STEPS = 20
+TOLERANCE = 0.1
+
+# The convolution blocks of the VGG16 model up to its last layer used by the
+# colornet network, as the depth and number of layers of each block. Every
+# block but the first starts by halving the size of the image.
+VGG_BLOCKS = [(64, 2), (128, 2), (256, 3), (512, 3)]
+
+# The size and depth of the VGG16 activations fed into the colornet network
+VGG_FEATURE_SHAPES = {
+    'conv1_2': (224, 64),
+    'conv2_2': (112, 128),
+    'conv3_3': (56, 256),
+    'conv4_3': (28, 512),
+}
+
+# The metrics compared against the baseline, and whether larger is better
+COMPARED_METRICS = [('throughput', True), ('latency_ms_p50', False)]
+
+# Function to generate a synthetic color image, made of a smooth random
+# gradient with noise on top, so it compresses and decodes like a photo
+def synthetic_image(rng, size):
+    corners = rng.uniform(0, 255, (4, 4, 3)).astype(np.uint8)
+    image = np.asarray(Image.fromarray(corners).resize((size, size),
+            Image.BICUBIC), dtype=np.float32)
+    image += rng.normal(0, 8, image.shape)
+    return Image.fromarray(np.clip(image, 0, 255).astype(np.uint8))
+
+# Function to write the given number of synthetic JPEG images into the given
+# directory, returning their paths
+def write_images(image_dir, num_images, size, rng):
+    os.makedirs(image_dir)
+    image_paths = []
+    for i in range(num_images):
+        image_path = os.path.join(image_dir, 'image_%05d.jpg' % i)
+        synthetic_image(rng, size).save(image_path, 'JPEG',
+                quality=JPEG_QUALITY)
+        image_paths.append(image_path)
+    return image_paths
+
+# Function to write a stand-in for the frozen VGG16 model with random weights,
+# which has the same input and convolutions up to the last layer used by the
+# colornet network, and so takes about as long to run
+def write_random_vgg(vgg_model_path, rng):
+    graph = tf.Graph()
+    with graph.as_default():
+        x = tf.placeholder(tf.float32, [None, 224, 224, 3], name='images')
+        depth = 3
+        for block, (block_depth, num_layers) in enumerate(VGG_BLOCKS):
+            if block > 0:
+                x = tf.nn.max_pool(x, [1, 2, 2, 1], [1, 2, 2, 1], 'SAME',
+                        name='pool%d' % block)
+            for layer in range(num_layers):
+                with tf.name_scope('conv%d_%d' % (block + 1, layer + 1)):
+                    filt = rng.normal(0, np.sqrt(2.0 / (9 * depth)),
+                            (3, 3, depth, block_depth)).astype(np.float32)
+                    x = tf.nn.conv2d(x, tf.constant(filt, name='filter'),
+                            [1, 1, 1, 1], 'SAME')
+                    x = tf.nn.bias_add(x, tf.zeros([block_depth],
+                            name='biases'))
+                    x = tf.nn.relu(x, name='Relu')
+                depth = block_depth
+
+    with open(vgg_model_path, 'wb') as vgg_file:
+        vgg_file.write(graph.as_graph_def().SerializeToString())
+
+# Function to write a randomly initialized colornet model for each of the
+# given colors into the given directory, in the layout test.py loads them from
+def write_random_models(model_dir, colors, seed):
+    graph = tf.Graph()
+    with graph.as_default():
+        tf.set_random_seed(seed)
+        tensors = dict((layer, tf.placeholder(tf.float32, [None, size, size,
+                depth])) for layer, (size, depth) in VGG_FEATURE_SHAPES.items())
+        tensors["grayscale"] = tf.placeholder(tf.float32, [None, 224, 224, 3])
+        tensors["weights"] = colornet_weights()
+        colornet(tensors, tf.placeholder(tf.bool))
+        init_op = tf.global_variables_initializer()
+        saver = tf.train.Saver(write_version=tf.train.SaverDef.V1)
+
+    os.makedirs(model_dir)
+    with tf.Session(graph=graph) as sess:
+        for color in colors:
+            # Every run of the initializer draws new weights
+            sess.run(init_op)
+            saver.save(sess, os.path.join(model_dir, 'model_%s' % color),
+                    write_meta_graph=False)
+
+# Function to time the given function over a number of runs, after running it
+# a few times untimed, returning the time of each run in seconds
+def time_runs(function, num_runs, num_warmup):
+    for run in range(num_warmup):
+        function(run)
+    times = []
+    for run in range(num_runs):
+        start_time = time.time()
+        function(num_warmup + run)
+        times.append(time.time() - start_time)
+    return np.array(times)
+
+# Function to summarize the times of the runs that each processed the given
+# number of items, as the percentiles of their latency and the throughput
+def timing_result(times, items_per_run, unit):
+    result = {
+        'runs': len(times),
+        'items_per_run': items_per_run,
+        'unit': unit,
+        'throughput': items_per_run * len(times) / max(np.sum(times), 1e-12),
+        'latency_ms_mean': float(np.mean(times) * 1000),
+    }
+    for percentile in PERCENTILES:
+        result['latency_ms_p%d' % percentile] = float(
+                np.percentile(times, percentile) * 1000)
+    return result
+
+# Function to benchmark colorizing single images and batches of images with
+# the ensemble
+def benchmark_inference(args, work_dir, image_paths, vgg_model_path):
+    model_dir = os.path.join(work_dir, 'model')
+    write_random_models(model_dir, ENSEMBLE_COLORS, args.seed)
+    engine = ColorizationEngine(model_dir, SAT_WEIGHTS,
+            vgg_model_path=vgg_model_path)
+
+    contents = []
+    for image_path in image_paths[:max(args.num_runs, args.batch_size)]:
+        with open(image_path, 'rb') as image_file:
+            contents.append(image_file.read())
+
+    def colorize_single(run):
+        engine.colorize_contents(contents[run % len(contents)])
+
+    def colorize_batch(run):
+        start = (run * args.batch_size) % len(contents)
+        batch = (contents + contents)[start:start + args.batch_size]
+        engine.colorize_batch(batch)
+
+    try:
+        return {
+            'inference_single': timing_result(time_runs(colorize_single,
+                    args.num_runs, args.num_warmup), 1, 'images'),
+            'inference_batched': timing_result(time_runs(colorize_batch,
+                    args.num_runs, args.num_warmup), args.batch_size,
+                    'images'),
+        }
+    finally:
+        engine.close()
+
+# Function to benchmark the recombination of the outputs of the ensemble, and
+# the conversions between RGB and YUV of all of them, on random images held in
+# variables, so that only the kernels themselves are timed
+def benchmark_recombine(args, work_dir, image_paths, vgg_model_path):
+    num_heads = len(ENSEMBLE_COLORS)
+    graph = tf.Graph()
+    with graph.as_default():
+        tf.set_random_seed(args.seed)
+        predictions = tf.Variable(tf.random_uniform([num_heads,
+                args.batch_size, 224, 224, 3]))
+        images = tf.reshape(predictions, [-1, 224, 224, 3])
+        ops = {
+            'recombine': tf.group(recombine(predictions,
+                    [SAT_WEIGHTS[color] for color in ENSEMBLE_COLORS])),
+            'rgb2yuv': tf.group(rgb2yuv(images)),
+            'yuv2rgb': tf.group(yuv2rgb(images)),
+        }
+        init_op = tf.global_variables_initializer()
+    graph.finalize()
+
+    # The recombination makes a batch of images out of the outputs of every
+    # model, while the conversions convert the outputs of every model
+    items_per_run = {
+        'recombine': args.batch_size,
+        'rgb2yuv': num_heads * args.batch_size,
+        'yuv2rgb': num_heads * args.batch_size,
+    }
+
+    results = {}
+    with tf.Session(graph=graph) as sess:
+        sess.run(init_op)
+        for name in sorted(ops):
+            times = time_runs(lambda run: sess.run(ops[name]), args.num_runs,
+                    args.num_warmup)
+            results[name] = timing_result(times, items_per_run[name],
+                    'images')
+    return results
+
+# Function to benchmark sorting the images into color bins, one image after
+# another in a single process, so the result does not depend on the number of
+# cores. Each run sorts all of the images.
+def benchmark_sort(args, work_dir, image_paths, vgg_model_path):
+    # Ties between color bins are broken at random
+    np.random.seed(args.seed)
+
+    def sort_images(run):
+        for image_path in image_paths:
+            sort_image(image_path)
+
+    times = time_runs(sort_images, args.sort_runs, 1)
+    result = timing_result(times, len(image_paths), 'images')
+    result['seconds_per_1000_images'] = float(np.mean(times) * 1000 /
+            len(image_paths))
+    return {'color_sort': result}
+
+# Function to benchmark training steps of the ensemble, by training it with
+# train.py for a number of steps, whose first step is not timed
+def benchmark_train(args, work_dir, image_paths, vgg_model_path):
+    # Every model trains on its own share of the images
+    image_dir = os.path.join(work_dir, 'train')
+    for i, color_bin in enumerate(COLOR_BINS):
+        bin_dir = os.path.join(image_dir, color_bin)
+        os.makedirs(bin_dir)
+        for image_path in image_paths[i::len(COLOR_BINS)]:
+            os.link(image_path, os.path.join(bin_dir,
+                    os.path.basename(image_path)))
+
+    # Nothing is saved or logged before the end of training
+    never = str(args.train_steps + 1)
+    output_path = os.path.join(work_dir, 'train.log')
+    with open(output_path, 'w') as train_output:
+        status = subprocess.call([sys.executable,
+                os.path.join(REPO_DIR, 'train.py'), image_dir,
+                os.path.join(work_dir, 'summary'), '--ensemble',
+                '--batch-size', str(args.batch_size),
+                '--max-steps', str(args.train_steps),
+                '--model-dir', os.path.join(work_dir, 'train_model'),
+                '--final-model', os.path.join(work_dir, 'final_model'),
+                '--vgg-model', vgg_model_path, '--image-save-rate', never,
+                '--model-save-rate', never, '--log-rate', never,
+                '--summary-rate', never], cwd=REPO_DIR,
+                stdout=train_output, stderr=subprocess.STDOUT)
+    with open(output_path) as train_output:
+        output = train_output.read()
+
+    match = THROUGHPUT_PATTERN.search(output)
+    if status != 0 or match is None:
+        sys.stderr.write(output)
+        return {'train_step': {'error': "train.py failed with status "
+                "{}".format(status)}}
+
+    # Every step trains a batch of each model
+    images_per_sec = float(match.group(1))
+    step_time = args.batch_size * len(COLOR_BINS) / images_per_sec
+    return {'train_step': {
+        'runs': args.train_steps - 1,
+        'items_per_run': args.batch_size * len(COLOR_BINS),
+        'unit': 'images',
+        'throughput': images_per_sec,
+        'steps_per_sec': 1 / step_time,
+        'latency_ms_mean': step_time * 1000,
+    }}
+
+BENCHMARK_FUNCTIONS = {
+    'inference': benchmark_inference,
+    'recombine': benchmark_recombine,
+    'sort': benchmark_sort,
+    'train': benchmark_train,
+}
+
+# Function to compare the given results against those of the baseline,
+# returning the rows of the comparison, and whether any of them regressed by
+# more than the tolerance. A benchmark that failed, or a metric of the
+# baseline that is missing from the results, counts as a regression, with no
+# value or change
+def compare(results, baseline, tolerance):
+    rows = []
+    regressed = False
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        for metric, larger_is_better in COMPARED_METRICS:
+            value = results[name].get(metric)
+            base = baseline[name].get(metric)
+            if not base:
+                continue
+            if value is None:
+                change = None
+                regression = True
+            else:
+                change = value / base - 1
+                worse = -change if larger_is_better else change
+                regression = worse > tolerance
+            regressed = regressed or regression
+            rows.append((name, metric, base, value, change, regression))
+    return rows, regressed
+
+def parse_arguments():
+    parser = ArgumentParser(description="Benchmarks inference, "
+            "recombination, color sorting and training on synthetic images "
+            "and randomly initialized models, writing the results as JSON.")
+    parser.add_argument("output_path", type=str, help="The JSON file to "
+            "write the results to.")
+    parser.add_argument("-c", "--compare", dest="baseline_path", default=None,
+            type=str, help="The JSON results of an earlier run to compare "
+            "against. The exit status is 1 if any benchmark regressed by more "
+            "than the tolerance, failed, or is missing a metric of the "
+            "baseline.")
+    parser.add_argument("-t", "--tolerance", dest="tolerance", type=float,
+            default=TOLERANCE, help="How much worse than the baseline a "
+            "throughput or median latency can be before it is flagged as a "
+            "regression, as a fraction of the baseline.")
+    parser.add_argument("-b", "--benchmarks", dest="benchmarks", nargs='+',
+            choices=BENCHMARKS, default=BENCHMARKS, help="The benchmarks to "
+            "run.")
+    parser.add_argument("-s", "--seed", dest="seed", type=int, default=SEED,
+            help="The seed of the synthetic images and random weights.")
+    parser.add_argument("-n", "--runs", dest="num_runs", type=int,
+            default=NUM_RUNS, help="The number of timed runs of inference and "
+            "recombination.")
+    parser.add_argument("-w", "--warmup", dest="num_warmup", type=int,
+            default=NUM_WARMUP, help="The number of untimed runs before the "
+            "timed ones.")
+    parser.add_argument("--batch-size", dest="batch_size", type=int,
+            default=BATCH_SIZE, help="The number of images in each batch of "
+            "batched inference, recombination and training.")
+    parser.add_argument("--sort-images", dest="sort_images", type=int,
+            default=SORT_IMAGES, help="The number of synthetic images to "
+            "generate, which are all sorted on every run of color sorting.")
+    parser.add_argument("--sort-runs", dest="sort_runs", type=int,
+            default=SORT_RUNS, help="The number of timed runs of color "
+            "sorting.")
+    parser.add_argument("--train-steps", dest="train_steps", type=int,
+            default=TRAIN_STEPS, help="The number of steps to train for. The "
+            "first step is not timed.")
+    parser.add_argument("--vgg-model", dest="vgg_model_path", default=None,
+            type=str, help="The frozen VGG16 model to use. By default, a "
+            "stand-in with random weights is generated.")
+    return parser.parse_args()
+
+def main():
+    args = parse_arguments()
+    if args.train_steps < 2:
+        sys.exit("--train-steps must be at least 2")
+
+    work_dir = tempfile.mkdtemp(prefix='benchmark')
+    try:
+        rng = np.random.RandomState(args.seed)
+        num_images = max(args.sort_images, args.num_runs, args.batch_size,
+                len(COLOR_BINS))
+        image_paths = write_images(os.path.join(work_dir, 'images'),
+                num_images, IMAGE_SIZE, rng)
+        vgg_model_path = args.vgg_model_path
+        if vgg_model_path is None:
+            vgg_model_path = os.path.join(work_dir, 'vgg16.tfmodel')
+            write_random_vgg(vgg_model_path, rng)
+
+        results = {}
+        for benchmark in args.benchmarks:
+            print("Running the {} benchmark".format(benchmark))
+            results.update(BENCHMARK_FUNCTIONS[benchmark](args, work_dir,
+                    image_paths, vgg_model_path))
+    finally:
+        shutil.rmtree(work_dir)
+
+    config = dict((name, getattr(args, name)) for name in ['seed',
+            'num_runs', 'num_warmup', 'batch_size', 'sort_images',
+            'sort_runs', 'train_steps', 'vgg_model_path'])
+    config.update({
+        'python': platform.python_version(),
+        'tensorflow': tf.__version__,
+        'cpu_count': cpu_count(),
+    })
+    with open(args.output_path, 'w') as output_file:
+        json.dump({'config': config, 'results': results}, output_file,
+                indent=2, sort_keys=True)
+
+    print("\n{:<18} {:>12} {:>8} {:>14}".format('benchmark', 'throughput',
+            'unit/s', 'p50 latency'))
+    for name in sorted(results):
+        result = results[name]
+        if 'error' in result:
+            print("{:<18} {:>12}".format(name, 'failed'))
+            continue
+        print("{:<18} {:>12.1f} {:>8} {:>11.1f} ms".format(name,
+                result['throughput'], result['unit'],
+                result.get('latency_ms_p50', result['latency_ms_mean'])))
+    print("Wrote the results to '{}'".format(args.output_path))
+
+    if args.baseline_path is None:
+        return
+    with open(args.baseline_path) as baseline_file:
+        baseline = json.load(baseline_file)
+    if baseline['config'] != config:
+        print("\nThe baseline was run with a different configuration, so the "
+                "comparison may not be meaningful")
+
+    rows, regressed = compare(results, baseline['results'], args.tolerance)
+    print("\n{:<18} {:<15} {:>12} {:>12} {:>8}".format('benchmark', 'metric',
+            'baseline', 'current', 'change'))
+    for name, metric, base, value, change, regression in rows:
+        if value is None:
+            print("{:<18} {:<15} {:>12.2f} {:>12}  REGRESSION".format(name,
+                    metric, base, 'failed' if 'error' in results[name] else
+                    'missing'))
+            continue
+        print("{:<18} {:<15} {:>12.2f} {:>12.2f} {:>+7.1%}{}".format(name,
+                metric, base, value, change,
+                '  REGRESSION' if regression else ''))
+    if regressed:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
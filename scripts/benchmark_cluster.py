@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+#
+# benchmark_cluster.py
+#
+# Measures how the throughput of data-parallel training scales with the number
+# of workers, by training for a fixed number of steps on a local cluster of 1
+# to N workers, and reporting the images per second of each. The arguments
+# after the options are passed on to train.py.
+
+import os
+import re
+import shutil
+import tempfile
+from argparse import ArgumentParser, REMAINDER
+
+from train_cluster import PORT, launch
+
+# The number of steps to train with each number of workers
+NUM_STEPS = 50
+
+# The throughput reported by train.py at the end of training
+THROUGHPUT_PATTERN = re.compile(r'\(([0-9.]+) images/s\)')
+
+# Function to train with the given number of workers, returning the images per
+# second, or None if training failed
+def benchmark(train_args, num_workers, num_steps, port):
+    output_dir = tempfile.mkdtemp(prefix='benchmark_cluster')
+    try:
+        output_path = os.path.join(output_dir, 'chief.log')
+        with open(output_path, 'w') as chief_output:
+            status = launch(train_args + ['--max-steps', str(num_steps),
+                    '--final-model', os.path.join(output_dir, 'model'),
+                    '--model-dir', output_dir], num_workers, port,
+                    chief_output=chief_output)
+        with open(output_path) as chief_output:
+            match = THROUGHPUT_PATTERN.search(chief_output.read())
+    finally:
+        shutil.rmtree(output_dir)
+
+    if status != 0 or match is None:
+        return None
+    return float(match.group(1))
+
+def parse_arguments():
+    parser = ArgumentParser(description="Benchmarks data-parallel training "
+            "with 1 to N workers on this machine.")
+    parser.add_argument("-n", "--max-workers", dest="max_workers", type=int,
+            default=4, help="The largest number of workers to train with.")
+    parser.add_argument("-s", "--steps", dest="num_steps", type=int,
+            default=NUM_STEPS, help="The number of steps to train for with "
+            "each number of workers. The first step is not timed.")
+    parser.add_argument("-p", "--port", dest="port", type=int, default=PORT,
+            help="The first port to run the clusters on.")
+    parser.add_argument("train_args", nargs=REMAINDER, help="The arguments "
+            "to pass on to train.py, which should include the image and "
+            "summary directories.")
+    return parser.parse_args()
+
+def main():
+    args = parse_arguments()
+
+    results = []
+    for num_workers in range(1, args.max_workers + 1):
+        # Every cluster gets its own ports, in case the last ones linger
+        port = args.port + (num_workers - 1) * (args.max_workers + 1)
+        throughput = benchmark(args.train_args, num_workers, args.num_steps,
+                port)
+        results.append((num_workers, throughput))
+        print("Trained with {} worker(s): {}".format(num_workers,
+                'failed' if throughput is None else
+                '{:.1f} images/s'.format(throughput)))
+
+    baseline = results[0][1]
+    print("\n{:>8} {:>12} {:>8} {:>11}".format('workers', 'images/s',
+            'speedup', 'efficiency'))
+    for num_workers, throughput in results:
+        if throughput is None:
+            print("{:>8} {:>12}".format(num_workers, 'failed'))
+            continue
+        speedup = throughput / baseline if baseline else float('nan')
+        print("{:>8} {:>12.1f} {:>7.2f}x {:>10.0%}".format(num_workers,
+                throughput, speedup, speedup / num_workers))
+
+if __name__ == '__main__':
+    main()
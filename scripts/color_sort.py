@@ -2,61 +2,38 @@
 #
 # color_sort.py
 #
-# Sorts the given image into the 'red', 'green', or 'blue' directory in the
-# specified output directory based on what the dominant color is in the image.
-# The dominant color is the color that has the greatest sum in the image.
+# Sorts the given images into the 'red', 'green', 'blue', or 'blue_green' bin
+# based on what the dominant color is in each image. The dominant color is the
+# color that has the greatest sum in the image. The bins are written to a
+# manifest in the output directory, and the images can also be hard linked
+# into a directory per bin, instead of being copied. The images can be resized
+# to the training size in the same pass, so each is only decoded once.
 
 import os
+import sys
 import numpy as np
-import scipy.misc
 from argparse import ArgumentParser
+from functools import partial
+from multiprocessing import Pool, cpu_count
+from PIL import Image
 
-# The directories for red, blue, and green images
-RED_DIR = "red"
-BLUE_DIR = "blue"
-GREEN_DIR = "green"
-BLUE_GREEN_DIR = "blue_green"
+# The dataset layout is shared with training, at the root of the repository
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+        os.pardir))
+from dataset import (BLUE_BIN, BLUE_GREEN_BIN, COLOR_BINS, GREEN_BIN,
+        IMAGE_SIZE, MANIFEST_NAME, RED_BIN, find_images, load_resized,
+        save_resized, write_manifest)
 
-# Function to check if the given pixel is grayscale (all color channels equal)
-def pixel_is_grayscale(pixel):
-    return pixel[0] == pixel[1] and pixel[1] == pixel[2]
+# The number of images handed to a worker process at a time
+CHUNK_SIZE = 64
 
 # Function to check if an image is grayscale (all color channels are equal)
 def image_is_grayscale(image):
-    for row in image:
-        for pixel in row:
-            if not pixel_is_grayscale(pixel):
-                return False
-    return True
-
-# Parse the command line arguments
-parser = ArgumentParser(description="Sorts the given input image into the "
-        "red, green, or blue directory output directory based on its dominant "
-        "color. The image is copied.")
-parser.add_argument("output_dir", type=str, help="The output directory to copy "
-        "the image file into. It is sorted to either a 'red', 'blue', or "
-        "'green' subdirectory in that directory.")
-parser.add_argument("image_path", type=str, nargs='+', help="The path(s) to "
-        "the image file(s) to sort based on its color.")
-args = parser.parse_args()
-
-# Create the output directory if it does not exist
-if not os.path.exists(args.output_dir):
-    os.mkdir(args.output_dir)
-
-# Iterate over all the image paths specified by the user
-for image_path in args.image_path:
-    # Load the image from file, and get the basename
-    image = scipy.misc.imread(image_path)
-    image_name = os.path.basename(image_path)
-
-    # Sum the image along each color channel, skip grayscale images
-    color_sums = np.sum(image, (0, 1))
-    if color_sums.shape == () or image_is_grayscale(image):
-        continue
-
-    # Determine the channel with the max sum value
-    max_color = np.amax(color_sums)
+    return bool(np.all(image[:, :, 0] == image[:, :, 1]) and
+            np.all(image[:, :, 1] == image[:, :, 2]))
+
+# Function to find the color bin of an image, which is None for grayscale images
+def color_bin(color_sums):
     red_sum = color_sums[0]
     green_sum = color_sums[1]
     blue_sum = color_sums[2]
@@ -64,18 +41,108 @@ for image_path in args.image_path:
 
     # if green and blue are both dominant over red, that's a blue green dominance
     if blue_sum > red_sum and green_sum > red_sum:
-        print(image_name, " has more blue and green then red", blue_sum, green_sum, red_sum)
         blue_green_sum = blue_sum + green_sum
 
-    # Select the output directory to save to based on the max color. If there
-    # are multiple that match, randomly select one of them
+    # Select the bin based on the max color. If there are multiple that match,
+    # randomly select one of them
     max_of_sums = max([red_sum, green_sum, blue_sum, blue_green_sum])
-    color_pairs = [(red_sum, RED_DIR), (blue_sum, BLUE_DIR), (green_sum, GREEN_DIR), (blue_green_sum, BLUE_GREEN_DIR)]
-    max_colors = [os.path.join(args.output_dir, color) for (color_sum, color) in color_pairs if color_sum == max_of_sums]
-    output_image_dir = np.random.choice(max_colors)
-
-    # Create the output directory if needed, and save the output image
-    if not os.path.exists(output_image_dir):
-        os.mkdir(output_image_dir)
-    output_image_path = os.path.join(output_image_dir, image_name)
-    scipy.misc.imsave(output_image_path, image)
+    color_pairs = [(red_sum, RED_BIN), (blue_sum, BLUE_BIN),
+            (green_sum, GREEN_BIN), (blue_green_sum, BLUE_GREEN_BIN)]
+    max_colors = [color for (color_sum, color) in color_pairs
+            if color_sum == max_of_sums]
+    return np.random.choice(max_colors)
+
+# Function to sort a single image, returning its manifest row, or None if it is
+# grayscale. With a resize directory, the image is resized as it is decoded,
+# and the resized image is saved there and sorted instead of the original
+def sort_image(image_path, resize_dir=None, size=IMAGE_SIZE):
+    if resize_dir is None:
+        image = np.asarray(Image.open(image_path).convert('RGB'))
+    else:
+        resized_image = load_resized(image_path, size)
+        image = np.asarray(resized_image)
+    if image_is_grayscale(image):
+        return None
+
+    if resize_dir is not None:
+        image_path = os.path.join(resize_dir, os.path.basename(image_path))
+        save_resized(resized_image, image_path)
+
+    # Sum the image along each color channel
+    color_sums = [int(color_sum) for color_sum in
+            np.sum(image[:, :, :3], (0, 1), dtype=np.uint64)]
+    return {
+        'path': os.path.abspath(image_path),
+        'bin': color_bin(color_sums),
+        'red_sum': color_sums[0],
+        'green_sum': color_sums[1],
+        'blue_sum': color_sums[2],
+    }
+
+# Function to seed the random tie-breaks of a worker process, which would
+# otherwise all inherit the same random state from the parent
+def seed_worker():
+    np.random.seed()
+
+def parse_arguments():
+    parser = ArgumentParser(description="Sorts the given input images into "
+            "the red, green, blue, or blue_green bin based on their dominant "
+            "color, writing the bins to a manifest in the output directory.")
+    parser.add_argument("output_dir", type=str, help="The output directory to "
+            "write the manifest into. With --link, the images are also linked "
+            "into a 'red', 'green', 'blue', or 'blue_green' subdirectory in "
+            "that directory.")
+    parser.add_argument("image_path", type=str, nargs='+', help="The path(s) to "
+            "the image file(s) to sort based on their color, or to "
+            "directories to sort all the JPEG images under.")
+    parser.add_argument("-j", "--jobs", dest="num_jobs", type=int,
+            default=cpu_count(), help="The number of worker processes to "
+            "sort the images with.")
+    parser.add_argument("-l", "--link", dest="link", action="store_true",
+            help="Hard link each image into the directory of its bin.")
+    parser.add_argument("-r", "--resize-dir", dest="resize_dir", default=None,
+            type=str, help="Resize the color images to the training size as "
+            "they are sorted, saving them into this directory. Each image is "
+            "only decoded once, and the resized images are the ones sorted.")
+    parser.add_argument("-s", "--size", dest="size", type=int,
+            default=IMAGE_SIZE, help="The width and height to resize the "
+            "images to, with --resize-dir.")
+    return parser.parse_args()
+
+def main():
+    args = parse_arguments()
+
+    # Create the output directories if they do not exist
+    if not os.path.exists(args.output_dir):
+        os.mkdir(args.output_dir)
+    if args.resize_dir is not None and not os.path.exists(args.resize_dir):
+        os.makedirs(args.resize_dir)
+    if args.link:
+        for color in COLOR_BINS:
+            bin_dir = os.path.join(args.output_dir, color)
+            if not os.path.exists(bin_dir):
+                os.mkdir(bin_dir)
+
+    # Sort the images across all the cores, in the order they were given
+    pool = Pool(args.num_jobs, initializer=seed_worker)
+    rows = []
+    sort = partial(sort_image, resize_dir=args.resize_dir, size=args.size)
+    for row in pool.imap(sort, find_images(args.image_path), CHUNK_SIZE):
+        if row is None:
+            continue
+        rows.append(row)
+
+        if args.link:
+            link_path = os.path.join(args.output_dir, row['bin'],
+                    os.path.basename(row['path']))
+            if not os.path.exists(link_path):
+                os.link(row['path'], link_path)
+    pool.close()
+    pool.join()
+
+    manifest_path = os.path.join(args.output_dir, MANIFEST_NAME)
+    write_manifest(manifest_path, rows)
+    print("Sorted {} color images into '{}'".format(len(rows), manifest_path))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+#
+# colorize_video.py
+#
+# Colorizes a video with the trained ensemble, streaming its frames through
+# the ensemble and into the output video as they are read. Only keyframes,
+# at scene changes and every so many frames within a scene, are run through
+# the ensemble, and the chroma of the frames between them is interpolated
+# from them (see video.py). The frames are read and written with OpenCV. The
+# frame throughput is reported as the video is colorized, and at the end.
+
+import os
+import sys
+import time
+from argparse import ArgumentParser
+
+import cv2
+
+# The modules of the project are at the root of the repository
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+        os.pardir))
+from engine import MODEL_DIR, SAT_WEIGHTS, ColorizationEngine
+from model import VGG_MODEL_PATH
+from quantize import FLOAT32, PRECISIONS
+from video import (KEYFRAME_BATCH_SIZE, KEYFRAME_INTERVAL, SCENE_THRESHOLD,
+        colorize_stream)
+
+# The codec of the output video, as its FourCC
+FOURCC = 'mp4v'
+
+# How many frames to report the throughput after
+REPORT_INTERVAL = 100
+
+# Function to read the RGB frames of the given open video, one at a time
+def read_frames(capture):
+    while True:
+        success, frame = capture.read()
+        if not success:
+            return
+        yield cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+
+# Function to print the throughput of the frames written so far
+def report(num_frames, num_keyframes, seconds):
+    print("{} frames in {:.1f} s: {:.2f} frames/s, {} keyframes ({:.1%} of "
+            "the frames)".format(num_frames, seconds, num_frames /
+            max(seconds, 1e-9), num_keyframes, num_keyframes /
+            float(max(num_frames, 1))))
+
+def parse_arguments():
+    parser = ArgumentParser(description="Colorizes a video with the trained "
+            "ensemble, running it over keyframes only, and interpolating the "
+            "chroma of the frames in between.")
+    parser.add_argument("input_path", type=str, help="The video to colorize.")
+    parser.add_argument("output_path", type=str, help="The colorized video to "
+            "write, at the size and frame rate of the input.")
+    parser.add_argument("-k", "--keyframe-interval", dest="keyframe_interval",
+            type=int, default=KEYFRAME_INTERVAL, help="The most frames from "
+            "one keyframe to the next within a scene. At most one in this "
+            "many frames is run through the ensemble, besides the first frame "
+            "of each scene.")
+    parser.add_argument("-s", "--scene-threshold", dest="scene_threshold",
+            type=float, default=SCENE_THRESHOLD, help="The fraction of the "
+            "luminance histogram that has to change between two frames for "
+            "the second to start a new scene, which always gets a keyframe.")
+    parser.add_argument("-b", "--batch-size", dest="batch_size", type=int,
+            default=KEYFRAME_BATCH_SIZE, help="The number of keyframes run "
+            "through the ensemble at once.")
+    parser.add_argument("-m", "--model-dir", dest="model_dir",
+            default=MODEL_DIR, type=str, help="The directory holding the "
+            "checkpoints or frozen versions of the ensemble.")
+    parser.add_argument("-a", "--moving-averages", dest="moving_averages",
+            action="store_true", help="Normalize with the moving averages of "
+            "the batch statistics kept by training, as with test.py.")
+    parser.add_argument("-f", "--frozen", dest="frozen", action="store_true",
+            help="Load the frozen float32 ensemble, as with test.py.")
+    parser.add_argument("--precision", dest="precision", default=FLOAT32,
+            choices=PRECISIONS, help="The precision to run the ensemble in, "
+            "as with test.py.")
+    parser.add_argument("--vgg-model", dest="vgg_model_path",
+            default=VGG_MODEL_PATH, type=str, help="The frozen VGG16 model "
+            "the ensemble is built on.")
+    args = parser.parse_args()
+    if args.keyframe_interval < 1 or args.batch_size < 1:
+        parser.error("The keyframe interval and batch size must be positive")
+    return args
+
+def main():
+    args = parse_arguments()
+
+    capture = cv2.VideoCapture(args.input_path)
+    if not capture.isOpened():
+        sys.exit("Could not open the video '{}'".format(args.input_path))
+    fps = capture.get(cv2.CAP_PROP_FPS)
+    size = (int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+    writer = cv2.VideoWriter(args.output_path,
+            cv2.VideoWriter_fourcc(*FOURCC), fps, size)
+
+    engine = ColorizationEngine(args.model_dir, SAT_WEIGHTS,
+            vgg_model_path=args.vgg_model_path,
+            moving_averages=args.moving_averages, precision=args.precision,
+            frozen=args.frozen)
+
+    num_frames = 0
+    num_keyframes = 0
+    start_time = time.time()
+    for frame, keyframe in colorize_stream(engine, read_frames(capture),
+            args.batch_size, args.keyframe_interval, args.scene_threshold):
+        writer.write(cv2.cvtColor(frame, cv2.COLOR_RGB2BGR))
+        num_frames += 1
+        num_keyframes += keyframe
+        if num_frames % REPORT_INTERVAL == 0:
+            report(num_frames, num_keyframes, time.time() - start_time)
+    seconds = time.time() - start_time
+
+    capture.release()
+    writer.release()
+    engine.close()
+
+    print("\nWrote the colorized video to '{}'".format(args.output_path))
+    report(num_frames, num_keyframes, seconds)
+
+if __name__ == '__main__':
+    main()
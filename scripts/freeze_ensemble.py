@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+#
+# freeze_ensemble.py
+#
+# Exports the trained ensemble as a frozen inference GraphDef, for test.py and
+# the server to load with --frozen. The checkpoints of the models and the
+# VGG16 trunk are frozen into a single GraphDef of constants, which only holds
+# what inference needs. With --moving-averages, batch normalization is folded
+# into the weights and biases of the convolutions before it. The frozen
+# ensemble is then compared with the one restored from the checkpoints by its
+# size, how long it takes to load, and, given some images, how long it takes
+# to run and how far its output strays.
+
+import os
+import sys
+import time
+from argparse import ArgumentParser
+
+import numpy as np
+
+# The modules of the project are at the root of the repository
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+        os.pardir))
+from dataset import find_images
+from engine import (BATCH_SIZE, MODEL_DIR, SAT_WEIGHTS, ColorizationEngine,
+        frozen_ensemble_path)
+from freeze import count_folds
+from model import VGG_MODEL_PATH
+from quantize import FLOAT32
+
+from quantize_ensemble import evaluate, read_batches
+
+# Function to load the ensemble with the given options, returning the engine,
+# the number of seconds it took to load, and its number of nodes
+def load(model_dir, **options):
+    start_time = time.time()
+    engine = ColorizationEngine(model_dir, SAT_WEIGHTS, **options)
+    load_time = time.time() - start_time
+    return engine, load_time, len(engine.graph.as_graph_def().node)
+
+def parse_arguments():
+    parser = ArgumentParser(description="Exports the trained ensemble as a "
+            "frozen inference GraphDef, and compares it with the ensemble "
+            "restored from the checkpoints.")
+    parser.add_argument("image_path", type=str, nargs='*', help="Image(s), or "
+            "directories of JPEG images, to compare the speed and output of "
+            "the two on.")
+    parser.add_argument("-m", "--model-dir", dest="model_dir",
+            default=MODEL_DIR, type=str, help="The directory holding the "
+            "checkpoints of the ensemble, where the frozen ensemble is "
+            "written as well.")
+    parser.add_argument("-a", "--moving-averages", dest="moving_averages",
+            action="store_true", help="Normalize with the moving averages of "
+            "the batch statistics kept by training, as with test.py, which "
+            "folds batch normalization into the convolutions. Otherwise, each "
+            "image is normalized with its own statistics, which cannot be "
+            "folded.")
+    parser.add_argument("-b", "--batch-size", dest="batch_size", type=int,
+            default=BATCH_SIZE, help="The number of images run through the "
+            "ensemble at once.")
+    parser.add_argument("--vgg-model", dest="vgg_model_path",
+            default=VGG_MODEL_PATH, type=str, help="The frozen VGG16 model "
+            "the ensemble is built on.")
+    return parser.parse_args()
+
+def main():
+    args = parse_arguments()
+
+    restored = load(args.model_dir, vgg_model_path=args.vgg_model_path,
+            moving_averages=args.moving_averages)
+    graph_def = restored[0].frozen_graph_def()
+    graph_def_path = frozen_ensemble_path(args.model_dir, FLOAT32)
+    with open(graph_def_path, 'wb') as graph_def_file:
+        graph_def_file.write(graph_def.SerializeToString())
+    print("Wrote the frozen ensemble to '{}' ({:.1f} MB)".format(
+            graph_def_path, os.path.getsize(graph_def_path) / float(1 << 20)))
+
+    # Report the batch normalizations that were actually folded
+    into_convs, scaled = count_folds(graph_def)
+    print("Folded {} batch normalizations, {} of them into "
+            "convolutions".format(into_convs + scaled, into_convs))
+    if not into_convs + scaled:
+        if args.moving_averages:
+            reason = "none of them have constant statistics"
+        else:
+            reason = ("each image is normalized with its own statistics; "
+                    "pass --moving-averages to fold them")
+        sys.stderr.write("WARNING: no batch normalization was folded, as "
+                "{}\n".format(reason))
+
+    frozen = load(args.model_dir, frozen=True)
+    rows = [('restored', restored), ('frozen', frozen)]
+
+    # Run both over the given images
+    image_paths = sorted(find_images(args.image_path))
+    outputs = dict()
+    if image_paths:
+        batches = list(read_batches(image_paths, args.batch_size))
+        for name, (engine, _, _) in rows:
+            outputs[name] = evaluate(engine, batches)
+    for _, (engine, _, _) in rows:
+        engine.close()
+
+    print("\n{:<9} {:>7} {:>9} {:>10} {:>10}".format('ensemble', 'nodes',
+            'load s', 'ms/image', 'max error'))
+    for name, (_, load_time, num_nodes) in rows:
+        if outputs:
+            output, seconds_per_image = outputs[name]
+            error = np.max(np.abs(output - outputs['restored'][0]))
+            timing = "{:>10.1f} {:>10.5f}".format(seconds_per_image * 1000,
+                    error)
+        else:
+            timing = ''
+        print("{:<9} {:>7} {:>9.2f} {}".format(name, num_nodes, load_time,
+                timing))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+#
+# pack_dataset.py
+#
+# Packs the sorted images listed in a manifest into shard files of fixed-size
+# uint8 records, with an index per color bin. Training from the shards skips
+# decoding the JPEG images on every step of every epoch.
+
+import os
+import sys
+import numpy as np
+from argparse import ArgumentParser
+from functools import partial
+from multiprocessing import Pool, cpu_count
+
+# The dataset layout is shared with training, at the root of the repository
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+        os.pardir))
+from dataset import (COLOR_BINS, IMAGE_SIZE, ShardWriter, load_resized,
+        read_manifest)
+
+# The number of images handed to a worker process at a time
+CHUNK_SIZE = 64
+
+# Function to decode a single image into an array of the shard image size
+def decode_image(image_path, size=IMAGE_SIZE):
+    return np.asarray(load_resized(image_path, size), dtype=np.uint8)
+
+def parse_arguments():
+    parser = ArgumentParser(description="Packs the images listed in a "
+            "manifest into shards of raw uint8 records for training.")
+    parser.add_argument("manifest", type=str, help="The manifest written by "
+            "scripts/color_sort.py, listing the images and their color bins.")
+    parser.add_argument("output_dir", type=str, help="The output directory to "
+            "write the shard files and their indices into.")
+    parser.add_argument("-b", "--bin", dest="color_bins", action="append",
+            choices=COLOR_BINS, help="The color bin to pack, which may be "
+            "given several times. By default, every bin is packed.")
+    parser.add_argument("-s", "--size", dest="size", type=int,
+            default=IMAGE_SIZE, help="The width and height of the packed "
+            "images. Images of another size are resized.")
+    parser.add_argument("-j", "--jobs", dest="num_jobs", type=int,
+            default=cpu_count(), help="The number of worker processes to "
+            "decode the images with.")
+    return parser.parse_args()
+
+def main():
+    args = parse_arguments()
+
+    # Create the output directory if it does not exist
+    if not os.path.exists(args.output_dir):
+        os.makedirs(args.output_dir)
+
+    pool = Pool(args.num_jobs)
+    decode = partial(decode_image, size=args.size)
+    for color_bin in args.color_bins or COLOR_BINS:
+        image_paths = [row['path'] for row in read_manifest(args.manifest,
+                color_bin)]
+
+        # Decode the images across all the cores, packing them in order
+        writer = ShardWriter(args.output_dir, color_bin, args.size)
+        for image in pool.imap(decode, image_paths, CHUNK_SIZE):
+            writer.write(image)
+        writer.close()
+        print("Packed {} {} images into {} shards".format(len(image_paths),
+                color_bin, len(writer.shards)))
+    pool.close()
+    pool.join()
+
+if __name__ == '__main__':
+    main()
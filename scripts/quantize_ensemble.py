@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+#
+# quantize_ensemble.py
+#
+# Exports reduced-precision versions of the trained ensemble, for test.py and
+# the server to run with --precision. The float32 ensemble is frozen into a
+# single GraphDef, calibrated on a sample of training images, and written out
+# with float16 weights and with int8 quantized convolutions. Each version is
+# then run over another sample of the images, and compared with the float32
+# ensemble by its speed, the memory its weights take, and how far the chroma
+# of its output strays from the float32 output.
+
+import json
+import os
+import random
+import sys
+import time
+from argparse import ArgumentParser
+
+import numpy as np
+
+# The modules of the project are at the root of the repository
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+        os.pardir))
+from dataset import find_images
+from engine import (BATCH_SIZE, ENSEMBLE_INPUT, MODEL_DIR, SAT_WEIGHTS,
+        ColorizationEngine, ensemble_outputs, frozen_ensemble_path)
+from model import VGG_MODEL_PATH
+from quantize import (FLOAT16, FLOAT32, INT8, calibrate, chroma_error,
+        constant_bytes, quantize_graph_def)
+
+# The precisions exported, besides float32
+EXPORTED_PRECISIONS = [FLOAT16, INT8]
+
+# Default values for parameters
+CALIBRATION_IMAGES = 64
+EVALUATION_IMAGES = 32
+SEED = 0
+
+# The name of the report written next to the exported ensembles
+REPORT_NAME = 'quantization_report.json'
+
+# Function to read the given images, batch_size at a time
+def read_batches(image_paths, batch_size):
+    for start in range(0, len(image_paths), batch_size):
+        contents = []
+        for image_path in image_paths[start:start + batch_size]:
+            with open(image_path, 'rb') as image_file:
+                contents.append(image_file.read())
+        yield contents
+
+# Function to run the given engine over the given batches of images, after one
+# untimed batch, returning the combined outputs and the seconds per image
+def evaluate(engine, batches):
+    engine.colorize_batch(batches[0])
+    outputs = []
+    start_time = time.time()
+    for contents in batches:
+        outputs += [result.combined for result in
+                engine.colorize_batch(contents)]
+    return np.array(outputs), (time.time() - start_time) / len(outputs)
+
+def parse_arguments():
+    parser = ArgumentParser(description="Exports float16 and int8 versions of "
+            "the trained ensemble, calibrated on a sample of the given "
+            "training images, and reports how they compare with float32.")
+    parser.add_argument("image_path", type=str, nargs='+', help="The training "
+            "image(s), or directories to sample all of the JPEG images under.")
+    parser.add_argument("-m", "--model-dir", dest="model_dir",
+            default=MODEL_DIR, type=str, help="The directory holding the "
+            "checkpoints of the ensemble, where the reduced-precision "
+            "ensembles are written as well.")
+    parser.add_argument("-c", "--calibration-images", dest="num_calibration",
+            type=int, default=CALIBRATION_IMAGES, help="The number of images "
+            "to find the ranges of the int8 activations on.")
+    parser.add_argument("-e", "--evaluation-images", dest="num_evaluation",
+            type=int, default=EVALUATION_IMAGES, help="The number of other "
+            "images to compare the precisions on.")
+    parser.add_argument("-b", "--batch-size", dest="batch_size", type=int,
+            default=BATCH_SIZE, help="The number of images run through the "
+            "ensemble at once.")
+    parser.add_argument("-a", "--moving-averages", dest="moving_averages",
+            action="store_true", help="Normalize with the moving averages of "
+            "the batch statistics kept by training, as with test.py.")
+    parser.add_argument("-s", "--seed", dest="seed", type=int, default=SEED,
+            help="The seed of the sampling of the images.")
+    parser.add_argument("--vgg-model", dest="vgg_model_path",
+            default=VGG_MODEL_PATH, type=str, help="The frozen VGG16 model "
+            "the ensemble is built on.")
+    return parser.parse_args()
+
+def main():
+    args = parse_arguments()
+
+    # Sample the calibration and evaluation images from the training images
+    image_paths = sorted(find_images(args.image_path))
+    random.Random(args.seed).shuffle(image_paths)
+    calibration_paths = image_paths[:args.num_calibration]
+    evaluation_paths = image_paths[args.num_calibration:
+            args.num_calibration + args.num_evaluation]
+    if not calibration_paths or not evaluation_paths:
+        sys.exit("There are not enough images to calibrate and evaluate on")
+    evaluation_batches = list(read_batches(evaluation_paths, args.batch_size))
+
+    engine = ColorizationEngine(args.model_dir, SAT_WEIGHTS,
+            vgg_model_path=args.vgg_model_path,
+            moving_averages=args.moving_averages)
+    graph_def = engine.frozen_graph_def()
+    output_names = ensemble_outputs(engine.colors)
+
+    print("Calibrating on {} images".format(len(calibration_paths)))
+    grayscale_batches = (engine.pipeline.preprocess(contents)[1] for contents
+            in read_batches(calibration_paths, args.batch_size))
+    ranges = calibrate(graph_def, ENSEMBLE_INPUT, grayscale_batches)
+
+    print("Evaluating the {} ensemble".format(FLOAT32))
+    reference, reference_time = evaluate(engine, evaluation_batches)
+    engine.close()
+    reference_bytes = constant_bytes(graph_def)
+    report = {FLOAT32: {
+        'seconds_per_image': reference_time,
+        'speedup': 1.0,
+        'weight_bytes': reference_bytes,
+        'memory_saved': 0.0,
+        'chroma_mean_error': 0.0,
+        'chroma_max_error': 0.0,
+    }}
+
+    for precision in EXPORTED_PRECISIONS:
+        quantized = quantize_graph_def(graph_def, precision, output_names,
+                ranges)
+        graph_def_path = frozen_ensemble_path(args.model_dir, precision)
+        with open(graph_def_path, 'wb') as graph_def_file:
+            graph_def_file.write(quantized.SerializeToString())
+        print("Wrote the {} ensemble to '{}'".format(precision,
+                graph_def_path))
+
+        print("Evaluating the {} ensemble".format(precision))
+        engine = ColorizationEngine(args.model_dir, SAT_WEIGHTS,
+                precision=precision)
+        outputs, seconds_per_image = evaluate(engine, evaluation_batches)
+        engine.close()
+        mean_error, max_error = chroma_error(outputs, reference)
+        weight_bytes = constant_bytes(quantized)
+        report[precision] = {
+            'seconds_per_image': seconds_per_image,
+            'speedup': reference_time / seconds_per_image,
+            'weight_bytes': weight_bytes,
+            'memory_saved': 1 - weight_bytes / float(reference_bytes),
+            'chroma_mean_error': mean_error,
+            'chroma_max_error': max_error,
+        }
+
+    report_path = os.path.join(args.model_dir, REPORT_NAME)
+    with open(report_path, 'w') as report_file:
+        json.dump(report, report_file, indent=2, sort_keys=True)
+
+    print("\n{:<9} {:>10} {:>8} {:>10} {:>8} {:>11} {:>10}".format(
+            'precision', 'ms/image', 'speedup', 'weights MB', 'saved',
+            'chroma MAE', 'chroma max'))
+    for precision in [FLOAT32] + EXPORTED_PRECISIONS:
+        row = report[precision]
+        print("{:<9} {:>10.1f} {:>7.2f}x {:>10.1f} {:>8.0%} {:>11.4f} "
+                "{:>10.4f}".format(precision, row['seconds_per_image'] * 1000,
+                row['speedup'], row['weight_bytes'] / float(1 << 20),
+                row['memory_saved'], row['chroma_mean_error'],
+                row['chroma_max_error']))
+    print("Wrote the report to '{}'".format(report_path))
+
+if __name__ == '__main__':
+    main()
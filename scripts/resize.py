@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+#
+# resize.py
+#
+# Resizes all the JPG images in the given directory to the required size for
+# the recolorization CNN, 256x256. Large images are decoded at a reduced scale
+# by the JPEG decoder, and the images are resized across all the cores.
+
+import os
+import sys
+from argparse import ArgumentParser
+from functools import partial
+from multiprocessing import Pool, cpu_count
+
+# The dataset layout is shared with training, at the root of the repository
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+        os.pardir))
+from dataset import IMAGE_SIZE, load_resized, save_resized
+
+# The number of images handed to a worker process at a time
+CHUNK_SIZE = 64
+
+# Function to resize a single image into the output directory, returning the
+# path of the resized image
+def resize_image(image_path, output_dir, size=IMAGE_SIZE):
+    output_path = os.path.join(output_dir, os.path.basename(image_path))
+    save_resized(load_resized(image_path, size), output_path)
+    return output_path
+
+# Function to resize the given images into the output directory with a pool of
+# worker processes, yielding the paths of the resized images in order
+def resize_images(image_paths, output_dir, size=IMAGE_SIZE,
+        num_jobs=cpu_count()):
+    pool = Pool(num_jobs)
+    try:
+        for output_path in pool.imap(partial(resize_image,
+                output_dir=output_dir, size=size), image_paths, CHUNK_SIZE):
+            yield output_path
+    finally:
+        pool.close()
+        pool.join()
+
+def parse_arguments():
+    parser = ArgumentParser(description="Resizes all the JPEG images in the "
+            "given directory to the size of the training images.")
+    parser.add_argument("image_dir", type=str, help="The directory "
+            "containing the JPEG images to resize.")
+    parser.add_argument("output_dir", type=str, help="The output directory to "
+            "save the resized images into, under the same names.")
+    parser.add_argument("-s", "--size", dest="size", type=int,
+            default=IMAGE_SIZE, help="The width and height to resize the "
+            "images to.")
+    parser.add_argument("-j", "--jobs", dest="num_jobs", type=int,
+            default=cpu_count(), help="The number of worker processes to "
+            "resize the images with.")
+    return parser.parse_args()
+
+def main():
+    args = parse_arguments()
+
+    # Make the output directory if it doesn't exist
+    if not os.path.exists(args.output_dir):
+        os.makedirs(args.output_dir)
+
+    image_paths = []
+    for dir_path, _, file_names in os.walk(args.image_dir, followlinks=True):
+        image_paths.extend(os.path.join(dir_path, file_name)
+                for file_name in sorted(file_names)
+                if file_name.endswith('.jpg'))
+
+    num_resized = 0
+    for _ in resize_images(image_paths, args.output_dir, args.size,
+            args.num_jobs):
+        num_resized += 1
+    print("Resized {} images into '{}'".format(num_resized, args.output_dir))
+
+if __name__ == '__main__':
+    main()
@@ -10,9 +10,8 @@ set -e
 set -u
 set -o pipefail
 
-# Program usage, number of parallel processes to spawn, and output image size
+# Program usage
 USAGE="./resize.sh <image_dir> <output_dir>"
-IMAGE_SIZE=256x256
 
 # Check that the number of command line arguments is valid
 num_args=$#
@@ -26,11 +25,5 @@ fi
 image_dir=$1
 output_dir=$2
 
-# Make the output directory if it doesn't exist
-mkdir -p ${output_dir}
-
-# Convert images in parallel, using as many processes as possible
-num_cores=$(getconf _NPROCESSORS_ONLN)
-num_jobs=$((2 * ${num_cores}))
-find -L ${image_dir} -type f -name '*.jpg' | parallel -j${num_jobs} --progress \
-        convert -resize ${IMAGE_SIZE}\! {} ${output_dir}/{/}
+# Resize the images in a single process, splitting the work among all the cores
+python resize.py ${image_dir} ${output_dir}
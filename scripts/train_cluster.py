@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+#
+# train_cluster.py
+#
+# Runs data-parallel training on this machine, with a parameter server process
+# and the given number of worker processes, which split the cores between
+# them. Every worker trains on its own part of the images, and their gradients
+# are averaged on every step. The arguments after the options are passed on to
+# train.py.
+
+import os
+import subprocess
+import sys
+import time
+from argparse import ArgumentParser, REMAINDER
+from multiprocessing import cpu_count
+
+# The training script, at the root of the repository
+TRAIN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+        os.pardir, 'train.py')
+
+# The port of the parameter server, which the workers' ports follow
+PORT = 2222
+
+# How often to check on the workers, in seconds
+POLL_INTERVAL = 1.0
+
+# Function to get the train.py arguments describing a local cluster
+def cluster_args(num_workers, port=PORT):
+    worker_hosts = ['localhost:%d' % (port + 1 + i) for i in range(num_workers)]
+    return ['--ps-hosts', 'localhost:%d' % port,
+            '--worker-hosts', ','.join(worker_hosts)]
+
+# Function to wait for the given processes to exit, returning their exit
+# statuses, or the status of the first one to fail as soon as it does
+def wait_all(processes, poll_interval=POLL_INTERVAL):
+    while True:
+        statuses = [process.poll() for process in processes]
+        failed = [status for status in statuses if status]
+        if failed:
+            return failed
+        if all(status is not None for status in statuses):
+            return statuses
+        time.sleep(poll_interval)
+
+# Function to train with the given train.py arguments on a local cluster with
+# the given number of workers, returning the exit status of the workers. The
+# output of the chief worker goes to the given file, if there is one. If any
+# worker fails, the others cannot make progress, so they are stopped with it
+def launch(train_args, num_workers, port=PORT, num_threads=None,
+        chief_output=None):
+    if num_threads is None:
+        num_threads = max(1, cpu_count() // num_workers)
+    command = ([sys.executable, TRAIN_PATH] + list(train_args) +
+            cluster_args(num_workers, port) + ['--threads', str(num_threads)])
+
+    ps = subprocess.Popen(command + ['--job-name', 'ps', '--task-index', '0'])
+    workers = []
+    try:
+        for task_index in range(num_workers):
+            workers.append(subprocess.Popen(command + ['--job-name', 'worker',
+                    '--task-index', str(task_index)],
+                    stdout=chief_output if task_index == 0 else None))
+        statuses = wait_all(workers)
+    finally:
+        # The parameter server runs until it is stopped, as do the remaining
+        # workers when one has failed
+        for process in workers + [ps]:
+            if process.poll() is None:
+                process.terminate()
+        for process in workers + [ps]:
+            process.wait()
+    return max(abs(status) for status in statuses)
+
+def parse_arguments():
+    parser = ArgumentParser(description="Runs data-parallel training with a "
+            "parameter server and several workers on this machine.")
+    parser.add_argument("-n", "--workers", dest="num_workers", type=int,
+            default=2, help="The number of worker processes to train with.")
+    parser.add_argument("-p", "--port", dest="port", type=int, default=PORT,
+            help="The port of the parameter server. The workers listen on the "
+            "ports following it.")
+    parser.add_argument("-t", "--threads", dest="num_threads", type=int,
+            default=None, help="The number of threads that each worker runs "
+            "operations on. By default, the cores are split between the "
+            "workers.")
+    parser.add_argument("train_args", nargs=REMAINDER, help="The arguments "
+            "to pass on to train.py.")
+    return parser.parse_args()
+
+def main():
+    args = parse_arguments()
+    sys.exit(launch(args.train_args, args.num_workers, args.port,
+            args.num_threads))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+Runs the server under gunicorn, with the colorization ensemble built once by
+the master process before it forks its workers.
+
+The application, and with it the ensemble when COLORIZATION_PRELOAD is set, is
+loaded before the workers are forked, so the imported modules and the graph of
+the ensemble, with its weights frozen into it, are built once rather than in
+every worker. The master then closes its own session, which it does not
+serve from. Each worker opens its own session over that graph before it takes
+requests, since a TensorFlow session does not survive a fork. A session holds
+its own copy of the weights, so every worker adds the size of the ensemble to
+the memory of the server; /myapp/ready/ reports the resident memory of each
+worker. The sessions split the cores between the workers, rather than each
+running ops on all of them.
+
+Every worker runs the ensemble on all of the cores it is given, so a few
+workers make the most of the machine, and more only hold more sessions and
+more copies of the weights.
+
+Use (from the server directory):
+    gunicorn -c gunicorn.conf.py myproject.wsgi
+"""
+
+import multiprocessing
+import os
+
+# The hooks below prepare the colorization jobs, rather than the application
+# as it is loaded (see myapp/apps.py)
+os.environ['COLORIZATION_SERVER_HOOKS'] = '1'
+
+bind = '0.0.0.0:8000'
+workers = 2
+preload_app = True
+
+# Colorizations run in the background, but a full-size upload can take a while
+# to be stored
+timeout = 120
+
+
+def on_starting(server):
+    # Queue the jobs left running when the server last stopped, once, before
+    # any worker can claim them. The application may not be loaded yet, so
+    # Django is set up first.
+    import django
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'myproject.settings')
+    django.setup()
+    from myproject.myapp import jobs
+    jobs.recover_jobs()
+
+
+def when_ready(server):
+    # Close the session of the preloaded ensemble in the master, which only
+    # forks the workers, before any of them inherits it
+    import myproject.myapp.colornet.test as net
+    net.release()
+
+
+def post_fork(server, worker):
+    # Open the worker's session over the preloaded ensemble with its share of
+    # the cores, and warm it up
+    import myproject.myapp.colornet.test as net
+    net.set_num_threads(max(1, multiprocessing.cpu_count() //
+                            server.cfg.workers))
+    if net.engine is not None:
+        net.get_engine()
+
+
+def post_worker_init(worker):
+    # Start the worker's pool once it has loaded the application, so it helps
+    # run the queued jobs without waiting for an upload
+    from myproject.myapp import jobs
+    jobs.start_workers()
@@ -0,0 +1 @@
+default_app_config = 'myproject.myapp.apps.MyAppConfig'
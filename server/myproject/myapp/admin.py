@@ -1,4 +1,6 @@
 from django.contrib import admin
-from myproject.myapp.models import Document
+from myproject.myapp.models import Document, Job, Render
 admin.site.register(Document)
+admin.site.register(Job)
+admin.site.register(Render)
 # Register your models here.
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""
+Prepares the colorization jobs as the server starts.
+
+Jobs left running by a server that stopped are queued again once, as the
+server starts, and the worker pool is started, so that the queued jobs are run
+without waiting for another upload. Under gunicorn, the hooks of
+gunicorn.conf.py do this, recovering the jobs in the master process before it
+forks its workers, and starting a pool in each worker, so the application
+leaves it to them. Any other server, such as manage.py runserver or another
+WSGI host, does it when the application is loaded. Management commands other
+than runserver leave the jobs alone.
+"""
+
+import os
+import sys
+
+from django.apps import AppConfig
+
+# Set by gunicorn.conf.py, whose hooks prepare the jobs instead
+SERVER_HOOKS_VARIABLE = 'COLORIZATION_SERVER_HOOKS'
+
+# The scripts that run management commands
+MANAGEMENT_SCRIPTS = ['manage.py', 'django-admin', 'django-admin.py']
+
+
+def serving():
+    """Returns whether this process is a server that prepares its own jobs,
+    rather than a gunicorn process or a management command. The autoreloader
+    of runserver serves from a child process, which is the one that does."""
+    if os.environ.get(SERVER_HOOKS_VARIABLE):
+        return False
+    if os.path.basename(sys.argv[0]) not in MANAGEMENT_SCRIPTS:
+        return True
+    if sys.argv[1:2] != ['runserver']:
+        return False
+    return '--noreload' in sys.argv or os.environ.get('RUN_MAIN') == 'true'
+
+
+class MyAppConfig(AppConfig):
+    name = 'myproject.myapp'
+
+    def ready(self):
+        if serving():
+            from myproject.myapp import jobs
+            jobs.recover_jobs()
+            jobs.start_workers()
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+Caches the renders of uploaded images by their content.
+
+The renders of an image are kept in a directory named after the digest of the
+image's bytes and the version of the models that made them, so uploading the
+same image again is served from the cache. The cache is kept under a disk
+budget by removing the least recently used render sets.
+"""
+
+import hashlib
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+
+import myproject.myapp.colornet.test as net
+
+# The directory holding the cached render sets, and the number of bytes that
+# they may take up on disk in total
+CACHE_DIR = getattr(settings, 'COLORIZATION_CACHE_DIR',
+                    os.path.join('media', 'Colorizations', 'cache'))
+CACHE_BYTES = getattr(settings, 'COLORIZATION_CACHE_BYTES', 1 << 30)
+
+# The version of the model bundle, worked out from its files when not set
+model_version_ = getattr(settings, 'COLORIZATION_MODEL_VERSION', None)
+
+
+def model_version():
+    """Returns the version of the model bundle, so that renders made by older
+    models, or in another precision, size or format, are not served after the
+    models are updated."""
+    global model_version_
+    if model_version_ is None:
+        digest = hashlib.sha1()
+        digest.update(('%s:%s:%s:%s:%s:%s;' % (
+            net.precision, net.frozen, net.full_size, net.render_format,
+            net.render_quality, net.combined_only)).encode('utf-8'))
+        for name in sorted(os.listdir(net.MODEL_DIR)):
+            if name.startswith(('model_', 'ensemble_')):
+                stat = os.stat(os.path.join(net.MODEL_DIR, name))
+                digest.update(('%s:%d:%d;' % (name, stat.st_size,
+                               stat.st_mtime)).encode('utf-8'))
+        model_version_ = digest.hexdigest()
+    return model_version_
+
+
+def file_digest(docfile):
+    """Returns the hex digest of the contents of the given uploaded or stored
+    file."""
+    digest = hashlib.sha256()
+    for chunk in docfile.chunks():
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def key(digest):
+    """Returns the cache key of the image with the given content digest."""
+    return hashlib.sha256((digest + ':' + model_version()).encode('utf-8')
+                          ).hexdigest()
+
+
+def lookup(key):
+    """Returns the directory holding the renders with the given key, marking
+    them as recently used, or None if they are not cached."""
+    render_dir = os.path.join(CACHE_DIR, key)
+    try:
+        os.utime(render_dir, None)
+    except OSError:
+        return None
+    return render_dir
+
+
+def store(key, render):
+    """Calls render with a new directory to write the renders with the given
+    key into, and adds that directory to the cache. The directory is only put
+    in place once all of the renders are written, so a partial render set is
+    never served."""
+    if not os.path.exists(CACHE_DIR):
+        os.makedirs(CACHE_DIR)
+
+    render_dir = os.path.join(CACHE_DIR, key)
+    temp_dir = tempfile.mkdtemp(prefix='.', dir=CACHE_DIR)
+    try:
+        render(temp_dir)
+        os.rename(temp_dir, render_dir)
+    except OSError:
+        # Another worker finished the same render set first
+        if not os.path.isdir(render_dir):
+            raise
+    finally:
+        if os.path.exists(temp_dir):
+            shutil.rmtree(temp_dir)
+    return render_dir
+
+
+def evict(keep=None):
+    """Removes the least recently used render sets until the cache is within
+    its disk budget, never removing the one with the key to keep. Returns the
+    directories that were removed."""
+    render_sets = []
+    total_bytes = 0
+    for name in os.listdir(CACHE_DIR):
+        render_dir = os.path.join(CACHE_DIR, name)
+        if name.startswith('.') or not os.path.isdir(render_dir):
+            continue
+        try:
+            size = sum(os.path.getsize(os.path.join(render_dir, render_name))
+                       for render_name in os.listdir(render_dir))
+            render_sets.append((os.path.getmtime(render_dir), name, size))
+        except OSError:
+            # Another worker removed the render set in the meantime
+            continue
+        total_bytes += size
+
+    evicted = []
+    for _, name, size in sorted(render_sets):
+        if total_bytes <= CACHE_BYTES:
+            break
+        if name == keep:
+            continue
+        render_dir = os.path.join(CACHE_DIR, name)
+        shutil.rmtree(render_dir, ignore_errors=True)
+        evicted.append(render_dir)
+        total_bytes -= size
+
+    return evicted
@@ -0,0 +1,9 @@
+import os
+import sys
+
+# The colorization engine lives at the root of the repository, where it is
+# shared with the command-line tools, so make it importable from the server
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__),
+        os.pardir, os.pardir, os.pardir, os.pardir))
+if REPO_ROOT not in sys.path:
+    sys.path.append(REPO_ROOT)
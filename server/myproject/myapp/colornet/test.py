@@ -1,12 +1,90 @@
 #! /usr/bin/python
 
+import io
 import os
-import glob
-import tensorflow as tf
-from matplotlib import pyplot as plt
-from matplotlib import colors
+import threading
+import time
 import numpy as np
 from argparse import ArgumentParser
+from multiprocessing.pool import ThreadPool
+from PIL import Image
+
+# TensorFlow, and the modules built on it, are only imported once the engine is
+# loaded, so importing this module keeps the server quick to start
+
+# The directory holding the checkpoints of the color-biased models
+MODEL_DIR = 'myproject/myapp/colornet'
+
+# The directory the renders are saved to by default
+RENDER_DIR = 'media/Colorizations'
+
+# The order in which the outputs of the biased models are rendered, followed by
+# the combined output of the ensemble
+RENDER_COLORS = ['blue', 'red', 'green', 'blue_green']
+RENDER_LABELS = RENDER_COLORS + ['combined']
+
+# The formats that the renders can be encoded in, as their PIL format, file
+# extension, and content type
+RENDER_FORMATS = {
+    'png': ('PNG', 'png', 'image/png'),
+    'jpeg': ('JPEG', 'jpg', 'image/jpeg'),
+    'webp': ('WEBP', 'webp', 'image/webp'),
+}
+
+# The number of threads encoding the renders, which PIL does without holding
+# the GIL
+ENCODE_THREADS = len(RENDER_LABELS)
+
+# How each biased model's saturations are weighted relative to the others
+sat_weights = {
+    'red': 1 / 8.0,
+    'green': 7 / 32.0,
+    'blue': 7 / 16.0,
+    'blue_green': 7 / 32.0,
+}
+
+# The engine is shared by every request, and loaded by the first one, or by
+# preload before a preforking server forks its workers. The ID of the process
+# whose session the engine runs in, and how long it took to load, are kept
+# with it.
+engine = None
+engine_pid = None
+load_seconds = None
+engine_lock = threading.Lock()
+
+# The profiler timing the stages of every colorization, when profiling is on
+profiler = None
+
+# The precision the ensemble is run in, and whether it is loaded from the
+# frozen ensemble of that precision rather than from the checkpoints. The
+# frozen ensembles are exported into MODEL_DIR by scripts/freeze_ensemble.py
+# and scripts/quantize_ensemble.py.
+precision = 'float32'
+frozen = False
+
+# The number of threads the session of this process runs ops with, or zero for
+# one per core. The workers of a preforking server split the cores between
+# them.
+num_threads = 0
+
+# Whether the renders are made at the full size of the uploaded images, rather
+# than at the 224x224 that the ensemble runs at
+full_size = False
+
+# The format the renders are encoded in, the quality of the lossy formats, and
+# whether only the combined output is rendered, rather than that of each model
+# as well
+render_format = 'png'
+render_quality = 90
+combined_only = False
+
+# The threads encoding the renders, started by the first render
+encode_pool = None
+encode_pool_lock = threading.Lock()
+
+class DecodeError(ValueError):
+    """Raised when uploaded contents cannot be decoded as an image."""
+    pass
 
 class HTMLObject:
     def __init__(self, path, name):
@@ -24,173 +102,250 @@ def parse_arguments():
         "test result, and original images concatenated together.")
     return parser.parse_args()
 
-def concat_images(imga, imgb):
-    """
-    Combines two color image ndarrays side-by-side.
-    """
-    ha, wa = imga.shape[:2]
-    hb, wb = imgb.shape[:2]
-    max_height = np.max([ha, hb])
-    total_width = wa + wb
-    new_img = np.zeros(shape=(max_height, total_width, 3), dtype=np.float32)
-    new_img[:ha, :wa] = imga
-    new_img[:hb, wa:wa + wb] = imgb
-    return new_img
-
-
-def rgb2yuv(rgb):
-    """
-    Convert RGB image into YUV https://en.wikipedia.org/wiki/YUV
-    """
-    rgb2yuv_filter = tf.constant(
-        [[[[0.299, -0.169, 0.499],
-           [0.587, -0.331, -0.418],
-            [0.114, 0.499, -0.0813]]]])
-    rgb2yuv_bias = tf.constant([0., 0.5, 0.5])
-
-    temp = tf.nn.conv2d(rgb, rgb2yuv_filter, [1, 1, 1, 1], 'SAME')
-    temp = tf.nn.bias_add(temp, rgb2yuv_bias)
-
-    return temp
-
-
-def yuv2rgb(yuv):
-    """
-    Convert YUV image into RGB https://en.wikipedia.org/wiki/YUV
-    """
-    yuv = tf.mul(yuv, 255)
-    yuv2rgb_filter = tf.constant(
-        [[[[1., 1., 1.],
-           [0., -0.34413999, 1.77199996],
-            [1.40199995, -0.71414, 0.]]]])
-    yuv2rgb_bias = tf.constant([-179.45599365, 135.45983887, -226.81599426])
-    temp = tf.nn.conv2d(yuv, yuv2rgb_filter, [1, 1, 1, 1], 'SAME')
-    temp = tf.nn.bias_add(temp, yuv2rgb_bias)
-    temp = tf.maximum(temp, tf.zeros(temp.get_shape(), dtype=tf.float32))
-    temp = tf.minimum(temp, tf.mul(
-        tf.ones(temp.get_shape(), dtype=tf.float32), 255))
-    temp = tf.div(temp, 255)
-    return temp
-
-def recombine(predictions, weights):
-    """
-    Combines the output images from the 3 CNN's, where each one is biased to a
-    color channel, into a final output image. Recombination is done by
-    pixel-wise weighting, where the pixel value for any given CNN's output is
-    weighted as its relative saturation to the other two.
-    """
-    red_biased = predictions['red']
-    green_biased = predictions['green']
-    blue_biased = predictions['blue']
-    blue_green_biased = predictions['blue_green']
-
-    # Compute the pixel-wise saturation for each biased CNN output image
-    red_sats = weights['red'] * colors.rgb_to_hsv(red_biased)[:,:,1]
-    green_sats = weights['green'] * colors.rgb_to_hsv(green_biased)[:,:,1]
-    blue_sats = weights['blue'] * colors.rgb_to_hsv(blue_biased)[:,:,1]
-    blue_green_sats = (weights['blue_green'] *
-            colors.rgb_to_hsv(blue_green_biased)[:,:,1])
-
-    # Weight each CNN-bias by its relative saturations at each pixel
-    total_sats = red_sats + blue_sats + green_sats + blue_green_sats
-    red_weights = red_sats / total_sats
-    green_weights = green_sats / total_sats
-    blue_weights = blue_sats / total_sats
-    blue_green_weights = blue_green_sats / total_sats
-
-    # Rehsape the per-pixel weights so they can be multiplied with the image
-    new_shape = (red_weights.shape[0], red_weights.shape[1], 1)
-    red_weights = np.reshape(red_weights, new_shape)
-    green_weights = np.reshape(green_weights, new_shape)
-    blue_weights = np.reshape(blue_weights, new_shape)
-    blue_green_weights = np.reshape(blue_green_weights, new_shape)
-
-    # Compute the output image as the pixel-wise weighted sum of the biases
-    return (red_weights * red_biased + green_weights * green_biased +
-            blue_weights * blue_biased + blue_green_weights * blue_green_biased)
-
-def run(filename):
-    # How each biased model's saturations are weighted relative to the others
-    sat_weights = {
-        'red': 1 / 8.0,
-        'green': 7 / 32.0,
-        'blue': 7 / 16.0,
-        'blue_green': 7 / 32.0,
-    }
-
-    phase_train = tf.placeholder(tf.bool, name='phase_train')
-    uv = tf.placeholder(tf.uint8, name='uv')
+def enable_profiling(trace_dir=None):
+    """Times the stages of every colorization from now on, optionally writing a
+    Chrome trace of each into the given directory. This is called before the
+    engine is loaded, so its restore is timed as well."""
+    global profiler
+    from profiler import Profiler
+    with engine_lock:
+        if profiler is None:
+            profiler = Profiler(trace_dir)
+    return profiler
+
+def set_precision(new_precision, new_frozen=False):
+    """Runs the ensemble in the given precision, loading the frozen ensemble
+    if new_frozen is set. This is called before the engine is loaded."""
+    global precision, frozen
+    with engine_lock:
+        precision = new_precision
+        frozen = new_frozen
+
+def set_full_size(enabled):
+    """Makes the renders at the full size of the uploaded images if enabled,
+    upsampling the chroma predicted by the ensemble."""
+    global full_size
+    full_size = enabled
+
+def set_num_threads(threads):
+    """Runs the ops of the session of this process with the given number of
+    threads, from the next time that it is opened."""
+    global num_threads
+    num_threads = threads
+
+def warm_up():
+    """Runs the engine over a blank image, so that the first request does not
+    pay for TensorFlow setting up the ensemble's kernels."""
+    engine.frame_chroma(np.zeros((1, 224, 224, 3), np.uint8))
+
+def set_render_format(new_format, quality=90, new_combined_only=False):
+    """Encodes the renders in the given format, at the given quality if it is
+    lossy, only rendering the combined output if new_combined_only is set."""
+    global render_format, render_quality, combined_only
+    if new_format not in RENDER_FORMATS:
+        raise ValueError("Unknown render format '%s'" % new_format)
+    render_format = new_format
+    render_quality = quality
+    combined_only = new_combined_only
+
+def render_colors():
+    """Returns the colors of the models whose outputs are rendered, in
+    order."""
+    return [] if combined_only else RENDER_COLORS
+
+def render_labels():
+    """Returns the labels of the renders that are made, in order."""
+    return render_colors() + ['combined']
+
+def content_type():
+    """Returns the content type of the encoded renders."""
+    return RENDER_FORMATS[render_format][2]
+
+def load_engine(freeze=False):
+    """Returns a new colorization engine. With freeze, an ensemble restored
+    from its checkpoints is frozen into constants in memory, and the engine
+    imports it from there instead, so its session can be reopened without
+    restoring the checkpoints again."""
+    from engine import ColorizationEngine
+    loaded = ColorizationEngine(MODEL_DIR, sat_weights, profiler=profiler,
+                                precision=precision, frozen=frozen,
+                                num_threads=num_threads)
+    if freeze and not loaded.frozen:
+        graph_def = loaded.frozen_graph_def()
+        loaded.close()
+        loaded = ColorizationEngine(MODEL_DIR, sat_weights,
+                                    profiler=profiler, graph_def=graph_def,
+                                    num_threads=num_threads)
+    return loaded
+
+def get_engine(freeze=False):
+    """Returns the colorization engine, loading the ensemble on first use,
+    frozen in memory if freeze is set (see load_engine).
+
+    An engine preloaded by the parent of a forked worker, or released by
+    this process, has its graph but no session of this process, so one is
+    opened on first use, which only takes the restore of the checkpoints
+    again when the ensemble was not frozen. Every session holds its own copy
+    of the weights."""
+    global engine, engine_pid, load_seconds
+    with engine_lock:
+        if engine is None:
+            print 'Loading the colornet ensemble...'
+            start_time = time.time()
+            engine = load_engine(freeze)
+            warm_up()
+            engine_pid = os.getpid()
+            load_seconds = time.time() - start_time
+            print 'Ensemble loaded!'
+        elif engine_pid != os.getpid():
+            print 'Opening a session over the preloaded ensemble...'
+            start_time = time.time()
+            engine.reopen(num_threads)
+            warm_up()
+            engine_pid = os.getpid()
+            load_seconds = time.time() - start_time
+            print 'Ensemble ready!'
+    return engine
+
+def preload():
+    """Loads and warms up the engine ahead of the first request. The WSGI
+    application calls this before a preforking server forks its workers, which
+    then inherit the built graph of the ensemble. The ensemble is frozen into
+    the graph, so the workers only open a session over it, rather than
+    restoring the checkpoints, though each session holds its own copy of the
+    weights."""
+    get_engine(freeze=True)
+
+def release():
+    """Closes the session of the engine in this process, which a preforking
+    server that does not serve from its master calls before it forks its
+    workers. The graph is kept, and a session is opened over it again if this
+    process uses the engine."""
+    global engine_pid
+    with engine_lock:
+        if engine is not None and engine_pid == os.getpid():
+            engine.close()
+            engine_pid = None
+
+def resident_bytes():
+    """Returns the resident memory of this process, and how much of it is
+    shared with other processes, in bytes, or None for both where /proc is
+    not available."""
+    try:
+        with open('/proc/self/statm') as statm:
+            pages = statm.read().split()
+        page_size = os.sysconf('SC_PAGE_SIZE')
+        return int(pages[1]) * page_size, int(pages[2]) * page_size
+    except (IOError, OSError, ValueError, IndexError):
+        return None, None
+
+def status():
+    """Returns whether the engine is loaded and warm in this process, and the
+    resident memory of the process, as a dictionary that can be serialized to
+    JSON."""
+    rss_bytes, shared_bytes = resident_bytes()
+    with engine_lock:
+        return {
+            'ready': engine is not None and engine_pid == os.getpid(),
+            'preloaded': engine is not None and engine_pid != os.getpid(),
+            'pid': os.getpid(),
+            'load_seconds': load_seconds,
+            'precision': precision,
+            'frozen': frozen,
+            'threads': num_threads,
+            'rss_bytes': rss_bytes,
+            'shared_bytes': shared_bytes,
+        }
+
+def render_objects(filename, output_dir):
+    """Returns the HTMLObjects of the renders of the given image, in the order
+    of render_labels, as saved under the given directory."""
+    basename = filename.split('/')[-1].split('.')[0]
+    extension = RENDER_FORMATS[render_format][1]
     out = []
-
-    with tf.Session() as sess:
-        saver = tf.train.import_meta_graph('myproject/myapp/colornet/model_blue.meta')
-
-        predictions = dict()
-
-        for color in ['blue', 'red', 'green', 'blue_green']:
-            print 'Restoring session...'
-            saver.restore(sess, 'myproject/myapp/colornet/model_%s' % color)
-            print 'Session loaded!'
-
-            graph = tf.get_default_graph()
-            print 'Loaded default graph'
-
-            print 'Processing image %s ...' % filename
-
-            contents = tf.read_file(filename)
-            uint8image = tf.image.decode_jpeg(contents, channels=3)
-            resized_image = tf.div(tf.image.resize_images(uint8image, (224, 224)), 255)
-            img = sess.run(resized_image)
-
-            print'Done processing image!'
-
-            pred = graph.get_tensor_by_name("colornet_1/conv2d_4/Sigmoid:0")
-
-            grayscale = tf.image.rgb_to_grayscale(resized_image)
-            grayscale = tf.reshape(grayscale, [1, 224, 224, 1])
-            grayscale_rgb = tf.image.grayscale_to_rgb(grayscale)
-            grayscale_yuv = rgb2yuv(grayscale_rgb)
-            grayscale = tf.concat(3, [grayscale, grayscale, grayscale])
-
-            print 'done transforms'
-
-            pred_yuv = tf.concat(3, [tf.split(3, 3, grayscale_yuv)[0], pred])
-            pred_rgb = yuv2rgb(pred_yuv)
-
-            input_image = sess.run(grayscale)
-
-            feed_dict = {phase_train : False, uv: 3, graph.get_tensor_by_name('concat:0') : input_image}
-
-            print 'Running colornet...'
-            pred_, pred_rgb_, colorimage_, grayscale_rgb_ = sess.run(
-                [pred, pred_rgb, resized_image, grayscale_rgb], feed_dict=feed_dict)
-
-            predictions[color] = pred_rgb_[0]
-
-            # Concatenate the grayscale, result, and original images together
-            output_image = concat_images(grayscale_rgb_[0], predictions[color])
-            output_image = concat_images(output_image, img)
-
-            # Save the output image to the directory with the same name
-            name = filename.split('/')[-1].split('.')[0] + '_output_%s' % color
-            path = 'media/Colorizations/render_' + name + '.png'
-            plt.imsave(path, output_image)
-
-            out.append(HTMLObject(path, name))
-
-        # Combine the three color-baised images into a final response
-        output = recombine(predictions, sat_weights)
-        # Concatenate the grayscale, result, and original images together
-        output_image = concat_images(grayscale_rgb_[0], output)
-        output_image = concat_images(output_image, img)
-
-        name = filename.split('/')[-1].split('.')[0] + '_output_combined'
-        path = 'media/Colorizations/render_' + name + '.png'
-        plt.imsave(path, output_image)
-
+    for label in render_labels():
+        name = basename + '_output_%s' % label
+        path = os.path.join(output_dir, 'render_%s.%s' % (name, extension))
         out.append(HTMLObject(path, name))
-
-        return out
-
-if __name__ == '__main__':
-    main()
+    return out
+
+def to_uint8(image):
+    """Returns the given float image, with values in [0, 1], as uint8."""
+    return (np.clip(image, 0, 1) * 255 + 0.5).astype(np.uint8)
+
+def composites(result, labels):
+    """Returns the grayscale, result, and original images of the given
+    Colorization concatenated together, for each of the given labels, as uint8
+    images in a single preallocated buffer."""
+    outputs = [result.combined if label == 'combined' else
+               result.predictions[label] for label in labels]
+
+    gray_height, gray_width = result.grayscale.shape[:2]
+    height, width = result.combined.shape[:2]
+    original_height, original_width = result.original.shape[:2]
+    buffer = np.zeros((len(outputs), max(gray_height, height,
+                      original_height), gray_width + width + original_width,
+                      3), np.uint8)
+
+    # Every composite shares the grayscale and original images, which are
+    # only converted once
+    buffer[:, :gray_height, :gray_width] = to_uint8(result.grayscale)
+    for composite, output in zip(buffer, outputs):
+        composite[:height, gray_width:gray_width + width] = to_uint8(output)
+    buffer[:, :original_height, gray_width + width:] = to_uint8(
+        result.original)
+    return buffer
+
+def encode(image):
+    """Returns the given uint8 image encoded in the render format."""
+    pil_format = RENDER_FORMATS[render_format][0]
+    options = {} if pil_format == 'PNG' else {'quality': render_quality}
+    output = io.BytesIO()
+    Image.fromarray(image).save(output, pil_format, **options)
+    return output.getvalue()
+
+def get_encode_pool():
+    """Returns the pool of threads encoding the renders, starting it on first
+    use."""
+    global encode_pool
+    with encode_pool_lock:
+        if encode_pool is None:
+            encode_pool = ThreadPool(ENCODE_THREADS)
+    return encode_pool
+
+def render(result, labels=None):
+    """Returns the renders of the given Colorization with the given labels,
+    which are render_labels by default, in order, encoded in the render
+    format."""
+    from profiler import profile_stage
+    buffer = composites(result, render_labels() if labels is None else labels)
+    with profile_stage(profiler, 'encode'):
+        return get_encode_pool().map(encode, list(buffer))
+
+def render_contents(contents, labels=None):
+    """Runs the ensemble over the given encoded JPEG bytes, returning the
+    renders of them with the given labels, which are render_labels by
+    default, in order. Only the outputs that are rendered are upsampled.
+    Raises DecodeError if the contents are not an image that can be
+    decoded."""
+    import tensorflow as tf
+    labels = render_labels() if labels is None else list(labels)
+    colors = [label for label in labels if label != 'combined']
+    try:
+        result = get_engine().colorize_contents(contents, full_size, colors)
+    except tf.errors.InvalidArgumentError:
+        raise DecodeError('The uploaded file could not be decoded as a JPEG '
+                          'image.')
+    return render(result, labels)
+
+def run(filename, output_dir=RENDER_DIR):
+    print 'Processing image %s ...' % filename
+    result = get_engine().colorize(filename, full_size, render_colors())
+    print 'Done processing image!'
+
+    out = render_objects(filename, output_dir)
+    for render_object, data in zip(out, render(result)):
+        with open(render_object.path, 'wb') as render_file:
+            render_file.write(data)
+
+    return out
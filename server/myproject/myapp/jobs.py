@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+"""
+Runs the colorization of uploaded images in the background.
+
+Every upload becomes a Job row in the database, which is the durable record of
+the queue. A bounded pool of worker threads, started as each server process
+starts, takes job IDs off an in-process queue and runs the ensemble over them.
+Jobs that were still queued when the server stopped are queued again when the
+workers start, so they are run without waiting for another upload, and no
+broker outside of the server is needed. Images whose
+renders are cached are finished without being queued.
+
+A server may run several processes, each with its own pool, over the same
+database. A job is only run by the worker that claims it, by moving it from
+queued to running in a single update, so a job queued by several processes
+still runs once. Jobs left running by a server that stopped are moved back to
+queued by recover_jobs, which the server calls once as it starts, before it
+forks any processes: from the hooks of gunicorn.conf.py under gunicorn, and
+as the application is loaded otherwise (see apps.py).
+"""
+
+import logging
+import os
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from myproject.myapp import cache
+from myproject.myapp.models import Job, Render
+
+import myproject.myapp.colornet.test as net
+
+logger = logging.getLogger(__name__)
+
+# The number of worker threads running the ensemble, and the maximum number of
+# jobs that can be waiting for one at a time
+NUM_WORKERS = getattr(settings, 'COLORIZATION_WORKERS', 1)
+MAX_QUEUED_JOBS = getattr(settings, 'COLORIZATION_MAX_QUEUED_JOBS', 64)
+
+# The error shown for a failed colorization, whose details are only logged, so
+# that they do not reveal the internals of the server
+FAILED_MESSAGE = 'The image could not be colorized.'
+
+# Run the ensemble in the configured precision, from the frozen ensemble if
+# one is configured
+net.set_precision(getattr(settings, 'COLORIZATION_PRECISION', 'float32'),
+                  getattr(settings, 'COLORIZATION_FROZEN', False))
+
+# Render at the full size of the uploaded images if configured
+net.set_full_size(getattr(settings, 'COLORIZATION_FULL_SIZE', False))
+
+# Encode the renders in the configured format, only rendering the combined
+# output if configured
+net.set_render_format(getattr(settings, 'COLORIZATION_RENDER_FORMAT', 'png'),
+                      getattr(settings, 'COLORIZATION_RENDER_QUALITY', 90),
+                      getattr(settings, 'COLORIZATION_COMBINED_ONLY', False))
+
+# Time the stages of every colorization, optionally writing Chrome traces
+if getattr(settings, 'COLORIZATION_PROFILE', False):
+    net.enable_profiling(getattr(settings, 'COLORIZATION_TRACE_DIR', None))
+
+
+class QueueFull(Exception):
+    """Raised when a job is submitted while the queue is at capacity."""
+    pass
+
+
+# The worker pool of this process, and the ID of the process that started it,
+# since its threads do not survive a fork
+job_queue = queue.Queue()
+workers = []
+workers_pid = None
+workers_lock = threading.Lock()
+
+
+def recover_jobs():
+    """Moves the jobs left running by a previous run of the server back to
+    queued. This is called once as the server starts, since while it runs,
+    running jobs belong to the worker that claimed them."""
+    Job.objects.filter(status=Job.RUNNING).update(status=Job.QUEUED)
+
+
+def claim(job_id):
+    """Marks the given queued job as running, returning whether this worker
+    claimed it. Only one worker, in any process, claims a job."""
+    return Job.objects.filter(pk=job_id, status=Job.QUEUED).update(
+        status=Job.RUNNING, started=timezone.now()) > 0
+
+
+def start_workers():
+    """Starts the worker pool of this process if it is not running yet,
+    queueing the jobs left queued by a previous run of the server, which only
+    one worker claims. The server calls this as each of its processes starts
+    (see apps.py and gunicorn.conf.py)."""
+    global job_queue, workers_pid
+    with workers_lock:
+        if workers and workers_pid == os.getpid():
+            return
+
+        # A pool inherited from the parent of a fork has no threads left
+        job_queue = queue.Queue()
+        del workers[:]
+        workers_pid = os.getpid()
+
+        pending = Job.objects.filter(status=Job.QUEUED)
+        for job_id in pending.order_by('created').values_list('id', flat=True):
+            job_queue.put(job_id)
+
+        for _ in range(NUM_WORKERS):
+            worker = threading.Thread(target=work)
+            worker.daemon = True
+            worker.start()
+            workers.append(worker)
+
+
+def submit(job):
+    """Queues the given job to be run by the worker pool, or finishes it right
+    away if the renders of its image are cached."""
+    if finish_from_cache(job):
+        return
+
+    if Job.objects.filter(status=Job.QUEUED).count() > MAX_QUEUED_JOBS:
+        raise QueueFull()
+
+    start_workers()
+    job_queue.put(job.id)
+
+
+def cache_key(job):
+    """Returns the key of the renders of the given job's image in the cache."""
+    document = job.document
+    if not document.digest:
+        document.digest = cache.file_digest(document.docfile)
+        document.save(update_fields=['digest'])
+    return cache.key(document.digest)
+
+
+def save_renders(job, render_dir):
+    """Records the renders of the given job, which are saved under the given
+    directory."""
+    filename = './' + job.document.docfile.url
+    for render in net.render_objects(filename, render_dir):
+        Render.objects.create(job=job, name=render.name, path=render.path)
+
+
+def finish_from_cache(job):
+    """Finishes the given job with the cached renders of its image, returning
+    whether they were cached."""
+    render_dir = cache.lookup(cache_key(job))
+    if render_dir is None:
+        return False
+
+    save_renders(job, render_dir)
+    job.status = Job.DONE
+    job.started = job.finished = timezone.now()
+    job.save()
+    return True
+
+
+def run(job_id):
+    """Runs the ensemble over the image of the given job, saving its renders
+    to the cache."""
+    if not claim(job_id):
+        return
+
+    job = Job.objects.get(pk=job_id)
+    if finish_from_cache(job):
+        return
+
+    key = cache_key(job)
+    filename = './' + job.document.docfile.url
+    try:
+        render_dir = cache.store(key, lambda output_dir: net.run(filename,
+                                                                 output_dir))
+    except Exception:
+        job.status = Job.FAILED
+        logger.exception('Colorizing job %s failed', job.id)
+        job.error = FAILED_MESSAGE
+    else:
+        save_renders(job, render_dir)
+        job.status = Job.DONE
+
+        # Keep the cache within its disk budget, forgetting evicted renders
+        for evicted_dir in cache.evict(keep=key):
+            Render.objects.filter(path__startswith=evicted_dir + os.sep
+                                  ).delete()
+
+    job.finished = timezone.now()
+    job.save()
+
+
+def work():
+    while True:
+        job_id = job_queue.get()
+        try:
+            run(job_id)
+        except Exception:
+            logger.exception('Running job %s failed', job_id)
+        finally:
+            close_old_connections()
+            job_queue.task_done()
+
+
+def describe(job):
+    """Returns the status of the given job and its results, as a dictionary
+    that can be serialized to JSON."""
+    status = {
+        'id': job.id,
+        'status': job.status,
+        'created': job.created.isoformat(),
+        'started': job.started.isoformat() if job.started else None,
+        'finished': job.finished.isoformat() if job.finished else None,
+        'renders': [{'name': render.name, 'path': '/' + render.path}
+                    for render in job.renders.all()],
+    }
+
+    # Report how many jobs are ahead of this one while it waits
+    if job.status == Job.QUEUED:
+        status['position'] = Job.objects.filter(
+            status=Job.QUEUED, created__lt=job.created).count()
+    if job.status == Job.FAILED:
+        status['error'] = job.error
+
+    return status
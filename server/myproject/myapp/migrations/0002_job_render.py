@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('status', models.CharField(default=b'queued', max_length=16, choices=[(b'queued', b'Queued'), (b'running', b'Running'), (b'done', b'Done'), (b'failed', b'Failed')])),
+                ('error', models.TextField(blank=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('started', models.DateTimeField(null=True, blank=True)),
+                ('finished', models.DateTimeField(null=True, blank=True)),
+                ('document', models.ForeignKey(to='myapp.Document')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Render',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('name', models.CharField(max_length=255)),
+                ('path', models.CharField(max_length=255)),
+                ('job', models.ForeignKey(related_name='renders', to='myapp.Job')),
+            ],
+        ),
+    ]
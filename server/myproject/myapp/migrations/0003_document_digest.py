@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0002_job_render'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='digest',
+            field=models.CharField(db_index=True, max_length=64, blank=True),
+        ),
+    ]
@@ -4,3 +4,36 @@ from django.db import models
 
 class Document(models.Model):
     docfile = models.FileField(upload_to='Colorizations/')
+    # The hex digest of the file's contents, so repeat uploads can be found
+    digest = models.CharField(max_length=64, blank=True, db_index=True)
+
+
+class Job(models.Model):
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    )
+
+    document = models.ForeignKey(Document)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES,
+                              default=QUEUED)
+    error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+
+    @property
+    def is_pending(self):
+        return self.status in (self.QUEUED, self.RUNNING)
+
+
+class Render(models.Model):
+    job = models.ForeignKey(Job, related_name='renders')
+    name = models.CharField(max_length=255)
+    path = models.CharField(max_length=255)
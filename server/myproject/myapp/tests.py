@@ -1,3 +1,32 @@
-from django.test import TestCase
+import numpy as np
+import tensorflow as tf
+from django.test import SimpleTestCase
 
-# Create your tests here.
+import myproject.myapp.colornet
+from engine import ImagePipeline
+
+
+class ImagePipelineTests(SimpleTestCase):
+
+    def setUp(self):
+        # Encode a random color image to feed through the pipeline
+        with tf.Graph().as_default(), tf.Session() as sess:
+            image = tf.placeholder(tf.uint8, shape=[300, 400, 3])
+            self.contents = sess.run(tf.image.encode_jpeg(image), feed_dict={
+                    image: np.random.randint(0, 256, size=(300, 400, 3))})
+
+    def test_graph_does_not_grow(self):
+        with tf.Graph().as_default() as graph, tf.Session() as sess:
+            pipeline = ImagePipeline(sess)
+            num_nodes = len(graph.as_graph_def().node)
+
+            chroma = np.random.rand(4, 224, 224, 2).astype(np.float32)
+            for _ in range(1000):
+                original, grayscale_rgb, luma = pipeline.preprocess(
+                        [self.contents])
+                rgb = pipeline.postprocess(np.repeat(luma, 4, axis=0), chroma)
+
+            self.assertEqual(len(graph.as_graph_def().node), num_nodes)
+            self.assertEqual(original.shape, (1, 224, 224, 3))
+            self.assertEqual(grayscale_rgb.shape, (1, 224, 224, 3))
+            self.assertEqual(rgb.shape, (4, 224, 224, 3))
@@ -1,7 +1,13 @@
 # -*- coding: utf-8 -*-
 from django.conf.urls import url
-from myproject.myapp.views import list
+from myproject.myapp.views import (list, job, job_status, profile, ready,
+                                   colorize)
 
 urlpatterns = [
-    url(r'^list/$', list, name='list')
+    url(r'^list/$', list, name='list'),
+    url(r'^jobs/(?P<job_id>\d+)/$', job, name='job'),
+    url(r'^jobs/(?P<job_id>\d+)/status/$', job_status, name='job_status'),
+    url(r'^profile/$', profile, name='profile'),
+    url(r'^ready/$', ready, name='ready'),
+    url(r'^colorize/$', colorize, name='colorize'),
 ]
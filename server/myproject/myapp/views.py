@@ -1,36 +1,94 @@
 # -*- coding: utf-8 -*-
-from django.shortcuts import render
+from django.shortcuts import render, get_object_or_404
 from django.template import RequestContext
-from django.http import HttpResponseRedirect
+from django.http import (Http404, HttpResponse, HttpResponseNotAllowed,
+                         HttpResponseRedirect, JsonResponse)
 from django.core.urlresolvers import reverse
 
-from myproject.myapp.models import Document
+from myproject.myapp.models import Document, Job
 from myproject.myapp.forms import DocumentForm
+from myproject.myapp import cache, jobs
 
+# Importing this does not load TensorFlow, which waits for the engine
 import myproject.myapp.colornet.test as net
 
-
-renders = []
+# The number of recent jobs listed under the upload form
+NUM_RECENT_JOBS = 10
     
 def list(request):
     # Handle file upload
     if request.method == 'POST':
         form = DocumentForm(request.POST, request.FILES)
         if form.is_valid():
-            newdoc = Document(docfile=request.FILES['docfile'])
-            newdoc.save()
-
-            global renders
-            renders = net.run('./' + newdoc.docfile.url)
-            
-            # Redirect to the document list after POST
-            return HttpResponseRedirect(reverse('list'))
+            # Store each distinct image once, reusing earlier uploads of it
+            docfile = request.FILES['docfile']
+            digest = cache.file_digest(docfile)
+            newdoc = Document.objects.filter(digest=digest).first()
+            if newdoc is None:
+                newdoc = Document(docfile=docfile, digest=digest)
+                newdoc.save()
+
+            # Queue the colorization, and return the job right away
+            job = Job.objects.create(document=newdoc)
+            try:
+                jobs.submit(job)
+            except jobs.QueueFull:
+                job.status = Job.FAILED
+                job.error = 'The server is too busy, try again later.'
+                job.save()
+                if request.is_ajax():
+                    return JsonResponse(jobs.describe(job), status=503)
+
+            if request.is_ajax():
+                return JsonResponse(jobs.describe(job), status=202)
+
+            # Redirect to the job's page after POST
+            return HttpResponseRedirect(reverse('job', args=[job.id]))
     else:
         form = DocumentForm()  # A empty, unbound form
 
-    # Render list page with the documents and the form
+    # Render list page with the recent jobs and the form
     return render(
         request,
         'list.html',
-        {'renders': renders, 'form': form}
+        {'jobs': Job.objects.order_by('-created')[:NUM_RECENT_JOBS],
+         'form': form}
     )
+
+def job(request, job_id):
+    # Render the job's page, which refreshes itself until the job is done
+    job = get_object_or_404(Job, pk=job_id)
+    return render(request, 'job.html', {'job': job})
+
+def job_status(request, job_id):
+    job = get_object_or_404(Job, pk=job_id)
+    return JsonResponse(jobs.describe(job))
+
+def profile(request):
+    # Report the times of the stages of the colorizations so far
+    if net.profiler is None:
+        raise Http404('Profiling is off, set COLORIZATION_PROFILE to turn it on')
+    return HttpResponse(net.profiler.table(), content_type='text/plain')
+
+def colorize(request):
+    # Colorize the uploaded image right away, and respond with the encoded
+    # render of the combined output, without queueing or storing anything
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    form = DocumentForm(request.POST, request.FILES)
+    if not form.is_valid():
+        return JsonResponse({'errors': form.errors}, status=400)
+
+    try:
+        combined, = net.render_contents(request.FILES['docfile'].read(),
+                                        labels=['combined'])
+    except net.DecodeError as error:
+        return JsonResponse({'errors': {'docfile': [str(error)]}},
+                            status=400)
+    return HttpResponse(combined, content_type=net.content_type())
+
+def ready(request):
+    # Report whether this worker has the ensemble loaded and warm, so that
+    # load balancers only send it uploads once it does
+    status = net.status()
+    return JsonResponse(status, status=200 if status['ready'] else 503)
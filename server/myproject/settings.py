@@ -111,3 +111,63 @@ MEDIA_URL = '/media/'
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/1.8/howto/static-files/
 STATIC_URL = '/static/'
+
+# Colorization jobs
+# The number of worker threads running the ensemble over uploaded images, and
+# the number of jobs that can wait for one before uploads are turned away
+COLORIZATION_WORKERS = 1
+COLORIZATION_MAX_QUEUED_JOBS = 64
+
+# The renders are cached by the contents of the uploaded image and the model
+# version, and the least recently used are removed past this many bytes
+COLORIZATION_CACHE_DIR = os.path.join('media', 'Colorizations', 'cache')
+COLORIZATION_CACHE_BYTES = 1 << 30
+
+# Time the stages of every colorization, reported at /myapp/profile/, and
+# write a Chrome trace of each into the trace directory if one is set
+COLORIZATION_PROFILE = False
+COLORIZATION_TRACE_DIR = None
+
+# The precision to run the ensemble in: 'float32' from the checkpoints, or the
+# 'float16' or 'int8' ensemble exported by scripts/quantize_ensemble.py
+COLORIZATION_PRECISION = 'float32'
+
+# Load the float32 ensemble from the frozen ensemble exported by
+# scripts/freeze_ensemble.py, rather than from the checkpoints
+COLORIZATION_FROZEN = False
+
+# Render at the full size of the uploaded images, by upsampling the chroma
+# that the ensemble predicts at 224x224, rather than at 224x224
+COLORIZATION_FULL_SIZE = False
+
+# Encode the renders as 'png', 'jpeg' or 'webp', at the given quality for the
+# lossy formats, and only render the combined output of the ensemble, rather
+# than that of each model as well, if set
+COLORIZATION_RENDER_FORMAT = 'png'
+COLORIZATION_RENDER_QUALITY = 90
+COLORIZATION_COMBINED_ONLY = False
+
+# Load and warm up the ensemble when the WSGI application is loaded, rather
+# than on the first upload. A preforking server that loads the application
+# before forking (gunicorn -c gunicorn.conf.py) then builds it once, and its
+# workers only open a session over it, each with its own copy of the weights.
+# /myapp/ready/ reports when a worker is warm, and its resident memory.
+COLORIZATION_PRELOAD = False
+
+# Log the errors of the colorization jobs, whose details are not shown to
+# clients, to the console
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'myproject': {
+            'handlers': ['console'],
+            'level': 'INFO',
+        },
+    },
+}
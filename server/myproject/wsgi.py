@@ -14,3 +14,11 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "myproject.settings")
 
 application = get_wsgi_application()
+
+# Load the ensemble now if configured, which is before a preforking server
+# forks its workers when it loads the application first
+from django.conf import settings
+
+if getattr(settings, 'COLORIZATION_PRELOAD', False):
+    import myproject.myapp.colornet.test as net
+    net.preload()
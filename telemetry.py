@@ -0,0 +1,137 @@
+"""
+Training telemetry, written from a background thread.
+
+The training loop hands summaries, scalar metrics and sample images to a
+Telemetry object, which queues them for a background thread that writes them
+to an event file and to image files. The queue is bounded, and anything that
+does not fit in it is dropped rather than waited for, so telemetry never slows
+training down.
+
+The Throughput object accumulates the timings of the training steps between
+reports, along with how full the input queues were and samples of the share of
+a step spent waiting for the input batches, which tell whether training is
+limited by its input.
+
+Use:
+    telemetry = Telemetry(summary_dir)
+    telemetry.add_scalars({'step_time': 0.5}, step)
+    telemetry.save_image('summary/0_1.jpg', image)
+    telemetry.close()
+"""
+
+import threading
+import numpy as np
+import tensorflow as tf
+from matplotlib import image as mpimg
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+# The number of items that can wait to be written before new ones are dropped
+MAX_QUEUED = 256
+
+
+class Telemetry(object):
+    """Writes summaries, scalars and images from a background thread."""
+
+    def __init__(self, summary_dir, max_queued=MAX_QUEUED):
+        self.writer = tf.summary.FileWriter(summary_dir)
+        self.items = queue.Queue(max_queued)
+        self.dropped = 0
+        self.thread = threading.Thread(target=self._write_items)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def add_summary(self, summary, step):
+        """Queues the given serialized Summary of the given step."""
+        self._put(self.writer.add_summary, summary, step)
+
+    def add_scalars(self, scalars, step):
+        """Queues the given dictionary of scalar values of the given step, which
+        are written as summaries tagged with their keys."""
+        self._put(self._write_scalars, dict(scalars), step)
+
+    def save_image(self, image_path, image):
+        """Queues the given image ndarray to be saved to the given path."""
+        self._put(mpimg.imsave, image_path, image)
+
+    def close(self):
+        """Writes the queued items, and stops the background thread."""
+        self.items.put(None)
+        self.thread.join()
+        self.writer.close()
+        if self.dropped:
+            print("Dropped {} telemetry items that could not be written in "
+                    "time".format(self.dropped))
+
+    def _put(self, function, *args):
+        try:
+            self.items.put_nowait((function, args))
+        except queue.Full:
+            self.dropped += 1
+
+    def _write_scalars(self, scalars, step):
+        summary = tf.Summary(value=[tf.Summary.Value(tag=tag,
+                simple_value=float(value)) for tag, value in
+                sorted(scalars.items())])
+        self.writer.add_summary(summary, step)
+
+    def _write_items(self):
+        while True:
+            item = self.items.get()
+            if item is None:
+                return
+            function, args = item
+            try:
+                function(*args)
+            except Exception as error:
+                print("Failed to write telemetry: {}".format(error))
+
+
+class Throughput(object):
+    """Accumulates the timings of training steps between reports."""
+
+    def __init__(self):
+        # The share of a step spent waiting for its input, as last sampled,
+        # which is reported until the next sample
+        self.input_wait_fraction = float('nan')
+        self.reset()
+
+    def reset(self):
+        self.step_times = []
+        self.input_samples = []
+        self.queue_fills = []
+        self.num_images = 0
+
+    def add(self, step_time, input_time, queue_fill, num_images):
+        """Adds the timings of a step, which took step_time seconds, when the
+        input queues were queue_fill full, and which trained on num_images
+        images. The input of only some of the steps is timed: input_time is
+        the time that a step spent waiting for its input, or None if that was
+        not timed."""
+        self.step_times.append(step_time)
+        if input_time is not None:
+            self.input_samples.append((input_time, step_time))
+        self.queue_fills.append(queue_fill)
+        self.num_images += num_images
+
+    def report(self):
+        """Returns a dictionary of the metrics of the steps since the last
+        report, and starts accumulating anew."""
+        total_time = sum(self.step_times)
+        if self.input_samples:
+            input_times, step_times = zip(*self.input_samples)
+            self.input_wait_fraction = sum(input_times) / max(sum(step_times),
+                    1e-12)
+        metrics = {
+            'throughput/images_per_sec': self.num_images / max(total_time,
+                    1e-12),
+            'throughput/step_time': np.mean(self.step_times),
+            'throughput/step_time_max': np.max(self.step_times),
+            'throughput/input_wait_fraction': self.input_wait_fraction,
+            'throughput/queue_fill': np.mean(self.queue_fills),
+        }
+        self.reset()
+        return metrics
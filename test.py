@@ -2,11 +2,16 @@
 
 import os
 import glob
-import tensorflow as tf
 from matplotlib import pyplot as plt
-from matplotlib import colors
-import numpy as np
 from argparse import ArgumentParser
+from engine import BATCH_SIZE, MODEL_DIR, ColorizationEngine, SAT_WEIGHTS
+from profiler import Profiler, profile_stage
+from quantize import FLOAT32, PRECISIONS
+from tiles import TILE_BUDGET, TILE_OVERLAP, read_pixels, write_png
+
+# The images colorized in tiled mode, which also takes the formats that store
+# raw RGB rows, which are read a band at a time
+TILED_PATTERNS = ['*.jpg', '*.png', '*.ppm', '*.tif', '*.tiff']
 
 def parse_arguments():
     parser = ArgumentParser(description="Runs the testing phase of image "
@@ -17,92 +22,57 @@ def parse_arguments():
     parser.add_argument("output_dir", type=str, help="The output directory to "
         "place the results of testing into. The results are the grayscale, "
         "test result, and original images concatenated together.")
-    return parser.parse_args()
-
-def concat_images(imga, imgb):
-    """
-    Combines two color image ndarrays side-by-side.
-    """
-    ha, wa = imga.shape[:2]
-    hb, wb = imgb.shape[:2]
-    max_height = np.max([ha, hb])
-    total_width = wa + wb
-    new_img = np.zeros(shape=(max_height, total_width, 3), dtype=np.float32)
-    new_img[:ha, :wa] = imga
-    new_img[:hb, wa:wa + wb] = imgb
-    return new_img
-
-
-def rgb2yuv(rgb):
-    """
-    Convert RGB image into YUV https://en.wikipedia.org/wiki/YUV
-    """
-    rgb2yuv_filter = tf.constant(
-        [[[[0.299, -0.169, 0.499],
-           [0.587, -0.331, -0.418],
-            [0.114, 0.499, -0.0813]]]])
-    rgb2yuv_bias = tf.constant([0., 0.5, 0.5])
-
-    temp = tf.nn.conv2d(rgb, rgb2yuv_filter, [1, 1, 1, 1], 'SAME')
-    temp = tf.nn.bias_add(temp, rgb2yuv_bias)
-
-    return temp
-
-
-def yuv2rgb(yuv):
-    """
-    Convert YUV image into RGB https://en.wikipedia.org/wiki/YUV
-    """
-    yuv = tf.mul(yuv, 255)
-    yuv2rgb_filter = tf.constant(
-        [[[[1., 1., 1.],
-           [0., -0.34413999, 1.77199996],
-            [1.40199995, -0.71414, 0.]]]])
-    yuv2rgb_bias = tf.constant([-179.45599365, 135.45983887, -226.81599426])
-    temp = tf.nn.conv2d(yuv, yuv2rgb_filter, [1, 1, 1, 1], 'SAME')
-    temp = tf.nn.bias_add(temp, yuv2rgb_bias)
-    temp = tf.maximum(temp, tf.zeros(temp.get_shape(), dtype=tf.float32))
-    temp = tf.minimum(temp, tf.mul(
-        tf.ones(temp.get_shape(), dtype=tf.float32), 255))
-    temp = tf.div(temp, 255)
-    return temp
-
-def recombine(predictions, weights):
-    """
-    Combines the output images from the 3 CNN's, where each one is biased to a
-    color channel, into a final output image. Recombination is done by
-    pixel-wise weighting, where the pixel value for any given CNN's output is
-    weighted as its relative saturation to the other two.
-    """
-    red_biased = predictions['red']
-    green_biased = predictions['green']
-    blue_biased = predictions['blue']
-    blue_green_biased = predictions['blue_green']
-
-    # Compute the pixel-wise saturation for each biased CNN output image
-    red_sats = weights['red'] * colors.rgb_to_hsv(red_biased)[:,:,1]
-    green_sats = weights['green'] * colors.rgb_to_hsv(green_biased)[:,:,1]
-    blue_sats = weights['blue'] * colors.rgb_to_hsv(blue_biased)[:,:,1]
-    blue_green_sats = (weights['blue_green'] *
-            colors.rgb_to_hsv(blue_green_biased)[:,:,1])
-
-    # Weight each CNN-bias by its relative saturations at each pixel
-    total_sats = red_sats + blue_sats + green_sats + blue_green_sats
-    red_weights = red_sats / total_sats
-    green_weights = green_sats / total_sats
-    blue_weights = blue_sats / total_sats
-    blue_green_weights = blue_green_sats / total_sats
-
-    # Rehsape the per-pixel weights so they can be multiplied with the image
-    new_shape = (red_weights.shape[0], red_weights.shape[1], 1)
-    red_weights = np.reshape(red_weights, new_shape)
-    green_weights = np.reshape(green_weights, new_shape)
-    blue_weights = np.reshape(blue_weights, new_shape)
-    blue_green_weights = np.reshape(blue_green_weights, new_shape)
-
-    # Compute the output image as the pixel-wise weighted sum of the biases
-    return (red_weights * red_biased + green_weights * green_biased +
-            blue_weights * blue_biased + blue_green_weights * blue_green_biased)
+    parser.add_argument("-b", "--batch-size", dest="batch_size", type=int,
+        default=BATCH_SIZE, help="The number of images to run through the "
+        "ensemble at once. Larger batches make better use of many cores.")
+    parser.add_argument("-m", "--moving-averages", dest="moving_averages",
+        action="store_true", help="Normalize with the moving averages of the "
+        "batch statistics kept by training, rather than the statistics of "
+        "each image. Use this for models trained with a batch size above 1.")
+    parser.add_argument("-s", "--full-size", dest="full_size",
+        action="store_true", help="Output the results at the full size of the "
+        "input images. The ensemble still runs at 224x224, and the chroma it "
+        "predicts is upsampled and combined with the full-size luminance.")
+    parser.add_argument("--tiled", dest="tiled", action="store_true",
+        help="Run the ensemble over overlapping 224x224 tiles of each image "
+        "at its own resolution, and blend their chroma, for images too large "
+        "to colorize in one piece. Only the colorized image is saved, as a "
+        "PNG image written a band of rows at a time.")
+    parser.add_argument("--tile-budget", dest="tile_budget", type=int,
+        default=TILE_BUDGET, help="The number of tiles run through the "
+        "ensemble at once in tiled mode, which caps the memory it uses.")
+    parser.add_argument("--tile-overlap", dest="tile_overlap", type=int,
+        default=TILE_OVERLAP, help="The number of pixels that neighboring "
+        "tiles overlap by in tiled mode, over which they are blended.")
+    parser.add_argument("-f", "--frozen", dest="frozen", action="store_true",
+        help="Load the frozen float32 ensemble exported into the model "
+        "directory by scripts/freeze_ensemble.py, rather than the checkpoints, "
+        "which loads faster and runs leaner.")
+    parser.add_argument("--precision", dest="precision", default=FLOAT32,
+        choices=PRECISIONS, help="The precision to run the ensemble in. The "
+        "float16 and int8 ensembles are the ones exported into the model "
+        "directory by scripts/quantize_ensemble.py.")
+    parser.add_argument("-p", "--profile", dest="profile", action="store_true",
+        help="Time each stage of the colorization of every image, and print "
+        "the median, 95th percentile and maximum times of each stage at the "
+        "end. The stages are run one at a time, which is a little slower.")
+    parser.add_argument("-t", "--trace-dir", dest="trace_dir", default=None,
+        type=str, help="Also write the TensorFlow step statistics of each "
+        "batch into this directory as a Chrome trace, when profiling.")
+    args = parser.parse_args()
+    if args.batch_size < 1:
+        parser.error("The batch size must be positive")
+    if args.tiled and args.full_size:
+        parser.error("--tiled already runs at the full size of the images")
+    return args
+
+# Function to colorize the given image in tiles, writing the colorization to
+# the given PNG image a band of rows at a time, as the bands are done
+def colorize_tiled(engine, image_path, output_path, tile_budget, overlap):
+    pixels = read_pixels(image_path)
+    height, width = pixels.shape[:2]
+    write_png(output_path, width, height, engine.colorize_tiled(pixels,
+            tile_budget, overlap))
 
 def main():
     args = parse_arguments()
@@ -111,80 +81,53 @@ def main():
     if not os.path.exists(args.output_dir):
         os.mkdir(args.output_dir)
 
-    # How each biased model's saturations are weighted relative to the others
-    sat_weights = {
-        'red': 1 / 8.0,
-        'green': 7 / 32.0,
-        'blue': 7 / 32.0,
-        'blue_green': 7 / 16.0,
-    }
-
-    phase_train = tf.placeholder(tf.bool, name='phase_train')
-    uv = tf.placeholder(tf.uint8, name='uv')
+    profiler = None
+    if args.profile or args.trace_dir is not None:
+        profiler = Profiler(args.trace_dir)
 
     print("Starting TF session")
+    engine = ColorizationEngine(MODEL_DIR, SAT_WEIGHTS,
+            moving_averages=args.moving_averages, profiler=profiler,
+            precision=args.precision, frozen=args.frozen)
 
-    with tf.Session() as sess:
-        saver = tf.train.import_meta_graph('model/model_blue.meta')
-
-        image_paths = glob.glob(os.path.join(args.image_dir, "*.jpg"))
+    if args.tiled:
+        image_paths = sorted(image_path for pattern in TILED_PATTERNS for
+                image_path in glob.glob(os.path.join(args.image_dir, pattern)))
         print(image_paths)
-        for image_path in sorted(image_paths):
-            predictions = dict()
-            print("\nEvaluating image '{}':".format(image_path))
-
-            for color in ['red', 'green', 'blue', 'blue_green']:
-                print("\tRunning {}-biased colornet CNN model...".format(color))
-                
-                print("restore color model", color)
-                saver.restore(sess, 'model/model_%s' % color)
-
-                print("get graph")
-                graph = tf.get_default_graph()
-
-                print("read file", image_path)
-                contents = tf.read_file(image_path)
-                uint8image = tf.image.decode_jpeg(contents, channels=3)
-                resized_image = tf.div(tf.image.resize_images(uint8image, (224, 224)), 255)
-                
-                print("get resized image")
-                img = sess.run(resized_image)
-
-                print("get soigmoid tensor")
-                pred = graph.get_tensor_by_name("colornet_1/conv2d_4/Sigmoid:0")
-
-                grayscale = tf.image.rgb_to_grayscale(resized_image)
-                grayscale = tf.reshape(grayscale, [1, 224, 224, 1])
-                grayscale_rgb = tf.image.grayscale_to_rgb(grayscale)
-                grayscale_yuv = rgb2yuv(grayscale_rgb)
-                grayscale = tf.concat(3, [grayscale, grayscale, grayscale])
-
-                pred_yuv = tf.concat(3, [tf.split(3, 3, grayscale_yuv)[0], pred])
-                pred_rgb = yuv2rgb(pred_yuv)
-
-                print("get grayscaled image")
-                input_image = sess.run(grayscale)
-
-                feed_dict = {phase_train : False, uv: 3, graph.get_tensor_by_name('concat:0') : input_image}
-
-                pred_, pred_rgb_, colorimage_, grayscale_rgb_ = sess.run(
-                    [pred, pred_rgb, resized_image, grayscale_rgb], feed_dict=feed_dict)
-
-                predictions[color] = pred_rgb_[0]
-
-            # Combine the three color-baised images into a final response
-            print("\tCombining the biased CNN outputs into a final image...")
-            output = recombine(predictions, sat_weights)
+        for image_path in image_paths:
+            # Save the colorization as a PNG image with the same name
+            image_name = os.path.splitext(os.path.basename(image_path))[0]
+            output_image_path = os.path.join(args.output_dir,
+                    image_name + '.png')
+            print("\nColorizing image '{}' in tiles into '{}'...".format(
+                    image_path, output_image_path))
+            colorize_tiled(engine, image_path, output_image_path,
+                    args.tile_budget, args.tile_overlap)
+    else:
+        image_paths = sorted(glob.glob(os.path.join(args.image_dir,
+                "*.jpg")))
+        print(image_paths)
+        results = engine.colorize_many(image_paths, args.batch_size,
+                full_size=args.full_size, colors=[])
+        for image_path, result in zip(image_paths, results):
+            print("\nEvaluated image '{}':".format(image_path))
 
             # Concatenate the grayscale, result, and original images together
-            output_image = concat_images(grayscale_rgb_[0], output)
-            output_image = concat_images(output_image, img)
+            output_image = result.composite()
 
             # Save the output image to the directory with the same name
             image_name = os.path.basename(image_path)
             output_image_path = os.path.join(args.output_dir, image_name)
-            print("\tSaving the evaluation to '{}'...".format(output_image_path))
-            plt.imsave(output_image_path, output_image)
+            print("\tSaving the evaluation to '{}'...".format(
+                    output_image_path))
+            with profile_stage(profiler, 'encode'):
+                plt.imsave(output_image_path, output_image)
+
+    engine.close()
+
+    if profiler is not None:
+        print("\nTime per image of each stage (ms):")
+        print(profiler.table())
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,160 @@
+"""
+Tiled inference over images too large to colorize in one piece.
+
+The network only runs on 224x224 images, so a large image is cut into
+overlapping 224x224 tiles at its own resolution, which are run through the
+ensemble a batch at a time. The chroma predicted for the tiles is blended into
+the image with feathered weights, which fall off towards the edges of each
+tile, so the seams between tiles do not show.
+
+Only a band of rows one tile high is blended at a time. Once a row of tiles is
+done, the rows above the next row of tiles are final, and are handed back, so
+the memory used does not grow with the height of the image, and the ensemble
+never runs over more than the tile budget at once.
+
+The colorized bands are written out as a PNG image as they are done, so the
+output is never held whole. Images that store their pixels as raw RGB rows,
+such as PPM and uncompressed TIFF images, are mapped into memory rather than
+decoded, so only the rows of the tiles being run are read. Other images are
+decoded whole, as uint8 pixels.
+
+Use:
+    pixels = read_pixels(image_path)
+    for top, chroma in blend_tiles(pixels, predict, tile_budget):
+        (the chroma of the rows from top on is final)
+    write_png(output_path, width, height, bands)
+"""
+
+import struct
+import zlib
+
+import numpy as np
+from PIL import Image
+
+# The size of the tiles, which is the size that the network runs at
+TILE_SIZE = 224
+
+# How many pixels neighboring tiles overlap by, over which they are blended
+TILE_OVERLAP = 32
+
+# The number of tiles run through the ensemble at once by default
+TILE_BUDGET = 8
+
+# The zlib compression level of the PNG images written
+PNG_COMPRESSION = 6
+
+# Archive scans are far past the size PIL takes to be a decompression bomb
+Image.MAX_IMAGE_PIXELS = None
+
+
+def tile_origins(length, tile_size=TILE_SIZE, overlap=TILE_OVERLAP):
+    """Returns the offsets of the tiles that cover the given length, where
+    neighboring tiles overlap by at least the given overlap, and the last tile
+    ends at the end. A length shorter than a tile has a single tile."""
+    if overlap >= tile_size:
+        raise ValueError("The tiles must overlap by less than their size")
+    last = max(length - tile_size, 0)
+    origins = list(range(0, last, tile_size - overlap))
+    return origins + [last]
+
+
+def feather(tile_size=TILE_SIZE, overlap=TILE_OVERLAP):
+    """Returns the tile_size x tile_size x 1 blending weights of a tile, which
+    ramp up linearly over the overlap at each edge. The weights never reach
+    zero, so the edges of the image, which only one tile covers, still have
+    weight."""
+    ramp = np.minimum(np.arange(1, tile_size + 1), np.arange(tile_size, 0, -1))
+    ramp = np.minimum(ramp / float(overlap + 1), 1.0)
+    return np.outer(ramp, ramp)[:, :, np.newaxis].astype(np.float32)
+
+
+def extract_tile(pixels, top, left, tile_size=TILE_SIZE):
+    """Returns the tile of the given image at the given offsets, padded by
+    repeating the edges of the image where it is smaller than a tile."""
+    tile = pixels[top:top + tile_size, left:left + tile_size]
+    height, width = tile.shape[:2]
+    if height < tile_size or width < tile_size:
+        tile = np.pad(tile, [(0, tile_size - height), (0, tile_size - width),
+                (0, 0)], 'edge')
+    return tile
+
+
+def blend_tiles(pixels, predict, tile_budget=TILE_BUDGET,
+        overlap=TILE_OVERLAP, tile_size=TILE_SIZE):
+    """Runs the given predict function over the tiles of the given HxWx3
+    image, and yields the blended chroma of the image as (top, chroma) bands
+    of rows, from the top of the image down.
+
+    The predict function is given an N x tile_size x tile_size x 3 batch of at
+    most tile_budget tiles, and returns their chroma, with two channels."""
+    height, width = pixels.shape[:2]
+    rows = tile_origins(height, tile_size, overlap)
+    columns = tile_origins(width, tile_size, overlap)
+    weights = feather(tile_size, overlap)
+
+    # The blended chroma and the sum of the weights of the rows of the current
+    # row of tiles, which extend past the image when it is smaller than a tile
+    chroma = np.zeros((tile_size, max(width, tile_size), 2), np.float32)
+    total = np.zeros((tile_size, max(width, tile_size), 1), np.float32)
+
+    for i, top in enumerate(rows):
+        for start in range(0, len(columns), tile_budget):
+            lefts = columns[start:start + tile_budget]
+            tiles = np.array([extract_tile(pixels, top, left, tile_size)
+                    for left in lefts])
+            for left, tile_chroma in zip(lefts, predict(tiles)):
+                chroma[:, left:left + tile_size] += tile_chroma * weights
+                total[:, left:left + tile_size] += weights
+
+        # The rows above the next row of tiles are final
+        bottom = rows[i + 1] if i + 1 < len(rows) else height
+        done = bottom - top
+        yield top, chroma[:done, :width] / total[:done, :width]
+
+        # Move the rows that the next row of tiles overlaps to the top
+        chroma[:tile_size - done] = chroma[done:]
+        chroma[tile_size - done:] = 0
+        total[:tile_size - done] = total[done:]
+        total[tile_size - done:] = 0
+
+
+def read_pixels(image_path):
+    """Returns the pixels of the given image as an HxWx3 uint8 array, which is
+    a read-only memory map of the file when it stores raw RGB rows."""
+    with Image.open(image_path) as image:
+        width, height = image.size
+        if image.mode == 'RGB' and len(image.tile) == 1:
+            decoder, _, offset, args = image.tile[0]
+            if not isinstance(args, tuple):
+                args = (args, 0, 1)
+            if (decoder == 'raw' and args[0] == 'RGB' and
+                    args[1] in (0, width * 3) and args[2] == 1):
+                return np.memmap(image_path, np.uint8, 'r', offset,
+                        (height, width, 3))
+        return np.asarray(image.convert('RGB'))
+
+
+def _png_chunk(kind, data):
+    checksum = zlib.crc32(kind + data) & 0xffffffff
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I',
+            checksum)
+
+
+def write_png(path, width, height, bands):
+    """Writes the given (top, rows) bands of uint8 RGB rows, from the top of
+    the image down, as a PNG image of the given size, compressing each band
+    as it arrives."""
+    compressor = zlib.compressobj(PNG_COMPRESSION)
+    with open(path, 'wb') as png_file:
+        png_file.write(b'\x89PNG\r\n\x1a\n')
+        png_file.write(_png_chunk(b'IHDR', struct.pack('>IIBBBBB', width,
+                height, 8, 2, 0, 0, 0)))
+        for _, rows in bands:
+            # Every row starts with the type of its filter, which is none
+            scanlines = np.zeros((len(rows), width * 3 + 1), np.uint8)
+            scanlines[:, 1:] = rows.reshape(len(rows), -1)
+            data = compressor.compress(scanlines.tobytes())
+            if data:
+                png_file.write(_png_chunk(b'IDAT', data))
+        png_file.write(_png_chunk(b'IDAT', compressor.flush()))
+        png_file.write(_png_chunk(b'IEND', b''))
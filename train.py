@@ -1,57 +1,231 @@
 import tensorflow as tf
 import numpy as np
 import glob
+import time
+from contextlib import contextmanager
 from os import path, makedirs
-from matplotlib import pyplot as plt
-from batchnorm import ConvolutionalBatchNormalizer
+from model import (VGG_MODEL_PATH, colornet, colornet_weights, load_vgg,
+        rgb2yuv, vgg_features, yuv2rgb)
+from dataset import COLOR_BINS, read_manifest, read_shard_index
+from checkpoint import (KEEP_CHECKPOINTS, CheckpointWriter,
+        latest_checkpoint, saved_step)
+from distributed import (PS_JOB, SyncGradients, WORKER_JOB, cluster_spec,
+        device_setter, shard)
+from telemetry import Telemetry, Throughput
 from argparse import ArgumentParser
 
 # Default values for parameters
 NUM_EPOCHS = 1e+9
 IMAGE_SAVE_RATE = 1000
 MODEL_SAVE_RATE = 100000
+LOG_RATE = 1
+SUMMARY_RATE = 100
 FINAL_MODEL_PATH = 'final.tfmodel'
+MODEL_DIR = 'model'
+BATCH_SIZE = 1
+
+# The learning rate for a batch of one image, which is scaled linearly with the
+# batch size, so the step taken per image stays the same
+BASE_LEARNING_RATE = 5 * 0.0001
+
+# How the squared errors of the U and V chroma channels are weighted in the loss
+UV_WEIGHTS = (0.5, 0.5)
 
 # Command-line arguments
 parser = ArgumentParser(description="Trains a recolorization CNN with the "
         "given parameters under the images in rgb_imgs/. The model is "
-        "incrementally saved to model.chkpt.")
+        "incrementally saved to model.chkpt. With --ensemble, the models of "
+        "every color bin are trained together instead.")
 parser.add_argument("image_dir", type=str, help="The directory "
-        "containing the JPEG images to run testing on.")
+        "containing the JPEG images to train on, or a manifest written by "
+        "scripts/color_sort.py, to train on the images of one of its bins. "
+        "With --ensemble, the directory holds a subdirectory of images per "
+        "color bin.")
 parser.add_argument("summary_dir", type=str, help="The output directory to "
         "place the intermediate results of training into. The results are the "
         "grayscale, training result, and original images concatenated together "
         "at the every image_save_rate steps.")
 parser.add_argument("-f", "--final-model", dest='final_model_path',
         default=FINAL_MODEL_PATH, type=str, help="The path to the file to "
-        "store the final model in after training is completed or stopped. This "
-        "will also save a TensorFlow meta file under <final_model>.meta.")
+        "store the final model in after training is completed or stopped. The "
+        "incremental models are saved next to it, under <final_model>-<step>.")
 parser.add_argument("-e", "--epochs", dest='num_epochs', default=NUM_EPOCHS,
         type=int, help="The number of epochs to run training for. An epoch is "
         "a complete iteration over all the input images.")
 parser.add_argument("-i", "--image-save-rate", dest="image_save_rate", type=int,
         default=IMAGE_SAVE_RATE, help="How often to save an image while "
-        "training. Every N images will be saved to 'summary/'.")
+        "training. Every N images will be saved to 'summary/' in the "
+        "background.")
 parser.add_argument("-m", "--model-save-rate", dest="model_save_rate", type=int,
-        default=MODEL_SAVE_RATE, help="How often to update the increment model "
-        "that has been trained so far. After every N images are processed, the "
-        "model will be saved to 'model.chkpt'")
+        default=MODEL_SAVE_RATE, help="How often to save the increment model "
+        "that has been trained so far. After every N steps, the model is saved "
+        "to <final_model>-<step> in the background, while training goes on.")
+parser.add_argument("-k", "--keep-checkpoints", dest="keep_checkpoints",
+        type=int, default=KEEP_CHECKPOINTS, help="The number of the latest "
+        "increment models to keep for each model. Older ones are removed. With "
+        "0, all of them are kept.")
+parser.add_argument("-r", "--resume", dest="resume", action="store_true",
+        help="Resume training from the latest increment or final model saved "
+        "for each model, restoring its weights, batch normalization averages "
+        "and global step.")
+parser.add_argument("-l", "--log-rate", dest="log_rate", type=int,
+        default=LOG_RATE, help="How often to print the training loss and "
+        "throughput. Every N steps, the mean loss, the images trained per "
+        "second and how full the input queues were since the last print, and "
+        "the share of the time spent waiting on input as last sampled, are "
+        "shown, and written to the summaries.")
+parser.add_argument("--summary-rate", dest="summary_rate", type=int,
+        default=SUMMARY_RATE, help="How often to write the TensorFlow "
+        "summaries of the weights, the loss and sample images into "
+        "summary_dir, for TensorBoard. The timings of every step are written "
+        "there as well, and the time spent waiting on input is sampled at "
+        "this rate.")
+parser.add_argument("-b", "--bin", dest="color_bin", default=None,
+        choices=COLOR_BINS, help="The color bin of the manifest to train on, "
+        "when training from a manifest. By default, all of its images are "
+        "used.")
+parser.add_argument("-s", "--shards", dest="shards", action="store_true",
+        help="Read the images of the --bin color bin from the shards packed "
+        "into image_dir by scripts/pack_dataset.py, instead of decoding JPEG "
+        "images on every step.")
+parser.add_argument("--batch-size", dest="batch_size", type=int,
+        default=BATCH_SIZE, help="The number of images in each training step. "
+        "Batch normalization uses the statistics of the whole batch, and the "
+        "learning rate is scaled with the batch size. Larger batches make "
+        "better use of many cores.")
+parser.add_argument("--uv-weights", dest="uv_weights", type=float, nargs=2,
+        default=UV_WEIGHTS, metavar=("U", "V"), help="How the errors of the U "
+        "and V chroma channels are weighted in the loss. Both channels are "
+        "trained in the same step.")
+parser.add_argument("--ensemble", dest="ensemble", action="store_true",
+        help="Train the models of all of the color bins at once, sharing the "
+        "VGG16 trunk between them. Each model is trained for the given number "
+        "of epochs over its own bin, and saved to <model_dir>/model_<bin>.")
+parser.add_argument("-d", "--model-dir", dest="model_dir", default=MODEL_DIR,
+        type=str, help="The directory to store the final models in with "
+        "--ensemble, in the layout that test.py loads them from.")
+parser.add_argument("--ps-hosts", dest="ps_hosts", default=None, type=str,
+        help="The comma-separated host:port addresses of the parameter "
+        "servers, when training with several processes.")
+parser.add_argument("--worker-hosts", dest="worker_hosts", default=None,
+        type=str, help="The comma-separated host:port addresses of the "
+        "workers, when training with several processes. Each worker trains on "
+        "its own part of the images, and their gradients are averaged on every "
+        "step. Use scripts/train_cluster.py to run them all on one machine.")
+parser.add_argument("--job-name", dest="job_name", default=WORKER_JOB,
+        choices=[PS_JOB, WORKER_JOB], help="Whether this process is a "
+        "parameter server or a worker, when training with several processes.")
+parser.add_argument("--task-index", dest="task_index", default=0, type=int,
+        help="The index of this process among the parameter servers or the "
+        "workers. Worker 0 is the chief, which saves the models and images.")
+parser.add_argument("--threads", dest="num_threads", default=None, type=int,
+        help="The number of threads that each operation runs on. By default, "
+        "TensorFlow uses every core, which oversubscribes the cores when "
+        "several workers run on one machine.")
+parser.add_argument("--max-steps", dest="max_steps", default=None, type=int,
+        help="Stop training after the given number of steps, regardless of "
+        "the number of epochs.")
+parser.add_argument("--vgg-model", dest="vgg_model_path",
+        default=VGG_MODEL_PATH, type=str, help="The frozen VGG16 model to "
+        "build the colornet network on top of.")
 args = parser.parse_args()
-
-filenames = sorted(glob.glob(path.join(args.image_dir, "*.jpg")))
-batch_size = 1
+if args.batch_size < 1:
+    parser.error("--batch-size must be at least 1")
+if args.ensemble and args.color_bin is not None:
+    parser.error("--ensemble trains every color bin, so it takes no --bin")
+if args.shards and args.color_bin is None and not args.ensemble:
+    parser.error("--shards requires the --bin to train on")
+
+# The configuration of the session, and of the server when there is one
+config = tf.ConfigProto()
+if args.num_threads is not None:
+    config.intra_op_parallelism_threads = args.num_threads
+    config.inter_op_parallelism_threads = args.num_threads
+
+# When training with several processes, start this process's server, which
+# is all that a parameter server does
+distributed = args.worker_hosts is not None
+if distributed:
+    if args.ps_hosts is None:
+        parser.error("--worker-hosts requires the --ps-hosts")
+    cluster = cluster_spec(args.ps_hosts.split(','),
+            args.worker_hosts.split(','))
+    server = tf.train.Server(cluster, job_name=args.job_name,
+            task_index=args.task_index, config=config)
+    if args.job_name == PS_JOB:
+        server.join()
+    num_workers = cluster.num_tasks(WORKER_JOB)
+    task_index = args.task_index
+else:
+    num_workers = 1
+    task_index = 0
+is_chief = task_index == 0
+
+
+def training_images(color_bin):
+    """Returns this worker's part of the files to read the images of the given
+    color bin from, the number of images in all of the files, and their size if
+    they are shards."""
+    if args.shards:
+        image_size, shards = read_shard_index(args.image_dir, color_bin)
+        filenames = [shard_path for shard_path, _ in shards]
+        num_images = sum(num_records for _, num_records in shards)
+    else:
+        image_size = None
+        if path.isfile(args.image_dir):
+            filenames = sorted(row['path'] for row in
+                    read_manifest(args.image_dir, color_bin))
+        elif args.ensemble:
+            filenames = sorted(glob.glob(path.join(args.image_dir, color_bin,
+                    "*.jpg")))
+        else:
+            filenames = sorted(glob.glob(path.join(args.image_dir, "*.jpg")))
+        num_images = len(filenames)
+    return shard(filenames, task_index, num_workers), num_images, image_size
+
+
+# The models being trained, named after their color bin, or a single model
+# named None when not training the ensemble
+heads = COLOR_BINS if args.ensemble else [None]
+num_heads = len(heads)
+inputs = dict((head, training_images(head if args.ensemble else
+        args.color_bin)) for head in heads)
+for head in heads:
+    if not inputs[head][0]:
+        parser.error("There are no {} to train on{}".format(
+                'shards' if args.shards else 'images',
+                '' if head is None else ' for the ' + head + ' model') +
+                (" for each of the workers" if distributed else ""))
+batch_size = args.batch_size
 num_epochs = args.num_epochs
 image_save_rate = args.image_save_rate
 model_save_rate = args.model_save_rate
+log_rate = args.log_rate
+summary_rate = args.summary_rate
 
-global_step = tf.Variable(0, name='global_step', trainable=False)
-phase_train = tf.placeholder(tf.bool, name='phase_train')
-uv = tf.placeholder(tf.uint8, name='uv')
+# The models are trained for a number of steps each when several of them are
+# trained at once, or when several workers train them, so the input of every
+# model repeats forever, and the models are saved as soon as they are done.
+# Otherwise, a single model is trained until its input runs out of epochs.
+step_budgets = args.ensemble or distributed
 
 def read_my_file_format(filename_queue, randomize=False):
     reader = tf.WholeFileReader()
     key, file = reader.read(filename_queue)
     uint8image = tf.image.decode_jpeg(file, channels=3)
+    return crop_example(uint8image, randomize)
+
+
+def read_shard_format(filename_queue, image_size, randomize=False):
+    # Each record is the raw pixels of an image, so nothing is decoded
+    reader = tf.FixedLengthRecordReader(record_bytes=image_size * image_size * 3)
+    key, record = reader.read(filename_queue)
+    uint8image = tf.reshape(tf.decode_raw(record, tf.uint8),
+            (image_size, image_size, 3))
+    return crop_example(uint8image, randomize)
+
+
+def crop_example(uint8image, randomize=False):
     uint8image = tf.random_crop(uint8image, (224, 224, 3))
     if randomize:
         uint8image = tf.image.random_flip_left_right(uint8image)
@@ -60,85 +234,46 @@ def read_my_file_format(filename_queue, randomize=False):
     return float_image
 
 
-def input_pipeline(filenames, batch_size, num_epochs=None):
+def input_pipeline(filenames, batch_size, num_epochs=None, image_size=None):
     print("Image dir:", args.image_dir)
     print("Files:", filenames)
     print("Epochs:", num_epochs)
-    filename_queue = tf.train.string_input_producer(
-        filenames, num_epochs=num_epochs, shuffle=False)
-    example = read_my_file_format(filename_queue, randomize=False)
+    print("Batch size:", batch_size)
+    if args.shards:
+        # Visit the shards in a different order on every epoch
+        filename_queue = tf.train.string_input_producer(
+            filenames, num_epochs=num_epochs, shuffle=True)
+        example = read_shard_format(filename_queue, image_size,
+                randomize=False)
+    else:
+        filename_queue = tf.train.string_input_producer(
+            filenames, num_epochs=num_epochs, shuffle=False)
+        example = read_my_file_format(filename_queue, randomize=False)
     min_after_dequeue = 100
     capacity = min_after_dequeue + 3 * batch_size
-    example_batch = tf.train.shuffle_batch(
-        [example], batch_size=batch_size, capacity=capacity,
-        min_after_dequeue=min_after_dequeue)
-    return example_batch
-
-
-def batch_norm(x, depth, phase_train):
-    with tf.variable_scope('batchnorm'):
-        ewma = tf.train.ExponentialMovingAverage(decay=0.9999)
-        bn = ConvolutionalBatchNormalizer(depth, 0.001, ewma, True)
-        update_assignments = bn.get_assigner()
-        x = bn.normalize(x, train=phase_train)
-    return x
-
-
-def conv2d(_X, w, sigmoid=False, bn=False):
-    with tf.variable_scope('conv2d'):
-        _X = tf.nn.conv2d(_X, w, [1, 1, 1, 1], 'SAME')
-        if bn:
-            _X = batch_norm(_X, w.get_shape()[3], phase_train)
-        if sigmoid:
-            return tf.sigmoid(_X)
-        else:
-            _X = tf.nn.relu(_X)
-            return tf.maximum(0.01 * _X, _X)
 
-
-def colornet(_tensors):
-    """
-    Network architecture http://tinyclouds.org/colorize/residual_encoder.png
-    """
-    with tf.variable_scope('colornet'):
-        # Bx28x28x512 -> batch norm -> 1x1 conv = Bx28x28x256
-        conv1 = tf.nn.relu(tf.nn.conv2d(batch_norm(_tensors[
-                           "conv4_3"], 512, phase_train),
-            _tensors["weights"]["wc1"], [1, 1, 1, 1], 'SAME'))
-        # upscale to 56x56x256
-        conv1 = tf.image.resize_bilinear(conv1, (56, 56))
-        conv1 = tf.add(conv1, batch_norm(
-            _tensors["conv3_3"], 256, phase_train))
-
-        # Bx56x56x256-> 3x3 conv = Bx56x56x128
-        conv2 = conv2d(conv1, _tensors["weights"][
-                       'wc2'], sigmoid=False, bn=True)
-        # upscale to 112x112x128
-        conv2 = tf.image.resize_bilinear(conv2, (112, 112))
-        conv2 = tf.add(conv2, batch_norm(
-            _tensors["conv2_2"], 128, phase_train))
-
-        # Bx112x112x128 -> 3x3 conv = Bx112x112x64
-        conv3 = conv2d(conv2, _tensors["weights"][
-                       'wc3'], sigmoid=False, bn=True)
-        # upscale to Bx224x224x64
-        conv3 = tf.image.resize_bilinear(conv3, (224, 224))
-        conv3 = tf.add(conv3, batch_norm(_tensors["conv1_2"], 64, phase_train))
-
-        # Bx224x224x64 -> 3x3 conv = Bx224x224x3
-        conv4 = conv2d(conv3, _tensors["weights"][
-                       'wc4'], sigmoid=False, bn=True)
-        conv4 = tf.add(conv4, batch_norm(
-            _tensors["grayscale"], 3, phase_train))
-
-        # Bx224x224x3 -> 3x3 conv = Bx224x224x3
-        conv5 = conv2d(conv4, _tensors["weights"][
-                       'wc5'], sigmoid=False, bn=True)
-        # Bx224x224x3 -> 3x3 conv = Bx224x224x2
-        conv6 = conv2d(conv5, _tensors["weights"][
-                       'wc6'], sigmoid=True, bn=True)
-
-    return conv6
+    # Shuffle the examples through a queue, like shuffle_batch does, which is
+    # built here so how full it is can be reported
+    example_queue = tf.RandomShuffleQueue(capacity, min_after_dequeue,
+        [tf.float32], shapes=[example.get_shape()])
+    tf.train.add_queue_runner(tf.train.QueueRunner(example_queue,
+        [example_queue.enqueue([example])]))
+    example_batch = example_queue.dequeue_many(batch_size)
+    queue_fill = tf.cast(example_queue.size(), tf.float32) / capacity
+    return example_batch, queue_fill
+
+
+def split_batches(tensor, sizes):
+    """Splits the given batch into consecutive batches of the given sizes,
+    which are scalar tensors."""
+    batches = []
+    start = tf.constant(0)
+    rank = tensor.get_shape().ndims
+    for size in sizes:
+        batches.append(tf.slice(tensor, tf.pack([start] + [0] * (rank - 1)),
+                tf.pack([size] + [-1] * (rank - 1))))
+        start += size
+    return batches
 
 
 def concat_images(imga, imgb):
@@ -155,185 +290,434 @@ def concat_images(imga, imgb):
     return new_img
 
 
-def rgb2yuv(rgb):
-    """
-    Convert RGB image into YUV https://en.wikipedia.org/wiki/YUV
-    """
-    rgb2yuv_filter = tf.constant(
-        [[[[0.299, -0.169, 0.499],
-           [0.587, -0.331, -0.418],
-            [0.114, 0.499, -0.0813]]]])
-    rgb2yuv_bias = tf.constant([0., 0.5, 0.5])
-
-    temp = tf.nn.conv2d(rgb, rgb2yuv_filter, [1, 1, 1, 1], 'SAME')
-    temp = tf.nn.bias_add(temp, rgb2yuv_bias)
-
-    return temp
-
-
-def yuv2rgb(yuv):
-    """
-    Convert YUV image into RGB https://en.wikipedia.org/wiki/YUV
-    """
-    yuv = tf.mul(yuv, 255)
-    yuv2rgb_filter = tf.constant(
-        [[[[1., 1., 1.],
-           [0., -0.34413999, 1.77199996],
-            [1.40199995, -0.71414, 0.]]]])
-    yuv2rgb_bias = tf.constant([-179.45599365, 135.45983887, -226.81599426])
-    temp = tf.nn.conv2d(yuv, yuv2rgb_filter, [1, 1, 1, 1], 'SAME')
-    temp = tf.nn.bias_add(temp, yuv2rgb_bias)
-    temp = tf.maximum(temp, tf.zeros(temp.get_shape(), dtype=tf.float32))
-    temp = tf.minimum(temp, tf.mul(
-        tf.ones(temp.get_shape(), dtype=tf.float32), 255))
-    temp = tf.div(temp, 255)
-    return temp
-
-
-with open("vgg/tensorflow-vgg16/vgg16-20160129.tfmodel", mode='rb') as f:
-    fileContent = f.read()
-
-graph_def = tf.GraphDef()
-graph_def.ParseFromString(fileContent)
-
-with tf.variable_scope('colornet'):
-    # Store layers weight
-    weights = {
-        # 1x1 conv, 512 inputs, 256 outputs
-        'wc1': tf.Variable(tf.truncated_normal([1, 1, 512, 256], stddev=0.01)),
-        # 3x3 conv, 512 inputs, 128 outputs
-        'wc2': tf.Variable(tf.truncated_normal([3, 3, 256, 128], stddev=0.01)),
-        # 3x3 conv, 256 inputs, 64 outputs
-        'wc3': tf.Variable(tf.truncated_normal([3, 3, 128, 64], stddev=0.01)),
-        # 3x3 conv, 128 inputs, 3 outputs
-        'wc4': tf.Variable(tf.truncated_normal([3, 3, 64, 3], stddev=0.01)),
-        # 3x3 conv, 6 inputs, 3 outputs
-        'wc5': tf.Variable(tf.truncated_normal([3, 3, 3, 3], stddev=0.01)),
-        # 3x3 conv, 3 inputs, 2 outputs
-        'wc6': tf.Variable(tf.truncated_normal([3, 3, 3, 2], stddev=0.01)),
-    }
-
-colorimage = input_pipeline(filenames, batch_size, num_epochs=num_epochs)
-colorimage_yuv = rgb2yuv(colorimage)
-
-grayscale = tf.image.rgb_to_grayscale(colorimage)
-grayscale_rgb = tf.image.grayscale_to_rgb(grayscale)
-grayscale_yuv = rgb2yuv(grayscale_rgb)
-grayscale = tf.concat(3, [grayscale, grayscale, grayscale])
-
-tf.import_graph_def(graph_def, input_map={"images": grayscale})
-
-graph = tf.get_default_graph()
-
-with tf.variable_scope('vgg'):
-    conv1_2 = graph.get_tensor_by_name("import/conv1_2/Relu:0")
-    conv2_2 = graph.get_tensor_by_name("import/conv2_2/Relu:0")
-    conv3_3 = graph.get_tensor_by_name("import/conv3_3/Relu:0")
-    conv4_3 = graph.get_tensor_by_name("import/conv4_3/Relu:0")
-
-tensors = {
-    "conv1_2": conv1_2,
-    "conv2_2": conv2_2,
-    "conv3_3": conv3_3,
-    "conv4_3": conv4_3,
-    "grayscale": grayscale,
-    "weights": weights
-}
-
-# Construct model
-pred = colornet(tensors)
-pred_yuv = tf.concat(3, [tf.split(3, 3, grayscale_yuv)[0], pred])
-pred_rgb = yuv2rgb(pred_yuv)
-
-loss = tf.square(tf.sub(pred, tf.concat(
-    3, [tf.split(3, 3, colorimage_yuv)[1], tf.split(3, 3, colorimage_yuv)[2]])))
-
-if uv == 1:
-    loss = tf.split(3, 2, loss)[0]
-elif uv == 2:
-    loss = tf.split(3, 2, loss)[1]
-else:
-    loss = (tf.split(3, 2, loss)[0] + tf.split(3, 2, loss)[1]) / 2
-
-if phase_train is not None:
-    optimizer = tf.train.GradientDescentOptimizer(5*0.0001)
-    opt = optimizer.minimize(
-        loss, global_step=global_step, gate_gradients=optimizer.GATE_NONE)
-
-# Summaries
-tf.summary.histogram("weights1", weights["wc1"])
-tf.summary.histogram("weights2", weights["wc2"])
-tf.summary.histogram("weights3", weights["wc3"])
-tf.summary.histogram("weights4", weights["wc4"])
-tf.summary.histogram("weights5", weights["wc5"])
-tf.summary.histogram("weights6", weights["wc6"])
-tf.summary.histogram("instant_loss", tf.reduce_mean(loss))
-tf.summary.image("colorimage", colorimage, max_outputs=1)
-tf.summary.image("pred_rgb", pred_rgb, max_outputs=1)
-tf.summary.image("grayscale", grayscale_rgb, max_outputs=1)
-
-# Saver.
-saver = tf.train.Saver()
-
-# Create the graph, etc.
-init_op = tf.global_variables_initializer() #tf.initialize_all_variables()
+@contextmanager
+def head_scope(head):
+    """Builds the variables of the given model under a variable scope named
+    after it, or under no scope when training a single model."""
+    if head is None:
+        yield
+    else:
+        with tf.variable_scope(head):
+            yield
+
+
+def head_variables(head):
+    """Returns the variables to save of the given model, named without its
+    scope, so its checkpoint is the same as one of a model that was trained on
+    its own."""
+    if head is None:
+        return dict((var.op.name, var) for var in tf.global_variables())
+    prefix = head + '/'
+    var_list = dict((var.op.name[len(prefix):], var) for var in
+            tf.global_variables() if var.op.name.startswith(prefix))
+    var_list[global_step.op.name] = global_step
+    return var_list
+
+
+def head_path(head, path_format, default):
+    """Returns the path of a file of the given model, which is the default
+    path when training a single model."""
+    return default if head is None else path_format.format(head)
+
+
+# The variables are placed on the parameter servers when training with several
+# processes, and the rest of the graph on this worker
+with tf.device(device_setter(cluster, task_index) if distributed else None):
+    global_step = tf.Variable(0, name='global_step', trainable=False)
+    phase_train = tf.placeholder(tf.bool, name='phase_train')
+
+    graph_def = load_vgg(args.vgg_model_path)
+
+    # Read a batch of images for each model
+    colorimages = []
+    queue_fills = []
+    grayscales = []
+    grayscale_rgbs = []
+    for head in heads:
+        filenames, num_images, image_size = inputs[head]
+        colorimage, queue_fill = input_pipeline(filenames, batch_size,
+                image_size=image_size,
+                num_epochs=None if step_budgets else num_epochs)
+
+        # The models that are done are fed a batch in place of their input,
+        # which leaves their input queue alone, and which is empty when
+        # training in a single process, so that it takes them out of the
+        # shared VGG16 trunk
+        colorimage = tf.placeholder_with_default(colorimage,
+                [None] + colorimage.get_shape().as_list()[1:])
+        colorimages.append(colorimage)
+        queue_fills.append(queue_fill)
+
+        grayscale = tf.image.rgb_to_grayscale(colorimage)
+        grayscale_rgbs.append(tf.image.grayscale_to_rgb(grayscale))
+        grayscales.append(tf.concat(3, [grayscale, grayscale, grayscale]))
+
+    # The VGG16 trunk is frozen, and so the same for every model, so it is run
+    # once over the batches of all of the models, and its features are split
+    # back into a batch per model
+    features = vgg_features(graph_def, tf.concat(0, grayscales))
+    batch_sizes = [tf.shape(grayscale)[0] for grayscale in grayscales]
+    features = dict((layer, split_batches(feature, batch_sizes)) for layer,
+            feature in features.items())
+
+    # Head active is fed with whether each model is still being trained, so
+    # the models that are done are left as they are by the workers, whose
+    # gradients are averaged over the same variables on every step, and whose
+    # models that are done are fed a blank batch
+    head_active = tf.placeholder_with_default(tf.ones([num_heads]),
+            [num_heads], name='head_active')
+
+    pred_rgbs = []
+    mean_losses = []
+    train_losses = []
+    head_summaries = []
+    for i, head in enumerate(heads):
+        colorimage_yuv = rgb2yuv(colorimages[i])
+        grayscale_yuv = rgb2yuv(grayscale_rgbs[i])
+
+        with head_scope(head):
+            weights = colornet_weights()
+
+            tensors = dict((layer, features[layer][i]) for layer in features)
+            tensors["grayscale"] = grayscales[i]
+            tensors["weights"] = weights
+
+            # Construct model
+            pred = colornet(tensors, phase_train)
+        pred_yuv = tf.concat(3, [tf.split(3, 3, grayscale_yuv)[0], pred])
+        pred_rgb = yuv2rgb(pred_yuv)
+        pred_rgbs.append(pred_rgb)
+
+        # The squared errors of the U and V channels, weighted and summed per
+        # pixel, so both channels are trained by the same forward and backward
+        # pass
+        loss = tf.square(tf.sub(pred, tf.concat(3, [
+            tf.split(3, 3, colorimage_yuv)[1],
+            tf.split(3, 3, colorimage_yuv)[2]])))
+        loss = tf.reduce_sum(
+                loss * tf.constant(args.uv_weights, dtype=tf.float32), [3],
+                keep_dims=True)
+        mean_loss = tf.reduce_mean(loss)
+        mean_losses.append(mean_loss)
+
+        # The loss is summed over each image and averaged over the batch, so
+        # that the gradient of a batch is the mean of the gradients of its
+        # images
+        train_losses.append(tf.reduce_sum(loss) / batch_size)
+
+        # Summaries, which are only written for the models being trained
+        num_summaries = len(tf.get_collection(tf.GraphKeys.SUMMARIES))
+        prefix = '' if head is None else head + '_'
+        tf.summary.histogram(prefix + "weights1", weights["wc1"])
+        tf.summary.histogram(prefix + "weights2", weights["wc2"])
+        tf.summary.histogram(prefix + "weights3", weights["wc3"])
+        tf.summary.histogram(prefix + "weights4", weights["wc4"])
+        tf.summary.histogram(prefix + "weights5", weights["wc5"])
+        tf.summary.histogram(prefix + "weights6", weights["wc6"])
+        tf.summary.histogram(prefix + "instant_loss", mean_loss)
+        tf.summary.image(prefix + "colorimage", colorimages[i], max_outputs=1)
+        tf.summary.image(prefix + "pred_rgb", pred_rgb, max_outputs=1)
+        tf.summary.image(prefix + "grayscale", grayscale_rgbs[i],
+                max_outputs=1)
+        head_summaries.append(tf.get_collection(
+                tf.GraphKeys.SUMMARIES)[num_summaries:])
+
+    # The models share no weights, so each one is only trained by its own loss
+    train_loss = tf.reduce_sum(tf.pack(train_losses) * head_active)
+
+    if phase_train is not None:
+        # The gradients of the workers are averaged, so each step trains on
+        # the batches of all of them
+        learning_rate = BASE_LEARNING_RATE * batch_size * num_workers
+        optimizer = tf.train.GradientDescentOptimizer(learning_rate)
+
+        # Update the moving averages of the batch normalization statistics
+        # after every step, so the model can be evaluated with them later
+        update_ops = tf.get_collection(tf.GraphKeys.UPDATE_OPS)
+        if distributed:
+            sync = SyncGradients(optimizer, optimizer.compute_gradients(
+                train_loss, gate_gradients=optimizer.GATE_NONE),
+                global_step, task_index, num_workers, chief_ops=update_ops)
+
+# The summaries are written by the chief with the rest of the telemetry
+telemetry = Telemetry(args.summary_dir) if is_chief else None
+throughput = Throughput()
+
+# Saver. The chief writes the checkpoints of each model in the background.
+final_model_paths = [head_path(head, path.join(args.model_dir, 'model_{}'),
+        args.final_model_path) for head in heads]
+writers = [CheckpointWriter(head_variables(head), args.keep_checkpoints)
+        for head in heads] if is_chief else []
+
+# The checkpoints to resume each model from, if there are any
+if args.resume and is_chief:
+    resume_paths = [latest_checkpoint(model_path) for model_path in
+            final_model_paths]
+    restorers = [tf.train.Saver(head_variables(head)) for head in heads]
+    resume_step = tf.placeholder(tf.int32, name='resume_step')
+    set_step = global_step.assign(resume_step)
+summary_dirs = [head_path(head, path.join(args.summary_dir, '{}'),
+        args.summary_dir) for head in heads]
+
+# The number of steps to train each model for, when training for a number of
+# steps, where each step trains on a batch from every worker
+head_steps = [max(1, int(num_epochs * inputs[head][1]) //
+        (batch_size * num_workers)) for head in heads]
+
+# The sets of models that are trained together as the models are done, as
+# whether each model is still being trained, which only changes at the step
+# budget of a model
+active_sets = set(tuple(not step_budgets or step < head_steps[i] for i in
+        range(num_heads)) for step in [0] + head_steps)
+active_sets = [active_set for active_set in active_sets if any(active_set)]
+
+
+def build_train_op(trained):
+    """Returns a training step of the given models, which only runs and
+    back-propagates those models, and only updates their batch
+    normalization averages."""
+    var_list = None
+    step_update_ops = update_ops
+    if len(trained) < num_heads:
+        prefixes = tuple(heads[i] + '/' for i in trained)
+        var_list = [var for var in tf.trainable_variables()
+                if var.op.name.startswith(prefixes)]
+        step_update_ops = [op for op in update_ops
+                if op.name.startswith(prefixes)]
+    train_op = optimizer.minimize(
+        tf.add_n([train_losses[i] for i in trained]),
+        global_step=global_step, var_list=var_list,
+        gate_gradients=optimizer.GATE_NONE)
+    with tf.control_dependencies([train_op]):
+        return tf.group(*step_update_ops)
+
+
+# The summaries and, when training in a single process, the training step of
+# each set of models, built up front, so nothing is added to the graph once
+# training starts
+common_summaries = set(tf.get_collection(tf.GraphKeys.SUMMARIES)).difference(
+        summary for summaries in head_summaries for summary in summaries)
+summary_ops = dict()
+train_ops = dict()
+for active_set in active_sets:
+    trained = [i for i in range(num_heads) if active_set[i]]
+    summary_ops[active_set] = tf.summary.merge(list(common_summaries) + [
+            summary for i in trained for summary in head_summaries[i]])
+    if not distributed:
+        train_ops[active_set] = build_train_op(trained)
+
+# Create the graph, etc. The global step is initialized last, after the models
+# are restored, since the other workers wait for every variable to be set
+init_op = tf.variables_initializer([var for var in tf.global_variables()
+        if var is not global_step])
+init_step_op = tf.variables_initializer([global_step])
 init_op2 = tf.local_variables_initializer() # tf.initialize_local_variables()
 
 # Create a session for running operations in the Graph.
-sess = tf.Session()
+sess = tf.Session(server.target if distributed else '', config=config)
 
-# Initialize the variables.
-sess.run(init_op)
+# Initialize the variables, which the chief does for all of the workers
+if distributed:
+    sync.initialize(sess, init_op)
+else:
+    sess.run(init_op)
+
+if args.resume and is_chief:
+    # Restore the models, and continue from the latest step of any of them
+    restored_steps = [0]
+    for head, restorer, resume_path in zip(heads, restorers, resume_paths):
+        if resume_path is None:
+            print("No model to resume the {} model from".format(head or
+                    "trained"))
+            continue
+        restorer.restore(sess, resume_path)
+        restored_steps.append(saved_step(resume_path) or 0)
+        print("Resumed the {} model from '{}'".format(head or "trained",
+                resume_path))
+    sess.run(set_step, feed_dict={resume_step: max(restored_steps)})
+elif is_chief:
+    sess.run(init_step_op)
 sess.run(init_op2)
 
 # Start input enqueue threads.
 coord = tf.train.Coordinator()
 threads = tf.train.start_queue_runners(sess=sess, coord=coord)
 
-# Create the summary directory if it doesn't exist
-if not path.exists(args.summary_dir):
-    makedirs(args.summary_dir)
+# Create the summary and model directories if they don't exist
+for directory in summary_dirs + ([args.model_dir] if args.ensemble else []):
+    if is_chief and not path.exists(directory):
+        makedirs(directory)
 
-num_images = len(filenames)
 print('Beginning training...')
-print("Found {} images under the '{}' directory".format(num_images,
-        args.image_dir))
+if distributed:
+    print("Training as worker {} of {}".format(task_index, num_workers))
+for head in heads:
+    print("Found {} images under the '{}' directory{}".format(inputs[head][1],
+            args.image_dir, '' if head is None else ' for the ' + head +
+            ' model'))
+print("Training {} images per step with a learning rate of {}".format(
+        batch_size * num_workers, learning_rate))
+
+
+def save_final_model(i):
+    # Only the chief saves the models, which all of the workers share
+    if is_chief:
+        model_path = writers[i].save(sess, final_model_paths[i])
+        print("Saving final model to '{}'".format(model_path))
+
+
+step = start_step = sess.run(global_step)
+start_time = time.time()
+
+# The models that are already done are not trained any further when resuming
+active = [not step_budgets or step < head_steps[i] for i in range(num_heads)]
+
+# The batch fed in place of the input of the models that are done, which is
+# empty when training in a single process, and blank with several workers,
+# whose gradients are averaged over every model
+image_shape = colorimages[0].get_shape().as_list()[1:]
+done_batch = np.zeros([batch_size if distributed else 0] + image_shape,
+        np.float32)
+
+logged_losses = []
+num_trained = 0
 try:
-    while not coord.should_stop():
-        # Run training steps
-        training_opt = sess.run(opt, feed_dict={phase_train: True, uv: 1})
-        training_opt = sess.run(opt, feed_dict={phase_train: True, uv: 2})
-
-        step = sess.run(global_step)
-
-        if step % 1 == 0:
-            pred_, pred_rgb_, colorimage_, grayscale_rgb_, cost = sess.run(
-                [pred, pred_rgb, colorimage, grayscale_rgb, loss], feed_dict={phase_train: False, uv: 3})
-            print ("step", step, "cost", np.mean(cost))
-
-        if step % image_save_rate == 0:
-            summary_image = concat_images(grayscale_rgb_[0], pred_rgb_[0])
-            summary_image = concat_images(summary_image, colorimage_[0])
-            summary_path = path.join(args.summary_dir, "{}_{}".format(
-                    step / num_images, step % num_images))
-            plt.imsave(summary_path + ".jpg", summary_image)
-            print("Image summary saved to file '{}'".format(summary_path +
-                    ".jpg"))
-
-        if (step % model_save_rate == 0) and (step != 0):
-            save_path = saver.save(sess, "model.ckpt")
-            print("Model saved to file '{}'".format(save_path))
+    while (not coord.should_stop() and any(active) and
+            (args.max_steps is None or step < args.max_steps)):
+        step += 1
+        step_start = time.time()
+
+        # Only the models that are still being trained take their input
+        trained = [i for i in range(num_heads) if active[i]]
+        feed_dict = {phase_train: True}
+        for i in range(num_heads):
+            if not active[i]:
+                feed_dict[colorimages[i]] = done_batch
+        if distributed:
+            feed_dict[head_active] = [float(is_active) for is_active in
+                    active]
+
+        # The input batches are taken off their queues within the training
+        # step. On the first timed step, and every summary_rate steps, they
+        # are taken off in a run of their own and fed to the training step
+        # instead, which samples the time spent waiting on them
+        time_input = step == start_step + 2 or step % summary_rate == 0
+        input_time = None
+        if time_input:
+            feed_dict.update(zip([colorimages[i] for i in trained],
+                    sess.run([colorimages[i] for i in trained])))
+            input_time = time.time() - step_start
+
+        # Run a training step, fetching its summaries and images only when
+        # they are written
+        write_summary = is_chief and step % summary_rate == 0
+        save_image = is_chief and step % image_save_rate == 0
+        fetches = [[mean_losses[i] for i in trained],
+                [queue_fills[i] for i in trained]]
+        if write_summary:
+            fetches += [summary_ops[tuple(active)]]
+        if save_image:
+            fetches += [[tensors[i] for i in trained] for tensors in
+                    (pred_rgbs, grayscale_rgbs, colorimages)]
+        if distributed:
+            results = sync.run(sess, fetches, feed_dict)
+        else:
+            results = sess.run([train_ops[tuple(active)]] + fetches,
+                    feed_dict)[1:]
+        step_time = time.time() - step_start
+        fill = np.mean(results[1])
+        losses = dict(zip(trained, results[0]))
+
+        # Time training from the end of the first step, which sets things up
+        step_images = batch_size * len(trained) * num_workers
+        if step == start_step + 1:
+            start_time = time.time()
+        else:
+            throughput.add(step_time, input_time, fill, step_images)
+            num_trained += step_images
+
+        logged_losses.append(losses)
+        if is_chief:
+            scalars = {
+                'step/wall_time': step_time,
+                'step/queue_fill': fill,
+            }
+            if input_time is not None:
+                scalars['step/input_wait'] = input_time
+            for i, cost in losses.items():
+                scalars[head_path(heads[i], '{}/loss', 'loss')] = cost
+            telemetry.add_scalars(scalars, step)
+            if write_summary:
+                telemetry.add_summary(results[2], step)
+
+        if is_chief and step % log_rate == 0 and throughput.step_times:
+            costs = dict((i, np.mean([step_losses[i] for step_losses in
+                    logged_losses if i in step_losses])) for i in trained)
+            if args.ensemble:
+                cost = ", ".join("{} {}".format(heads[i], costs[i]) for i in
+                        trained)
+            else:
+                cost = costs[0]
+            metrics = throughput.report()
+            print("step", step, "cost", cost, "({:.1f} images/s, {:.0%} of "
+                    "the time waiting on input, input queues {:.0%} "
+                    "full)".format(metrics['throughput/images_per_sec'],
+                    metrics['throughput/input_wait_fraction'],
+                    metrics['throughput/queue_fill']))
+            telemetry.add_scalars(metrics, step)
+            logged_losses = []
+
+        for position, i in enumerate(trained):
+            head = heads[i]
+            if save_image:
+                pred_rgb_, grayscale_rgb_, colorimage_ = (images[position]
+                        for images in results[-3:])
+                summary_image = concat_images(grayscale_rgb_[0], pred_rgb_[0])
+                summary_image = concat_images(summary_image, colorimage_[0])
+                num_images = inputs[head][1]
+                images_seen = step * batch_size * num_workers
+                summary_path = path.join(summary_dirs[i], "{}_{}".format(
+                        images_seen // num_images, images_seen % num_images))
+                telemetry.save_image(summary_path + ".jpg", summary_image)
+
+            if is_chief and step % model_save_rate == 0:
+                save_path = writers[i].save(sess, final_model_paths[i], step)
+                print("Saving model to file '{}'".format(save_path))
+
+            # Save each model as soon as it is done
+            if step_budgets and step >= head_steps[i]:
+                print("Done training the {} model".format(head))
+                save_final_model(i)
+                active[i] = False
 
 except tf.errors.OutOfRangeError:
     print('Done training -- epoch limit reached')
 except KeyboardInterrupt:
     print('Training stopped at the request of the user')
 finally:
+    # Training ends here, before the final models are saved and the
+    # telemetry is flushed
+    end_time = time.time()
+
     # When done, ask the threads to stop.
     coord.request_stop()
-    # Save the final model
-    model_path = saver.save(sess, args.final_model_path)
-    print("Saving final model to '{}'".format(model_path))
+    # Save the final models that are not saved yet
+    for i in range(num_heads):
+        if active[i]:
+            save_final_model(i)
+
+    # Wait for the models and the telemetry to be written
+    for writer in writers:
+        writer.close()
+    if telemetry is not None:
+        telemetry.close()
+
+# Report the throughput of the timed steps, over all of the workers
+num_steps = step - start_step - 1
+if is_chief and num_steps > 0:
+    elapsed = end_time - start_time
+    print("Trained {} images in {:.1f} seconds ({:.1f} images/s)".format(
+            num_trained, elapsed, num_trained / elapsed))
 
 # Wait for threads to finish.
 coord.join(threads)
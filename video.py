@@ -0,0 +1,134 @@
+"""
+Streaming colorization of video.
+
+Running the ensemble over every frame would take four VGG16 and colornet
+passes per frame, but the colors of a shot barely change from one frame to
+the next. So only keyframes are run through the ensemble: the first frame of
+each scene, and every keyframe_interval-th frame within a scene after that.
+The chroma of the frames in between is interpolated over time from the
+keyframes on either side of them, or, where the next keyframe starts a new
+scene, reused from the keyframe before them. Every frame keeps its own
+luminance, so only the color is shared.
+
+A scene change is a jump in the histogram of the luminance between two
+consecutive frames.
+
+The frames are read from a generator and written out as they are done. Frames
+are held from one keyframe up to batch_size keyframes later, so that the
+keyframes are run through the ensemble a batch at a time.
+
+Use:
+    for frame, keyframe in colorize_stream(engine, frames):
+        (frame is the colorized uint8 frame)
+"""
+
+import numpy as np
+
+# The most frames from one keyframe to the next within a scene
+KEYFRAME_INTERVAL = 8
+
+# The fraction of the luminance histogram that has to change between two
+# frames for the second to start a new scene
+SCENE_THRESHOLD = 0.3
+
+# The number of bins of the luminance histograms compared for scene changes
+HISTOGRAM_BINS = 32
+
+# The default number of keyframes run through the ensemble at once
+KEYFRAME_BATCH_SIZE = 4
+
+# The weights of the RGB channels in the luminance of model.rgb2yuv
+LUMA_WEIGHTS = np.array([0.299, 0.587, 0.114])
+
+
+def luma_histogram(frame):
+    """Returns the normalized histogram of the luminance of the given uint8
+    RGB frame, over a quarter of its pixels in each dimension."""
+    luma = np.dot(frame[::4, ::4], LUMA_WEIGHTS)
+    histogram = np.histogram(luma, HISTOGRAM_BINS, (0, 256))[0]
+    return histogram / float(max(histogram.sum(), 1))
+
+
+def mark_keyframes(frames, keyframe_interval=KEYFRAME_INTERVAL,
+        scene_threshold=SCENE_THRESHOLD):
+    """Yields each of the given frames as (frame, keyframe, cut), where
+    keyframe is set for the frames to run the ensemble over, and cut for the
+    frames that start a new scene."""
+    previous = None
+    last_keyframe = 0
+    for index, frame in enumerate(frames):
+        histogram = luma_histogram(frame)
+        cut = (previous is not None and
+                bool(np.abs(histogram - previous).sum() / 2 > scene_threshold))
+        keyframe = (previous is None or cut or
+                index - last_keyframe >= keyframe_interval)
+        if keyframe:
+            last_keyframe = index
+        previous = histogram
+        yield frame, keyframe, cut
+
+
+def interpolate_chroma(marked, keyframe_chroma, end):
+    """Returns the chroma of the first end of the given marked frames, given
+    the chroma of their keyframes by index, where the first frame is a
+    keyframe. Frames between two keyframes of the same scene are linearly
+    interpolated between them, and the others reuse the keyframe before
+    them."""
+    indices = sorted(keyframe_chroma)
+    chroma = []
+    for index in range(end):
+        before = max(i for i in indices if i <= index)
+        after = [i for i in indices if i > index]
+        if index == before or not after or marked[after[0]][2]:
+            chroma.append(keyframe_chroma[before])
+        else:
+            weight = (index - before) / float(after[0] - before)
+            chroma.append((1 - weight) * keyframe_chroma[before] +
+                    weight * keyframe_chroma[after[0]])
+    return chroma
+
+
+def colorize_stream(engine, frames, batch_size=KEYFRAME_BATCH_SIZE,
+        keyframe_interval=KEYFRAME_INTERVAL, scene_threshold=SCENE_THRESHOLD):
+    """Colorizes the given uint8 RGB frames, which have the same size, with
+    the given ColorizationEngine, yielding each as (frame, keyframe), where
+    keyframe is set for the frames that the ensemble was run over."""
+    # The frames that are not written yet, from the last keyframe with its
+    # chroma on, and the chroma of the keyframes among them by index
+    marked = []
+    keyframe_chroma = dict()
+
+    def flush(final):
+        pending = [index for index, (_, keyframe, _) in enumerate(marked)
+                if keyframe and index not in keyframe_chroma]
+        if pending:
+            chroma = engine.frame_chroma([marked[i][0] for i in pending])
+            keyframe_chroma.update(zip(pending, chroma))
+
+        # The frames after the last keyframe wait for the next one, unless
+        # there are no more
+        end = len(marked) if final else max(keyframe_chroma)
+        chroma = interpolate_chroma(marked, keyframe_chroma, end)
+        for start in range(0, end, batch_size):
+            batch = marked[start:min(start + batch_size, end)]
+            rgb = engine.recolor([frame for frame, _, _ in batch],
+                    chroma[start:start + len(batch)])
+            for frame, (_, keyframe, _) in zip(rgb, batch):
+                yield frame, keyframe
+
+        kept = dict((index - end, value) for index, value in
+                keyframe_chroma.items() if index >= end)
+        del marked[:end]
+        keyframe_chroma.clear()
+        keyframe_chroma.update(kept)
+
+    for entry in mark_keyframes(frames, keyframe_interval, scene_threshold):
+        marked.append(entry)
+        num_pending = sum(1 for index, (_, keyframe, _) in enumerate(marked)
+                if keyframe and index not in keyframe_chroma)
+        if num_pending == batch_size:
+            for output in flush(False):
+                yield output
+    if marked:
+        for output in flush(True):
+            yield output